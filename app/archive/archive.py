@@ -3,14 +3,20 @@ import re
 import time
 
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from utils.log import mainLog
 from utils.date_utils import get_current_date
-from utils.backup_utils import get_last_date_path, create_tar_gz_archive
+from utils.backup_utils import get_last_date_path, create_tar_archive
 from utils.logging_tools import log_execution
 from utils.fs_utils import create_archive_dir, get_list_dirs, get_list_files
 from notify.tg import send_telegram_message
+from archive.indexed import create_indexed_archive, get_index_path
 
 from config.const import LOCAL_DIST, LOCAL_DIST_ARCHIVE, ARCHIVE_SERVER_TAG, ARCHIVE_LIFETIME_SECS
+from config.const import ARCHIVE_FORMAT, ARCHIVE_THREADS_PER_JOB, ARCHIVE_CPU_BUDGET, ARCHIVE_INDEX_ENABLE
+
+# Формат архива -> расширение файла
+ARCHIVE_EXTENSIONS = {"gz": "tar.gz", "zst": "tar.zst"}
 
 
 def remove_outdated_archive():
@@ -18,11 +24,11 @@ def remove_outdated_archive():
         Удаляет архивы из директории LOCAL_DIST_ARCHIVE, которые старше заданного срока хранения ARCHIVE_LIFETIME_SECS.
 
         Логика работы:
-        - Получает список файлов с расширением .tar.gz в архивной директории.
-        - Фильтрует файлы по строгому шаблону имени: <слово>.<слово>.<ГГГГ-ММ-ДД>.tar.gz.
+        - Получает список файлов в архивной директории.
+        - Фильтрует файлы по строгому шаблону имени: <слово>.<слово>.<ГГГГ-ММ-ДД>.tar.gz или .tar.zst.
         - Проверяет значение ARCHIVE_LIFETIME_SECS из конфигурации, если оно меньше 6 месяцев (15778463 секунд), удаление отменяется с логированием и уведомлением.
         - Для каждого подходящего файла извлекает дату из имени и преобразует в timestamp.
-        - Удаляет файлы с датой старше текущего времени минус ARCHIVE_LIFETIME_SECS.
+        - Удаляет файлы с датой старше текущего времени минус ARCHIVE_LIFETIME_SECS вместе с индексом <архив>.idx.
         - Логирует удаление каждого файла.
 
         Особенности:
@@ -30,10 +36,10 @@ def remove_outdated_archive():
         - Использует логирование и отправку уведомлений при ошибках конфигурации.
     """
 
-    accounts_archive_list = get_list_files(LOCAL_DIST_ARCHIVE, "tar.gz")
+    accounts_archive_list = get_list_files(LOCAL_DIST_ARCHIVE)
 
     # Дополнительная проверка названия файла
-    account_archive_pattern = re.compile(r'^\w+\.\w+\.\d{4}-\d{2}-\d{2}\.tar\.gz$')
+    account_archive_pattern = re.compile(r'^\w+\.\w+\.\d{4}-\d{2}-\d{2}\.tar\.(gz|zst)$')
     accounts_archive_list = [f for f in accounts_archive_list if account_archive_pattern.match(f)]
 
     # (Защита от дурака) значение в конфигурации менее 6 месяцев.
@@ -49,22 +55,30 @@ def remove_outdated_archive():
         
         if (more_then > archive_timestamp):
             os.remove(f"{LOCAL_DIST_ARCHIVE}/{archive}")
+
+            if os.path.exists(get_index_path(f"{LOCAL_DIST_ARCHIVE}/{archive}")):
+                os.remove(get_index_path(f"{LOCAL_DIST_ARCHIVE}/{archive}"))
+
             mainLog.info(f"[remove_outdated_archive] {LOCAL_DIST_ARCHIVE}/{archive} удален.")
 
 
 @log_execution
 def create_account_archive(last_available_backup_path, username):
     """
-        Создает tar.gz архив для указанного аккаунта из последней доступной резервной копии.
+        Создает архив (ARCHIVE_FORMAT) для указанного аккаунта из последней доступной резервной копии.
 
         :param last_available_backup_path: Путь к директории с последней доступной резервной копией.
         :param username: Имя пользователя (аккаунта), для которого создается архив.
         :return: None. В случае ошибки логирует и отправляет уведомление в Telegram.
     """
     account_source_path = f"{last_available_backup_path}/{username}"
-    account_distance_archive_path = f"{LOCAL_DIST_ARCHIVE}/{ARCHIVE_SERVER_TAG}.{username}.{get_current_date()}.tar.gz"
+    account_distance_archive_path = f"{LOCAL_DIST_ARCHIVE}/{ARCHIVE_SERVER_TAG}.{username}.{get_current_date()}.{ARCHIVE_EXTENSIONS[ARCHIVE_FORMAT]}"
 
-    status = create_tar_gz_archive(account_source_path, account_distance_archive_path)
+    # Архив gz с индексом: извлечение отдельных файлов без распаковки всего архива (archive/indexed.py)
+    if ARCHIVE_FORMAT == "gz" and ARCHIVE_INDEX_ENABLE:
+        status = create_indexed_archive(account_source_path, account_distance_archive_path, ARCHIVE_THREADS_PER_JOB)
+    else:
+        status = create_tar_archive(account_source_path, account_distance_archive_path, ARCHIVE_FORMAT, ARCHIVE_THREADS_PER_JOB)
 
     if not status:
         mainLog.error(f"[create_account_archive] При создании архива для аккаунта {username} из директории {last_available_backup_path} произошла ошибка.")
@@ -98,7 +112,8 @@ def backup_removed_account():
         - Создаёт директорию для хранения архивов (если её нет).
         - Определяет путь к последней доступной резервной копии.
         - Получает список аккаунтов, которые были удалены (присутствуют в старой резервной копии, но отсутствуют в текущей).
-        - Для каждого удалённого аккаунта создаёт архив.
+        - Для каждого удалённого аккаунта создаёт архив, одновременно не более
+          ARCHIVE_CPU_BUDGET // ARCHIVE_THREADS_PER_JOB архивов.
 
         Если не удаётся найти последнюю резервную копию, процесс архивации отменяется.
 
@@ -119,6 +134,9 @@ def backup_removed_account():
     if accounts_removed_list:
         mainLog.info(f"[backup_removed_account] Обнаружено {len(accounts_removed_list)} удаленных аккаунтов для архивации.")
 
-    # Создает архив для каждого из удаленных аккаунтов.
-    for username in accounts_removed_list:
-        create_account_archive(last_available_backup_path, username)
\ No newline at end of file
+    # Создает архив для каждого из удаленных аккаунтов, суммарное количество потоков сжатия не превышает ARCHIVE_CPU_BUDGET
+    with ThreadPoolExecutor(max_workers=max(1, ARCHIVE_CPU_BUDGET // ARCHIVE_THREADS_PER_JOB)) as executor:
+        jobs = [executor.submit(create_account_archive, last_available_backup_path, username) for username in accounts_removed_list]
+
+        for job in jobs:
+            job.result()
\ No newline at end of file
@@ -0,0 +1,375 @@
+"""
+    Архивы с индексом для восстановления отдельных файлов без распаковки всего архива.
+
+    Архив — tar, сжатый независимыми gzip-блоками (фреймами) по ARCHIVE_INDEX_FRAME_SIZE байт
+    несжатых данных: конкатенация gzip-потоков, читается обычным tar xzf. Фреймы сжимаются
+    параллельно. Рядом создаётся индекс <архив>.idx (gzip, JSON-строки):
+        - первая строка: {"version", "frames": [[несжатое смещение, сжатое смещение, сжатый размер]]}
+        - далее по строке на запись tar: {"name", "type", "size", "link", "start", "end"}
+          (start, end — смещения заголовка и конца данных записи в несжатом tar).
+
+    Директории записываются обходом в глубину, поэтому содержимое директории занимает непрерывный
+    диапазон архива. Извлечение читает только фреймы, покрывающие диапазон записи.
+
+    Запуск из директории app:
+        python3 archive/indexed.py list <архив>
+        python3 archive/indexed.py extract <архив> <путь в архиве> <директория>
+"""
+import os
+import sys
+import gzip
+import json
+import bisect
+import tarfile
+import argparse
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.log import mainLog
+
+from config.const import ARCHIVE_COMPRESS_LEVEL, ARCHIVE_INDEX_FRAME_SIZE
+
+INDEX_VERSION = 1
+
+
+def get_index_path(archive_path: str) -> str:
+    return f"{archive_path}.idx"
+
+
+def compress_frame(data: bytes, level: int) -> bytes:
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class FrameWriter:
+    """
+        Файловый объект для tarfile: несжатые данные делятся на фреймы, которые сжимаются в пуле потоков
+        и записываются в файл по порядку (в обработке не более 2 * threads фреймов).
+    """
+
+    def __init__(self, fileobj, threads: int, level: int = ARCHIVE_COMPRESS_LEVEL, frame_size: int = ARCHIVE_INDEX_FRAME_SIZE):
+        self.fileobj = fileobj
+        self.threads = threads
+        self.level = level
+        self.frame_size = frame_size
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.buffer = bytearray()
+        self.inflight = deque()
+        self.position = 0
+        self.frame_start = 0
+        self.compressed = 0
+        self.frames = []
+
+    def tell(self) -> int:
+        return self.position
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        self.position += len(data)
+
+        while len(self.buffer) >= self.frame_size:
+            self.submit(bytes(self.buffer[:self.frame_size]))
+            del self.buffer[:self.frame_size]
+
+        return len(data)
+
+    def submit(self, chunk: bytes) -> None:
+        self.inflight.append((self.frame_start, self.executor.submit(compress_frame, chunk, self.level)))
+        self.frame_start += len(chunk)
+
+        while len(self.inflight) > self.threads * 2:
+            self.write_frame()
+
+    def write_frame(self) -> None:
+        offset, future = self.inflight.popleft()
+        data = future.result()
+
+        self.fileobj.write(data)
+        self.frames.append([offset, self.compressed, len(data)])
+        self.compressed += len(data)
+
+    def close(self) -> None:
+        if self.buffer:
+            self.submit(bytes(self.buffer))
+            self.buffer.clear()
+
+        while self.inflight:
+            self.write_frame()
+
+        self.executor.shutdown()
+
+
+class IndexedArchiveWriter:
+    """ Создаёт архив директории source_dir (имена записей начинаются с её имени, как у tar -C parent name). """
+
+    def __init__(self, source_dir: str, archive_path: str, threads: int):
+        self.source_dir = source_dir.rstrip("/")
+        self.archive_path = archive_path
+        self.threads = threads
+        self.members = []
+
+    def run(self) -> dict:
+        base_name = os.path.basename(self.source_dir)
+
+        with open(f"{self.archive_path}.tmp", "wb") as f:
+            writer = FrameWriter(f, self.threads)
+
+            try:
+                with tarfile.open(fileobj=writer, mode="w", format=tarfile.PAX_FORMAT) as tar:
+                    self.add(tar, self.source_dir, base_name)
+            finally:
+                writer.close()
+
+        with gzip.open(f"{get_index_path(self.archive_path)}.tmp", "wt", compresslevel=6) as f:
+            f.write(json.dumps({"version": INDEX_VERSION, "frames": writer.frames}) + "\n")
+
+            for member in self.members:
+                f.write(json.dumps(member) + "\n")
+
+        os.replace(f"{self.archive_path}.tmp", self.archive_path)
+        os.replace(f"{get_index_path(self.archive_path)}.tmp", get_index_path(self.archive_path))
+
+        return {"members": len(self.members), "frames": len(writer.frames), "size": writer.position, "compressed": writer.compressed}
+
+    def add(self, tar: tarfile.TarFile, path: str, arcname: str) -> None:
+        """ Добавляет запись и, для директории, её содержимое (обход в глубину, имена по порядку). """
+        try:
+            tarinfo = tar.gettarinfo(path, arcname)
+        except OSError as exc:
+            # Аналог tar --ignore-failed-read
+            mainLog.warning(f"[IndexedArchiveWriter] Пропущен {path}: {exc}")
+            return
+
+        if tarinfo is None:
+            return
+
+        start = tar.offset
+
+        try:
+            if tarinfo.isreg():
+                with open(path, "rb") as f:
+                    tar.addfile(tarinfo, f)
+            else:
+                tar.addfile(tarinfo)
+        except OSError as exc:
+            mainLog.warning(f"[IndexedArchiveWriter] Пропущен {path}: {exc}")
+            return
+
+        self.members.append({"name": tarinfo.name, "type": tarinfo.type.decode(), "size": tarinfo.size,
+                             "link": tarinfo.linkname, "start": start, "end": tar.offset})
+
+        if tarinfo.isdir():
+            try:
+                names = sorted(os.listdir(path))
+            except OSError as exc:
+                mainLog.warning(f"[IndexedArchiveWriter] Директория недоступна {path}: {exc}")
+                return
+
+            for name in names:
+                self.add(tar, f"{path}/{name}", f"{arcname}/{name}")
+
+
+def create_indexed_archive(source_dir: str, archive_path: str, threads: int) -> bool:
+    """
+    Создаёт архив с индексом (см. описание модуля).
+
+    :param source_dir: Путь к директории, содержимое которой нужно архивировать.
+    :param archive_path: Путь к создаваемому архиву (.tar.gz), индекс — <archive_path>.idx.
+    :param threads: Количество потоков сжатия.
+    :return: True при успехе, False при ошибке.
+    """
+    try:
+        stats = IndexedArchiveWriter(source_dir, archive_path, threads).run()
+    except Exception as exc:
+        mainLog.error(f"[create_indexed_archive] Ошибка при создании архива {archive_path} из {source_dir}: {exc}")
+
+        for path in (f"{archive_path}.tmp", f"{get_index_path(archive_path)}.tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+        return False
+
+    mainLog.debug(f"[create_indexed_archive] {archive_path}: {stats}")
+    return True
+
+
+#### RESTORE API ####
+def read_index(archive_path: str):
+    """ Возвращает (фреймы, итератор записей) индекса архива. """
+    f = gzip.open(get_index_path(archive_path), "rt")
+    header = json.loads(f.readline())
+
+    if header.get("version") != INDEX_VERSION:
+        f.close()
+        raise ValueError(f"Неподдерживаемая версия индекса {get_index_path(archive_path)}: {header.get('version')}")
+
+    def members():
+        with f:
+            for line in f:
+                yield json.loads(line)
+
+    return header["frames"], members()
+
+
+def list_archive(archive_path: str) -> list:
+    """
+    Список записей архива по индексу, без чтения архива.
+
+    :return: Список словарей {name, type, size, link, start, end}.
+    """
+    _, members = read_index(archive_path)
+    return list(members)
+
+
+class FrameReader:
+    """ Чтение несжатого tar начиная со смещения start: распаковываются только нужные фреймы. """
+
+    def __init__(self, archive_path: str, frames: list, start: int):
+        self.file = open(archive_path, "rb")
+        self.frames = frames
+        self.index = bisect.bisect_right([frame[0] for frame in frames], start) - 1
+        self.skip = start - frames[self.index][0]
+        self.buffer = b""
+        self.position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while (size < 0 or len(self.buffer) - self.position < size) and self.index < len(self.frames):
+            _, offset, length = self.frames[self.index]
+            self.file.seek(offset)
+            data = gzip.decompress(self.file.read(length))
+
+            self.buffer = self.buffer[self.position:] + data[self.skip:]
+            self.position = 0
+            self.skip = 0
+            self.index += 1
+
+        end = len(self.buffer) if size < 0 else self.position + size
+        data = self.buffer[self.position:end]
+        self.position += len(data)
+        return data
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def find_members(archive_path: str, path: str):
+    """
+    Находит запись path и, для директории, все вложенные записи.
+
+    :return: (фреймы, список записей) — записи занимают непрерывный диапазон архива.
+    """
+    frames, members = read_index(archive_path)
+    path = path.strip("/")
+    found = []
+
+    for member in members:
+        if member["name"] == path or member["name"].startswith(f"{path}/"):
+            found.append(member)
+        elif found:
+            break
+
+    return frames, found
+
+
+def find_link_targets(archive_path: str, names: set) -> dict:
+    """ Записи индекса с именами names (цели жёстких ссылок): {имя: запись}. """
+    _, members = read_index(archive_path)
+    return {member["name"]: member for member in members if member["name"] in names}
+
+
+def extract_members(archive_path: str, frames: list, members: list, dest_dir: str, outside_links: list) -> int:
+    """
+    Извлекает записи непрерывного диапазона members. Жёсткие ссылки на файлы вне диапазона
+    не извлекаются, а добавляются в outside_links.
+
+    :return: Количество прочитанных записей.
+    """
+    reader = FrameReader(archive_path, frames, members[0]["start"])
+    names = {member["name"] for member in members}
+    extract_filter = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+    count = 0
+
+    try:
+        with tarfile.open(fileobj=reader, mode="r|") as tar:
+            for tarinfo in tar:
+                if count == len(members):
+                    break
+
+                member = members[count]
+                tarinfo.name = member["name"]
+                count += 1
+
+                if tarinfo.islnk() and tarinfo.linkname not in names:
+                    outside_links.append(member)
+                    continue
+
+                try:
+                    tar.extract(tarinfo, dest_dir, **extract_filter)
+                except (OSError, KeyError, tarfile.TarError) as exc:
+                    mainLog.warning(f"[extract_from_archive] Не удалось извлечь {tarinfo.name}: {exc}")
+    finally:
+        reader.close()
+
+    return count
+
+
+def extract_from_archive(archive_path: str, path: str, dest_dir: str) -> int:
+    """
+    Извлекает из архива файл или директорию path в dest_dir (с путём внутри архива).
+    Читаются только фреймы, покрывающие записи path, время не зависит от размера архива.
+
+    Жёсткие ссылки на файлы вне path извлекаются как обычные файлы с данными файла,
+    на который они указывают (читаются фреймы этого файла).
+
+    :param path: Путь внутри архива, например 'user/homedir/public_html/index.php'.
+    :return: Количество прочитанных записей.
+    """
+    frames, members = find_members(archive_path, path)
+
+    if not members:
+        raise FileNotFoundError(f"{path} не найден в индексе {get_index_path(archive_path)}")
+
+    outside_links = []
+    count = extract_members(archive_path, frames, members, dest_dir, outside_links)
+
+    if outside_links:
+        targets = find_link_targets(archive_path, {member["link"] for member in outside_links})
+
+        for member in outside_links:
+            target = targets.get(member["link"])
+
+            if not target:
+                mainLog.warning(f"[extract_from_archive] Не найден файл {member['link']} жёсткой ссылки {member['name']}")
+                continue
+
+            extract_members(archive_path, frames, [dict(target, name=member["name"])], dest_dir, [])
+
+    return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Индексированные архивы удалённых аккаунтов")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list")
+    list_parser.add_argument("archive")
+
+    extract_parser = subparsers.add_parser("extract")
+    extract_parser.add_argument("archive")
+    extract_parser.add_argument("path")
+    extract_parser.add_argument("dest")
+
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for member in list_archive(args.archive):
+            print(f"{member['type']} {member['size']:>14} {member['name']}")
+    else:
+        print(f"Извлечено записей: {extract_from_archive(args.archive, args.path, args.dest)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+    Сравнение копирования дерева hardlink'ами: rsync -a --delete --link-dest (run_rsync_suspended)
+    и clone_tree (utils/hardlink_clone.py) на синтетическом дереве.
+
+    Запуск из директории app:
+        python3 bench/clone_benchmark.py --path /backup1/bench --dirs 200 --files 500 --depth 3
+
+    Каталог --path должен находиться на той же файловой системе, что и LOCAL_DIST, и будет создан заново.
+"""
+import os
+import sys
+import shutil
+import argparse
+import subprocess
+
+from time import monotonic
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.hardlink_clone import HardlinkClone
+
+
+def create_tree(root: str, dirs: int, files: int, depth: int, size: int) -> int:
+    """ Создаёт dirs директорий (вложенность до depth) по files файлов размера size. """
+    payload = os.urandom(size)
+    count = 0
+
+    for index in range(dirs):
+        path = root
+
+        for level in range(index % depth + 1):
+            path = f"{path}/d{index % (level + 7)}_{level}"
+
+        path = f"{path}/leaf{index}"
+        os.makedirs(path)
+
+        for number in range(files):
+            with open(f"{path}/f{number}", "wb") as f:
+                f.write(payload)
+            count += 1
+
+        os.symlink("f0", f"{path}/link")
+
+    return count
+
+
+def measure(name: str, func) -> float:
+    started = monotonic()
+    func()
+    elapsed = monotonic() - started
+    print(f"{name:<28} {elapsed:8.2f} s")
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark: rsync --link-dest vs clone_tree")
+    parser.add_argument("--path", required=True)
+    parser.add_argument("--dirs", type=int, default=200)
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() * 2)
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        shutil.rmtree(args.path)
+
+    src = f"{args.path}/src"
+    os.makedirs(src)
+
+    count = create_tree(src, args.dirs, args.files, args.depth, args.size)
+    print(f"Дерево: {args.dirs} директорий, {count} файлов по {args.size} байт")
+
+    def run_rsync():
+        subprocess.run(["rsync", "-a", "--delete", f"--link-dest={src}/", f"{src}/", f"{args.path}/rsync/"], check=True)
+
+    def run_cp():
+        subprocess.run(["cp", "-al", src, f"{args.path}/cp"], check=True)
+
+    rsync_time = measure("rsync -a --link-dest", run_rsync) if shutil.which("rsync") else None
+    measure("cp -al", run_cp)
+
+    for workers in sorted({1, args.workers}):
+        clone_time = measure(f"clone_tree ({workers} потоков)", lambda: HardlinkClone(src, f"{args.path}/clone{workers}", workers=workers, reflink=False).run())
+
+    if rsync_time:
+        print(f"Ускорение clone_tree относительно rsync: {rsync_time / clone_time:.1f}x")
+
+    shutil.rmtree(args.path)
+
+
+if __name__ == "__main__":
+    main()
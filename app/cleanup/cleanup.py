@@ -1,3 +1,4 @@
+import os
 import re
 import sys
 import time
@@ -5,12 +6,17 @@ import time
 from pathlib import Path
 from datetime import datetime
 from utils.log import mainLog
-from utils.fs_utils import get_base_dir, get_list_dirs
-from utils.local_exec import run_local_command
+from utils.fs_utils import get_list_dirs
+from utils.parallel_delete import delete_paths
+from notify.tg import send_telegram_message
 from utils.logging_tools import log_execution
+from utils.checksum_cache import prune_checksum_cache
+from utils.date_utils import get_current_date
+from retention.catalog import expire_pins, get_pinned_snapshots
+from database.xtrabackup import filter_xtrabackup_cleanup, get_incomplete_xtrabackups
 
 
-from config.const import LOCAL_DIST, MYSQL_DUMP_PATH, LOCAL_DIST_UPLOAD
+from config.const import LOCAL_DIST, MYSQL_DUMP_PATH, LOCAL_DIST_UPLOAD, LOCAL_DIST_INCOMING
 from config.const import (
     DAILY_BACKUP_DAYS_LIMIT,
     DAILY_BACKUP_MIN_COUNT,
@@ -22,7 +28,7 @@ from config.const import (
     MYSQL_XTRABACKUP_MIN_COUNT
 )
 
-def collect_outdated_dirs(path: str, days_limit: int, min_count: int = 6) -> list:
+def collect_outdated_dirs(path: str, days_limit: int, min_count: int = 6, keep: set = frozenset()) -> list:
     """
         Собирает список директорий с названиями в формате 'YYYY-MM-DD' в указанном пути, 
         которые старше заданного лимита дней.
@@ -33,10 +39,11 @@ def collect_outdated_dirs(path: str, days_limit: int, min_count: int = 6) -> lis
         :param path: Путь к директории с бэкапами.
         :param days_limit: Лимит возраста файлов в днях — директории старше этого значения будут помечены как устаревшие.
         :param min_count: Минимальное количество директорий, при котором разрешается сбор устаревших (по умолчанию 6).
+        :param keep: Имена директорий, которые не учитываются и не удаляются (закреплённые копии).
         :return: Список полных путей к устаревшим директориям.
     """
     backup_dir_pattern = re.compile(r'^\d{4}-\d{2}-\d{2}$')
-    all_dirs = [f for f in get_list_dirs(path) if backup_dir_pattern.match(f)]
+    all_dirs = [f for f in get_list_dirs(path) if backup_dir_pattern.match(f) and f not in keep]
 
     if len(all_dirs) <= min_count:
         mainLog.debug(f"[collect_outdated_dirs] Кол-во копий в {path} ≤ {min_count}. Очистка отменена.")
@@ -46,6 +53,10 @@ def collect_outdated_dirs(path: str, days_limit: int, min_count: int = 6) -> lis
     time_limit = int(time.time()) - (days_limit * 86400)
 
     for dir_name in all_dirs:
+        # Представления уровней хранения (ссылки на ежедневные копии) удаляются каталогом хранения
+        if os.path.islink(f"{path}/{dir_name}"):
+            continue
+
         try:
             dir_timestamp = int(datetime.strptime(dir_name, '%Y-%m-%d').timestamp())
             if dir_timestamp < time_limit:
@@ -55,28 +66,72 @@ def collect_outdated_dirs(path: str, days_limit: int, min_count: int = 6) -> lis
 
     return outdated_dirs
 
-@log_execution
-def cleanup_outdated_backups():
-    """ Собирает и удаляет устаревшие daily/weekly/monthly директории. """
+
+def collect_cleanup_targets(dry_run: bool = False, keep_current: bool = False) -> list:
+    """
+    Собирает устаревшие daily/weekly/monthly директории, xtrabackup и временные директории pkgacct.
+
+    :param dry_run: Не снимать устаревшие закрепления каталога хранения (оценка объёма очистки),
+                    закреплённые ими копии всё равно считаются устаревшими.
+    :param keep_current: Не удалять временные директории pkgacct текущей даты (очистка перед запуском).
+    :return: Список полных путей к удаляемым директориям.
+    """
+    if dry_run:
+        pinned = get_pinned_snapshots(exclude_expired=True)
+    else:
+        # Закрепления weekly/monthly старше срока снимаются, после чего копии удаляются по сроку daily
+        expire_pins()
+        pinned = get_pinned_snapshots()
+
+    current = {get_current_date()} if keep_current else frozenset()
 
     dirs_to_delete = []
-    dirs_to_delete += collect_outdated_dirs(MYSQL_DUMP_PATH, days_limit=MYSQL_XTRABACKUP_DAYS_LIMIT, min_count=MYSQL_XTRABACKUP_MIN_COUNT)     # xtrabackup > 1 дня
-    dirs_to_delete += collect_outdated_dirs(LOCAL_DIST_UPLOAD, days_limit=-1, min_count=-1)                                                    # upload     Remove all
-    dirs_to_delete += collect_outdated_dirs(LOCAL_DIST, days_limit=DAILY_BACKUP_DAYS_LIMIT, min_count=DAILY_BACKUP_MIN_COUNT)                  # daily      > 5 дней
+    # xtrabackup: минимальное количество не учитывает незавершённые копии (с отметкой .in_progress),
+    # они непригодны для восстановления и удаляются все, кроме текущей даты
+    incomplete = set(get_incomplete_xtrabackups())
+    xtrabackup_dirs = collect_outdated_dirs(MYSQL_DUMP_PATH, days_limit=MYSQL_XTRABACKUP_DAYS_LIMIT, min_count=MYSQL_XTRABACKUP_MIN_COUNT, keep=incomplete)  # xtrabackup > 1 дня
+    xtrabackup_dirs += [f"{MYSQL_DUMP_PATH}/{name}" for name in sorted(incomplete) if name != get_current_date()]
+    # Последняя завершённая полная копия и копии, от которых зависят сохраняемые инкрементальные, не удаляются
+    dirs_to_delete += filter_xtrabackup_cleanup(xtrabackup_dirs)
+    dirs_to_delete += collect_outdated_dirs(LOCAL_DIST_UPLOAD, days_limit=-1, min_count=-1, keep=current)                                      # upload     Remove all
+
+    if os.path.isdir(LOCAL_DIST_INCOMING):
+        dirs_to_delete += collect_outdated_dirs(LOCAL_DIST_INCOMING, days_limit=-1, min_count=-1, keep=current)                                # incoming   Remove all
+
+    dirs_to_delete += collect_outdated_dirs(LOCAL_DIST, days_limit=DAILY_BACKUP_DAYS_LIMIT, min_count=DAILY_BACKUP_MIN_COUNT, keep=pinned)     # daily      > 5 дней
     dirs_to_delete += collect_outdated_dirs(f"{LOCAL_DIST}/weekly", days_limit=WEEKLY_BACKUP_DAYS_LIMIT, min_count=WEEKLY_BACKUP_MIN_COUNT)    # weekly     > 8 дней
     dirs_to_delete += collect_outdated_dirs(f"{LOCAL_DIST}/monthly", days_limit=MONTHLY_BACKUP_DAYS_LIMIT, min_count=MONTHLY_BACKUP_MIN_COUNT) # monthly    > 28 дня
 
+    return dirs_to_delete
+
+
+@log_execution
+def cleanup_outdated_backups(keep_current: bool = False):
+    """
+        Собирает и удаляет устаревшие daily/weekly/monthly директории.
+
+        :param keep_current: Сохранить временные директории pkgacct текущей даты (очистка перед запуском).
+    """
+
+    # Записи кеша контрольных сумм для удалённых копий больше не используются
+    prune_checksum_cache(max(DAILY_BACKUP_DAYS_LIMIT, WEEKLY_BACKUP_DAYS_LIMIT, MONTHLY_BACKUP_DAYS_LIMIT) + 7)
+
+    dirs_to_delete = collect_cleanup_targets(keep_current=keep_current)
+
     if dirs_to_delete:
-        full_list_str = ' '.join(dirs_to_delete)
-        mainLog.info(f"[cleanup_archives] Удаляем директории: {full_list_str}")
+        mainLog.info(f"[cleanup_archives] Удаляем директории: {' '.join(dirs_to_delete)}")
+
+        stats = delete_paths(dirs_to_delete)
+
+        mainLog.info(f"[cleanup_archives] Удалено директорий: {stats['dirs']}, файлов: {stats['files']} (общих с другими копиями: {stats['files_shared']}), "
+                     f"освобождено: {stats['bytes_freed'] / 1024**3:.2f} GiB за {stats['duration']} с")
 
-        # Удаление данных с низким приоритетом
-        cmd_remove_all = f"/bin/ionice -c3 /bin/rm -rf {full_list_str}"
-        # Поиск директорий с неправильными правами и добавления необходимых прав
-        cmd_fix_dirs_chmod = f"/bin/find {full_list_str} -type d \\( ! -perm -200 -o ! -perm -100 \\) -exec chmod u+rwx {{}} +"
-        # Поиск файлов с неправильными правами и добавления необходимых прав
-        cmd_fix_files_chmod = f"/bin/find {full_list_str} -type f ! -perm -200 -exec chmod u+rw {{}} +"
+        if stats['errors']:
+            errors = "\n".join(f"{path}: {exc}" for path, exc in stats['errors'][:20])
+            mainLog.error(f"[cleanup_archives] Ошибок удаления: {len(stats['errors'])}\n{errors}")
+            send_telegram_message(f"[cleanup_archives] Ошибок удаления: {len(stats['errors'])}\n{errors}")
 
-        # Запускаем сначала удаление , после чего поиск директорий и файлов с неправильными правами и повторно удаляем. 
-        run_local_command(f"/bin/nohup bash -c '{cmd_remove_all}; {cmd_fix_dirs_chmod}; {cmd_fix_files_chmod}; {cmd_remove_all}' > {get_base_dir()}/logs/remove_error.log 2>&1 &")
 
+def pre_cleanup_outdated_backups():
+    """ Очистка устаревших копий перед запуском, если без неё не хватает места (retention/capacity.py). """
+    return cleanup_outdated_backups(keep_current=True)
@@ -1,71 +1,87 @@
+import sys
+
 from datetime import datetime
 from utils.log import mainLog
 
 from notify.mail import alertToSupport
 from report.report import get_total_report
-from cleanup.cleanup import cleanup_outdated_backups
+from cleanup.cleanup import cleanup_outdated_backups, pre_cleanup_outdated_backups
+from retention.capacity import analyse_snapshot_usage, ADMISSION_PRE_CLEAN
 from utils.disk_utils import check_free_space
 from remote.cpanel.api import get_account_dict
+from remote.cpanel.fingerprint import prefetch_pkgacct_fingerprints
 from remote.sshfs import mount_over_ssh, umount_over_ssh
 from archive.archive import backup_removed_account, remove_outdated_archive
 from utils.fs_utils import create_current_backup_dir, create_current_upload_dir, get_base_dir
-from service.service import processing_account_data, create_additional_copy
-
-from multiprocessing import Process, Manager
+from service.service import create_additional_copy
+from service.scheduler import run_backup_scheduler
+from history.journal import load_completed, run_journaled_step
+from utils.ssh_pool import close_ssh_pool
 
-from config.const import RESELLER
+from config.const import RESELLER, PKGACCT_TRANSFER_MODE, PKGACCT_SKIP_UNCHANGED, ACCOUNT_DB_BACKUP_ENABLE, CAPACITY_ANALYSE_ENABLE
 
 # DEBUG TIMER START
 startTime = datetime.now()
 
+# Режим возобновления прерванного запуска: этапы, завершённые по журналу текущей даты, пропускаются
+completed = load_completed() if "--resume" in sys.argv else None
+
+if completed is not None:
+    mainLog.info(f"[MAIN] Режим возобновления. Завершённых этапов в журнале: {len(completed)}")
+
+# Проверяем наличие свободного места с учётом прогноза прироста, при необходимости очищаем устаревшие копии до запуска
+if check_free_space()["decision"] == ADMISSION_PRE_CLEAN:
+    run_journaled_step("pre_cleanup_outdated_backups", pre_cleanup_outdated_backups, completed)
+    check_free_space(allow_pre_clean=False)
+
 # Создаем директорию резервного копирования с текущей датой
 create_current_backup_dir()
 
-# Для pkgacct over ssh с текущей датой
-create_current_upload_dir()
+# В режиме stream результат pkgacct передаётся tar-потоком через ssh, sshfs не используется
+use_sshfs = PKGACCT_TRANSFER_MODE != "stream"
 
-# Проверяем наличие свободного места
-check_free_space()
+# Для pkgacct over ssh с текущей датой
+if use_sshfs:
+    create_current_upload_dir()
 
 # Монтируем sshfs зависимость для pkgacct
-mount_over_ssh()
+if use_sshfs:
+    mount_over_ssh()
 
 # Получаем список аккаунтов RESELLER сгрупированных по разделу
 acc_partition_list = get_account_dict(RESELLER)
 
-# Мультипроцессорный dict для сбора информации в отчет
-manager = Manager()
-shared_report_dict = manager.dict()
-
-procs = []
-
-mainLog.info("[MAIN] Запускаем каждый найденый раздел в отдельном процессе.")
+# Отпечатки метаданных аккаунтов и таблицы их баз данных одним ssh-вызовом:
+# pkgacct не запускается для неизменённых аккаунтов, этап mysql не запрашивает список таблиц
+if PKGACCT_SKIP_UNCHANGED or ACCOUNT_DB_BACKUP_ENABLE:
+    prefetch_pkgacct_fingerprints(acc_partition_list)
 
-for partition in acc_partition_list:
-    proc = Process(target=processing_account_data, args=(acc_partition_list[partition], shared_report_dict,))
-    procs.append(proc)
-    proc.start()
+mainLog.info("[MAIN] Запускаем аккаунты всех разделов через общий планировщик.")
 
-for proc in procs:
-    proc.join()
+# Результаты этапов аккаунтов для отчета собирает планировщик (history/results.py)
+stage_stats, account_results = run_backup_scheduler(acc_partition_list, completed)
 
 # Дополнительные резервные копии
-create_additional_copy()
+run_journaled_step("create_additional_copy", create_additional_copy, completed)
 
 # Архивация удаленных аккаунтов
-backup_removed_account()
+run_journaled_step("backup_removed_account", backup_removed_account, completed)
 
 # Удаление устаревших архивов (Зависит от значения в конфигурации ARCHIVE_LIFETIME_SECS)
-remove_outdated_archive()
+run_journaled_step("remove_outdated_archive", remove_outdated_archive, completed)
+
+# Объём текущей копии (уникальный и общий с предыдущими копиями) для прогноза прироста
+if CAPACITY_ANALYSE_ENABLE:
+    run_journaled_step("analyse_snapshot_usage", analyse_snapshot_usage, completed)
 
 # Удаленние устаревших данных резервных копий
-cleanup_outdated_backups()
+run_journaled_step("cleanup_outdated_backups", cleanup_outdated_backups, completed)
 
 # Считаем время исполнения скрипта
 executionTime = datetime.now() - startTime
 
 # Генерируем отчет
-report = get_total_report(shared_report_dict, executionTime)
+report = get_total_report(account_results, executionTime, stage_stats)
 alertToSupport("Система резервного копирования", htmlText=report)
 
 # DEBUG
@@ -73,7 +89,11 @@ with open(f"{get_base_dir()}/logs/report.html", "w") as f:
     f.write(report)
 
 # Проводим размонтирование раздела sshfs
-umount_over_ssh()
+if use_sshfs:
+    umount_over_ssh()
+
+# Закрываем постоянные ssh-соединения с производственным сервером
+close_ssh_pool()
 
 # # DEBUG TIMER END
 mainLog.info(f"[MAIN] Скрипт завершен. Время выполнения: {executionTime}")
\ No newline at end of file
@@ -0,0 +1,286 @@
+import os
+import json
+import shlex
+import shutil
+
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.log import mainLog
+from utils.date_utils import get_current_date
+from utils.ssh_pool import ssh_session, get_ssh_transport
+from utils.local_exec import run_local_command
+from utils.remote_exec import run_ssh_command_on_prod
+from utils.link_dest import link_file
+
+from remote.cpanel.fingerprint import TABLES_SQL, MYSQLD_PID_CMD, get_prefetched_tables
+
+from config.const import (
+    REMOTE_SERVER,
+    ACCOUNT_DB_DUMP_WORKERS,
+    ACCOUNT_DB_DUMP_TIMEOUT,
+    ACCOUNT_DB_DUMP_OPTIONS,
+    ACCOUNT_DB_COMPRESS_LEVEL
+)
+
+# Описание копии баз данных аккаунта, записывается последним (копия без него считается неполной)
+MANIFEST_FILE = "manifest.json"
+# Привилегии пользователей баз данных аккаунта
+GRANTS_FILE = "_grants.sql.gz"
+# Хранимые процедуры и события базы данных
+ROUTINES_FILE = "_routines.sql.gz"
+
+
+def fetch_account_tables(username: str) -> tuple:
+    """
+    Получает таблицы баз данных аккаунта (по префиксу <user>_), если они не получены prefetch_pkgacct_fingerprints.
+
+    :return: ([поля строк T], pid mysqld)
+    """
+    lines = []
+    cmd = f"{MYSQLD_PID_CMD}; /usr/bin/mysql -N -B -e \"{TABLES_SQL} AND TABLE_SCHEMA LIKE '{username}\\_%'\""
+
+    result = run_ssh_command_on_prod(cmd, ACCOUNT_DB_DUMP_TIMEOUT, line_parsers=[lines.append])
+
+    if not result['success']:
+        raise Exception(f"[fetch_account_tables] [{username}] Ошибка получения списка таблиц: {result['stderr']}")
+
+    tables = [line.split("\t") for line in lines if line.startswith("T\t")]
+    mysqld_pid = next((line.split("\t")[1] for line in lines if line.startswith("P\t")), "")
+
+    return tables, mysqld_pid
+
+
+def quote_identifier(name: str) -> str:
+    """ Имя базы данных или таблицы в обратных кавычках MySQL (обратная кавычка в имени удваивается). """
+    return "`" + name.replace("`", "``") + "`"
+
+
+def build_checksum_command(database: str, tables: list) -> str:
+    """
+    Команда CHECKSUM TABLE для выполнения на производственном сервере. Запрос передаётся
+    одним аргументом в одинарных кавычках: обратные кавычки имён не обрабатываются оболочкой.
+    """
+    names = ", ".join(f"{quote_identifier(database)}.{quote_identifier(table)}" for table in tables)
+    return f"/usr/bin/mysql -N -B -e {shlex.quote(f'CHECKSUM TABLE {names}')}"
+
+
+def fetch_checksums(database: str, tables: list) -> dict:
+    """
+    Выполняет CHECKSUM TABLE для таблиц базы данных.
+
+    :return: Словарь {table: checksum}.
+    """
+    lines = []
+
+    result = run_ssh_command_on_prod(build_checksum_command(database, tables), ACCOUNT_DB_DUMP_TIMEOUT, line_parsers=[lines.append])
+
+    if not result['success']:
+        mainLog.warning(f"[fetch_checksums] [{database}] CHECKSUM TABLE завершился ошибкой: {result['stderr']}")
+        return {}
+
+    checksums = {}
+
+    for line in lines:
+        name, _, checksum = line.rpartition("\t")
+        checksums[name.split(".", 1)[-1]] = checksum
+
+    return checksums
+
+
+def get_table_key(fields: list) -> list:
+    """ Признаки изменения таблицы: CREATE_TIME, UPDATE_TIME, DATA_LENGTH, INDEX_LENGTH. """
+    return [fields[3], fields[4], fields[6], fields[7]]
+
+
+def dump_remote(remote_cmd: str, path: str) -> int:
+    """
+    Выполняет команду на производственном сервере, сжимая её вывод там же, и сохраняет поток
+    в файл path через временный файл.
+
+    :return: Размер сохранённого файла.
+    """
+    tmp = f"{path}.tmp"
+
+    with ssh_session() as ssh:
+        remote = f"set -o pipefail; {remote_cmd} | /bin/gzip -{ACCOUNT_DB_COMPRESS_LEVEL}"
+        cmd = f"{get_ssh_transport(ssh)} {REMOTE_SERVER} {shlex.quote(remote)} > {shlex.quote(tmp)}"
+
+        result = run_local_command(cmd, ACCOUNT_DB_DUMP_TIMEOUT)
+
+    if not result['success']:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise Exception(f"[dump_remote] Ошибка выгрузки {path}: {result['stderr']}")
+
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+class AccountDatabaseDump:
+    """
+        Резервная копия баз данных аккаунта по таблицам: <dest>/<db>/<table>.sql.gz.
+
+        - Таблица выгружается заново, если изменились CREATE_TIME, UPDATE_TIME, DATA_LENGTH или INDEX_LENGTH.
+          Представления выгружаются всегда.
+        - Если UPDATE_TIME пуст (таблицы в общем табличном пространстве InnoDB, после перезапуска mysqld),
+          неизменность проверяется через CHECKSUM TABLE.
+        - Неизменённые таблицы связываются hardlink'ом с предыдущей копией.
+        - Изменённые таблицы выгружаются параллельно (ACCOUNT_DB_DUMP_WORKERS), каждая — отдельным
+          mysqldump со сжатием на производственном сервере. Согласованность между таблицами не гарантируется.
+    """
+
+    def __init__(self, username: str, dest: str, previous: str = None):
+        self.username = username
+        self.dest = dest
+        self.previous = previous
+        self.previous_manifest = self.load_manifest(previous) if previous else None
+        self.stats = {"files": 0, "files_transferred": 0, "files_linked": 0, "bytes_received": 0}
+
+    @staticmethod
+    def load_manifest(path: str):
+        try:
+            with open(f"{path}/{MANIFEST_FILE}") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get_previous_entry(self, database: str, table: str):
+        if not self.previous_manifest:
+            return None
+
+        return self.previous_manifest["tables"].get(database, {}).get(table)
+
+    def get_table_path(self, base: str, database: str, table: str) -> str:
+        return f"{base}/{quote(database, safe='')}/{quote(table, safe='')}.sql.gz"
+
+    def plan(self, tables: list) -> tuple:
+        """
+        Делит таблицы на неизменённые и требующие выгрузки.
+
+        :return: ({db: {table: запись манифеста}}, [(db, table)] неизменённые, [(db, table)] для выгрузки)
+        """
+        entries = {}
+        unchanged = []
+        changed = []
+        to_checksum = {}
+
+        for fields in tables:
+            database, table, table_type = fields[1], fields[2], fields[8]
+            entry = {"key": get_table_key(fields), "checksum": None}
+            entries.setdefault(database, {})[table] = entry
+
+            previous = self.get_previous_entry(database, table)
+
+            if table_type == "VIEW":
+                changed.append((database, table))
+
+            # UPDATE_TIME неизвестен: контрольная сумма нужна и для выгружаемой таблицы, чтобы сравнить её при следующем запуске
+            elif not fields[4]:
+                to_checksum.setdefault(database, []).append(table)
+
+            elif previous and previous["key"] == entry["key"]:
+                unchanged.append((database, table))
+
+            else:
+                changed.append((database, table))
+
+        for database, names in to_checksum.items():
+            checksums = fetch_checksums(database, names)
+
+            for table in names:
+                entry = entries[database][table]
+                entry["checksum"] = checksums.get(table)
+                previous = self.get_previous_entry(database, table)
+
+                if previous and previous["key"] == entry["key"] and entry["checksum"] and entry["checksum"] == previous.get("checksum"):
+                    unchanged.append((database, table))
+                else:
+                    changed.append((database, table))
+
+        return entries, unchanged, changed
+
+    def link_table(self, database: str, table: str) -> bool:
+        src = self.get_table_path(self.previous, database, table)
+        dst = self.get_table_path(self.dest, database, table)
+
+        if not os.path.isfile(src):
+            return False
+
+        if not link_file(src, dst):
+            shutil.copy2(src, dst)
+
+        return True
+
+    def dump_table(self, database: str, table: str) -> int:
+        remote_cmd = f"/usr/bin/mysqldump {ACCOUNT_DB_DUMP_OPTIONS} {shlex.quote(database)} {shlex.quote(table)}"
+        return dump_remote(remote_cmd, self.get_table_path(self.dest, database, table))
+
+    def dump_routines(self, database: str) -> int:
+        remote_cmd = f"/usr/bin/mysqldump --no-data --no-create-info --skip-triggers --routines --events {shlex.quote(database)}"
+        return dump_remote(remote_cmd, f"{self.dest}/{quote(database, safe='')}/{ROUTINES_FILE}")
+
+    def dump_grants(self) -> int:
+        users_sql = (
+            "SELECT CONCAT('SHOW GRANTS FOR ', QUOTE(User), '@', QUOTE(Host), ';') FROM mysql.user "
+            f"WHERE User = '{self.username}' OR User LIKE '{self.username}\\_%'"
+        )
+        remote_cmd = f"/usr/bin/mysql -N -B -e \"{users_sql}\" | /usr/bin/mysql -N -B | /bin/sed 's/$/;/'"
+        return dump_remote(remote_cmd, f"{self.dest}/{GRANTS_FILE}")
+
+    def write_manifest(self, entries: dict, mysqld_pid: str) -> None:
+        path = f"{self.dest}/{MANIFEST_FILE}"
+
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"date": get_current_date(), "mysqld_pid": mysqld_pid, "tables": entries}, f)
+
+        os.replace(f"{path}.tmp", path)
+
+    def run(self) -> dict:
+        prefetched = get_prefetched_tables(self.username)
+        tables, mysqld_pid = prefetched if prefetched else fetch_account_tables(self.username)
+
+        if os.path.isdir(self.dest):
+            shutil.rmtree(self.dest)
+
+        databases = sorted({fields[1] for fields in tables})
+        os.makedirs(self.dest)
+
+        for database in databases:
+            os.makedirs(f"{self.dest}/{quote(database, safe='')}")
+
+        entries, unchanged, changed = self.plan(tables)
+
+        for database, table in unchanged:
+            if self.link_table(database, table):
+                self.stats["files_linked"] += 1
+            else:
+                changed.append((database, table))
+
+        # Крупные таблицы первыми, чтобы параллельная выгрузка не заканчивалась одной долгой таблицей
+        sizes = {(fields[1], fields[2]): int(fields[6] or 0) + int(fields[7] or 0) for fields in tables}
+        changed.sort(key=lambda item: sizes.get(item, 0), reverse=True)
+
+        with ThreadPoolExecutor(max_workers=ACCOUNT_DB_DUMP_WORKERS) as executor:
+            jobs = [executor.submit(self.dump_table, database, table) for database, table in changed]
+            jobs += [executor.submit(self.dump_routines, database) for database in databases]
+            jobs.append(executor.submit(self.dump_grants))
+
+            for job in jobs:
+                self.stats["bytes_received"] += job.result()
+
+        self.write_manifest(entries, mysqld_pid)
+
+        self.stats["files"] = len(tables)
+        self.stats["files_transferred"] = len(changed)
+
+        return self.stats
+
+
+def dump_account_databases(username: str, dest: str, previous: str = None) -> dict:
+    """
+    Выполняет AccountDatabaseDump и возвращает статистику {files, files_transferred, files_linked, bytes_received}.
+    """
+    stats = AccountDatabaseDump(username, dest, previous).run()
+    mainLog.debug(f"[dump_account_databases] [{username}] {dest}: {stats}")
+    return stats
@@ -1,18 +1,31 @@
+import os
+import re
 import sys
+import json
+import shutil
+import hashlib
 import subprocess
 import threading
 import logging
 
 from pathlib import Path
+from time import monotonic
+from datetime import date, datetime
 from utils.log import mainLog
 from utils.fs_utils import create_current_mysqldump_dir, get_base_dir
 from utils.date_utils import get_current_date
+from utils.local_exec import run_local_command
 from utils.logging_tools import log_execution
 
 from remote.fs_utils import remote_dir_exists
+from utils.ssh_pool import ssh_session
 from notify.tg import send_telegram_message
+from history.history import record_stage_result
+from history.journal import GLOBAL_USER
 
-from config.const import MYSQL_DUMP_ENABLE, MYSQL_PATH, REMOTE_SERVER, REMOTE_SSH_PORT, MYSQL_DUMP_OPTIONS
+from config.const import MYSQL_DUMP_ENABLE, MYSQL_PATH, REMOTE_SERVER, MYSQL_DUMP_OPTIONS, MYSQL_DUMP_PATH
+from config.const import MYSQL_XTRABACKUP_MODE, MYSQL_XTRABACKUP_FULL_INTERVAL_DAYS
+from config.const import XTRABACKUP_RELAY_BUFFER, XTRABACKUP_STALL_TIMEOUT, XTRABACKUP_PROGRESS_INTERVAL
 from tenacity import retry, stop_after_attempt, retry_if_result, wait_random, before_sleep_log
 
 # Для вывода stdout
@@ -27,43 +40,309 @@ def write_stream_to_file(stream, filepath):
             f.write(line)
 
 
+# Файл в директории копии: тип копии и диапазон LSN, создаётся после успешного завершения
+CHAIN_FILE = ".chain.json"
+# Файл в директории копии: копия создаётся, удаляется после успешного завершения
+IN_PROGRESS_FILE = ".in_progress"
+
+BACKUP_DIR_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+#### CHAIN ####
+def read_chain_file(backup_path: str):
+    """
+    Читает описание копии.
+
+    :return: Словарь {type, date, from_lsn, to_lsn, base, stream: {bytes, sha256}} или None для незавершённой копии.
+    """
+    try:
+        with open(f"{backup_path}/{CHAIN_FILE}") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_chain_file(backup_path: str, chain: dict) -> None:
+    with open(f"{backup_path}/{CHAIN_FILE}.tmp", "w") as f:
+        json.dump(chain, f)
+
+    os.replace(f"{backup_path}/{CHAIN_FILE}.tmp", f"{backup_path}/{CHAIN_FILE}")
+
+
+def read_checkpoints(backup_path: str) -> dict:
+    """
+    Читает xtrabackup_checkpoints копии (backup_type, from_lsn, to_lsn, last_lsn).
+    При --compress файл может быть сжат qpress.
+    """
+    path = f"{backup_path}/xtrabackup_checkpoints"
+
+    if os.path.exists(path):
+        with open(path) as f:
+            text = f.read()
+    else:
+        result = run_local_command(f"qpress -do {path}.qp")
+
+        if not result['success']:
+            raise Exception(f"xtrabackup_checkpoints не найден в {backup_path}: {result['stderr']}")
+
+        text = result['stdout']
+
+    checkpoints = {}
+
+    for line in text.splitlines():
+        key, _, value = line.partition("=")
+        checkpoints[key.strip()] = value.strip()
+
+    return checkpoints
+
+
+def get_xtrabackup_chains() -> dict:
+    """ Возвращает описания завершённых копий: {дата: chain}. """
+    chains = {}
+
+    if os.path.isdir(MYSQL_DUMP_PATH):
+        for name in sorted(os.listdir(MYSQL_DUMP_PATH)):
+            chain = read_chain_file(f"{MYSQL_DUMP_PATH}/{name}")
+
+            if chain:
+                chains[name] = chain
+
+    return chains
+
+
+def get_incremental_base():
+    """
+    Последняя полная копия, относительно которой выполняется инкрементальная копия текущей даты.
+
+    :return: (дата, chain) или None, если нужна полная копия: нет завершённой полной копии
+             или она старше MYSQL_XTRABACKUP_FULL_INTERVAL_DAYS дней.
+    """
+    fulls = [(name, chain) for name, chain in get_xtrabackup_chains().items() if chain["type"] == "full" and name != get_current_date()]
+
+    if not fulls:
+        return None
+
+    name, chain = fulls[-1]
+    age = (date.fromisoformat(get_current_date()) - date.fromisoformat(name)).days
+
+    if age >= MYSQL_XTRABACKUP_FULL_INTERVAL_DAYS:
+        return None
+
+    return name, chain
+
+
+def get_incomplete_xtrabackups() -> list:
+    """
+    Директории копий (YYYY-MM-DD) с отметкой .in_progress: прерванные или завершившиеся ошибкой копии.
+    Копии, созданные до появления .chain.json, отметки не имеют и незавершёнными не считаются.
+    """
+    if not os.path.isdir(MYSQL_DUMP_PATH):
+        return []
+
+    return [name for name in sorted(os.listdir(MYSQL_DUMP_PATH))
+            if BACKUP_DIR_PATTERN.match(name) and os.path.isfile(f"{MYSQL_DUMP_PATH}/{name}/{IN_PROGRESS_FILE}")]
+
+
+def filter_xtrabackup_cleanup(outdated: list) -> list:
+    """
+    Исключает из удаляемых:
+        - последнюю завершённую полную копию и её инкрементальные копии (восстановление возможно всегда,
+          даже если следующие копии завершились ошибкой);
+        - полные копии, от которых зависят сохраняемые инкрементальные копии.
+
+    Пока нет ни одной завершённой полной копии, не удаляется ничего.
+
+    :param outdated: Пути директорий MYSQL_DUMP_PATH: устаревшие (collect_outdated_dirs) и незавершённые копии.
+    :return: Пути, которые можно удалить.
+    """
+    chains = get_xtrabackup_chains()
+    fulls = [name for name, chain in chains.items() if chain["type"] == "full"]
+
+    if not fulls:
+        if outdated:
+            mainLog.warning(f"[filter_xtrabackup_cleanup] Нет завершённой полной копии, очистка {MYSQL_DUMP_PATH} отменена.")
+        return []
+
+    protected = {fulls[-1]} | {name for name, chain in chains.items() if chain.get("base") == fulls[-1]}
+
+    deleting = {os.path.basename(path) for path in outdated} - protected
+    live_bases = {chain["base"] for name, chain in chains.items() if chain.get("base") and name not in deleting}
+
+    for name in sorted((protected | live_bases) & {os.path.basename(path) for path in outdated}):
+        mainLog.info(f"[filter_xtrabackup_cleanup] Копия {name} сохраняется: последняя завершённая полная копия или её зависимость.")
+
+    return [path for path in outdated if os.path.basename(path) not in protected | live_bases]
+
+
+def is_xtrabackup_due() -> bool:
+    """ В режиме incremental копия создаётся ежедневно, в режиме full — каждые 3 дня. """
+    return MYSQL_XTRABACKUP_MODE == "incremental" or date.today().day % 3 == 0
+
+
+class StreamRelay:
+    """
+        Передача потока xbstream от ssh к mbstream через буфер XTRABACKUP_RELAY_BUFFER (один буфер
+        на весь поток, без копирования данных в новые объекты).
+
+        - Считает объём и скорость, раз в XTRABACKUP_PROGRESS_INTERVAL секунд пишет прогресс в лог.
+        - Считает sha256 переданного потока.
+        - Если данных нет XTRABACKUP_STALL_TIMEOUT секунд, завершает процессы потока.
+    """
+
+    def __init__(self, source, sink, processes: list):
+        self.source = source
+        self.sink = sink
+        self.processes = processes
+        self.hasher = hashlib.sha256()
+        self.bytes = 0
+        self.last_activity = monotonic()
+        self.done = threading.Event()
+        self.stalled = False
+        self.error = None
+
+    def run(self) -> dict:
+        """ Выполняет передачу до конца потока, возвращает {bytes, duration, rate, sha256, stalled, error}. """
+        started = monotonic()
+        watchdog = threading.Thread(target=self.watch)
+        watchdog.start()
+
+        try:
+            self.relay()
+        except OSError as exc:
+            # mbstream завершился раньше ssh (BrokenPipeError) или ошибка чтения потока
+            self.error = str(exc)
+
+            for proc in self.processes:
+                proc.kill()
+        finally:
+            self.done.set()
+            watchdog.join()
+
+            try:
+                self.sink.close()
+            except OSError:
+                pass
+
+        duration = monotonic() - started
+
+        return {
+            "bytes": self.bytes,
+            "duration": duration,
+            "rate": self.bytes / duration if duration else 0,
+            "sha256": self.hasher.hexdigest(),
+            "stalled": self.stalled,
+            "error": self.error,
+        }
+
+    def relay(self) -> None:
+        buffer = bytearray(XTRABACKUP_RELAY_BUFFER)
+        view = memoryview(buffer)
+
+        while True:
+            size = self.source.readinto(buffer)
+
+            if not size:
+                break
+
+            self.last_activity = monotonic()
+            self.hasher.update(view[:size])
+
+            written = 0
+
+            while written < size:
+                written += self.sink.write(view[written:size])
+
+            self.bytes += size
+
+    def watch(self) -> None:
+        last_progress = monotonic()
+        last_bytes = 0
+
+        while not self.done.wait(1):
+            now = monotonic()
+
+            if now - self.last_activity > XTRABACKUP_STALL_TIMEOUT:
+                mainLog.error(f"[StreamRelay] Нет данных {XTRABACKUP_STALL_TIMEOUT} с, поток xtrabackup остановлен.")
+                self.stalled = True
+
+                for proc in self.processes:
+                    proc.kill()
+                return
+
+            if now - last_progress >= XTRABACKUP_PROGRESS_INTERVAL:
+                mainLog.info(f"[StreamRelay] Получено: {self.bytes / 1024**3:.2f} GiB, "
+                             f"{(self.bytes - last_bytes) / (now - last_progress) / 1024**2:.1f} MiB/s")
+                last_progress, last_bytes = now, self.bytes
+
+
 @log_execution
-def run_xtrabackup_stream(mysql_dump_path):
+def run_xtrabackup_stream(mysql_dump_path, incremental_lsn: str = None):
 
     additional_args = MYSQL_DUMP_OPTIONS or ""
+
+    # Инкрементальная копия: изменения страниц с LSN больше to_lsn полной копии
+    if incremental_lsn:
+        additional_args += f" --incremental-lsn={incremental_lsn}"
+
     remote_cmd = f"/usr/bin/mariabackup --backup --compress --compress-threads=8 {additional_args} --stream=xbstream --datadir={MYSQL_PATH}"
 
-    ssh_cmd = ["ssh", "-p", str(REMOTE_SSH_PORT), REMOTE_SERVER, remote_cmd]
-	
     xbstream_cmd = ["/usr/bin/mbstream", "-x", "-C", mysql_dump_path]
 
+    started_at = datetime.now()
+
     try:
-        ssh_proc = subprocess.Popen(
-            ssh_cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        xbstream_proc = subprocess.Popen(
-            xbstream_cmd,
-            stdin=ssh_proc.stdout,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-
-        # Для отладочных целей возможно писать лог из mariabackup в stdout или в файл
-        #ssh_stderr_thread = threading.Thread(target=print_stream, args=(ssh_proc.stderr, "[mariabackup]"))
-        ssh_stderr_thread = threading.Thread(target=write_stream_to_file, args=(ssh_proc.stderr, f"{get_base_dir()}/logs/xtrabackup-{get_current_date()}.log"))
-        ssh_stderr_thread.start()
-
-        out, err = xbstream_proc.communicate()
-
-        ssh_stderr_thread.join()
-        ssh_proc.wait()
+        # Сессия из пула master-соединений занята на всё время потока
+        with ssh_session() as ssh:
+            ssh_proc = subprocess.Popen(
+                ssh + [REMOTE_SERVER, remote_cmd],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                bufsize=0
+            )
+            xbstream_proc = subprocess.Popen(
+                xbstream_cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                bufsize=0
+            )
+
+            # Для отладочных целей возможно писать лог из mariabackup в stdout или в файл
+            #ssh_stderr_thread = threading.Thread(target=print_stream, args=(ssh_proc.stderr, "[mariabackup]"))
+            ssh_stderr_thread = threading.Thread(target=write_stream_to_file, args=(ssh_proc.stderr, f"{get_base_dir()}/logs/xtrabackup-{get_current_date()}.log"))
+            ssh_stderr_thread.start()
+
+            xbstream_err = []
+            xbstream_stderr_thread = threading.Thread(target=lambda: xbstream_err.append(xbstream_proc.stderr.read()))
+            xbstream_stderr_thread.start()
+
+            relay = StreamRelay(ssh_proc.stdout, xbstream_proc.stdin, [ssh_proc, xbstream_proc])
+            stats = relay.run()
+
+            xbstream_proc.wait()
+            ssh_proc.wait()
+            xbstream_stderr_thread.join()
+            ssh_stderr_thread.join()
+
+        success = xbstream_proc.returncode == 0 and ssh_proc.returncode == 0 and not stats["stalled"] and not stats["error"]
+        err = b"".join(xbstream_err).decode(errors="replace")
+
+        if stats["stalled"]:
+            err = f"Поток остановлен: нет данных {XTRABACKUP_STALL_TIMEOUT} с. {err}"
+        elif stats["error"]:
+            err = f"{stats['error']}. {err}"
+
+        mainLog.info(f"[run_xtrabackup_stream] Получено: {stats['bytes'] / 1024**3:.2f} GiB за {stats['duration']:.0f} с "
+                     f"({stats['rate'] / 1024**2:.1f} MiB/s), sha256: {stats['sha256']}")
+
+        record_stage_result(GLOBAL_USER, "run_xtrabackup_stream", started_at, stats["duration"], success,
+                            returncode=xbstream_proc.returncode or ssh_proc.returncode, bytes_received=stats["bytes"])
 
         return {
-            "success": xbstream_proc.returncode == 0 and ssh_proc.returncode == 0,
-            "stdout": out.decode() if out else "",
-            "stderr": err.decode() if err else ""
+            "success": success,
+            "stdout": "",
+            "stderr": err,
+            "stream": stats
         }
 
     except Exception as e:
@@ -89,14 +368,40 @@ def create_mysql_xtrabackup():
         send_telegram_message(f"[createMysqlCopy] Произошла ошибка при создании директории для xtrabackup. Создание дампа отменено.")
         return None
 
-    result = run_xtrabackup_stream(xtrabackup_cur_path)
+    # Повторная попытка начинается с пустой директории
+    shutil.rmtree(xtrabackup_cur_path)
+    os.makedirs(xtrabackup_cur_path)
+    Path(f"{xtrabackup_cur_path}/{IN_PROGRESS_FILE}").touch()
+
+    base = get_incremental_base() if MYSQL_XTRABACKUP_MODE == "incremental" else None
+
+    if base:
+        mainLog.info(f"[createMysqlCopy] Инкрементальная копия относительно {base[0]} (to_lsn {base[1]['to_lsn']}).")
+
+    result = run_xtrabackup_stream(xtrabackup_cur_path, base[1]["to_lsn"] if base else None)
 
     if not result["success"]:
         mainLog.error(f"[createMysqlCopy] Результат создания xtrabackup копии завершился с ошибокой. stderr: {result['stderr']}")
         send_telegram_message(f"[createMysqlCopy] Результат создания xtrabackup копии завершился с ошибокой. stderr: {result['stderr']}")
-        # TODO Тут нужна реализация флага, что бы если копия завершилось с ошибкой , то во время очистки не удалять последную копию. 
-        # Самой простой реализацией может быть создание текстового файла и удаление его в случае успеха.
         return False
-    
-    mainLog.info("[createMysqlCopy] Успешно завершен.")
+
+    try:
+        checkpoints = read_checkpoints(xtrabackup_cur_path)
+    except Exception as exc:
+        mainLog.error(f"[createMysqlCopy] Не удалось прочитать LSN копии: {exc}")
+        send_telegram_message(f"[createMysqlCopy] Не удалось прочитать LSN копии: {exc}")
+        return False
+
+    # Описание копии записывается только после успешного завершения: незавершённая копия не становится базой
+    write_chain_file(xtrabackup_cur_path, {
+        "type": "incremental" if base else "full",
+        "date": get_current_date(),
+        "from_lsn": checkpoints.get("from_lsn"),
+        "to_lsn": checkpoints.get("to_lsn"),
+        "base": base[0] if base else None,
+        "stream": {key: result["stream"][key] for key in ("bytes", "sha256")},
+    })
+    os.remove(f"{xtrabackup_cur_path}/{IN_PROGRESS_FILE}")
+
+    mainLog.info(f"[createMysqlCopy] Успешно завершен ({'incremental' if base else 'full'}, to_lsn {checkpoints.get('to_lsn')}).")
     return True
\ No newline at end of file
@@ -0,0 +1,152 @@
+import os
+import json
+import shutil
+
+from time import monotonic
+from datetime import datetime
+
+from utils.log import mainLog
+from utils.logging_tools import log_execution
+from utils.local_exec import run_local_command
+from utils.date_utils import get_current_date
+from notify.tg import send_telegram_message
+from history.history import record_stage_result
+from history.journal import GLOBAL_USER
+from database.xtrabackup import CHAIN_FILE, get_xtrabackup_chains
+
+from config.const import MYSQL_DUMP_PATH, MYSQL_PREPARE_PARALLEL, MYSQL_PREPARE_USE_MEMORY, MYSQL_PREPARE_TIMEOUT
+
+# Файл в директории копии: результат подготовки копии к восстановлению
+PREPARE_FILE = ".prepare.json"
+
+# Префикс директории подготовленной копии в MYSQL_DUMP_PATH (не попадает под шаблон даты collect_outdated_dirs)
+PREPARED_PREFIX = "prepared-"
+
+
+def stage_backup_dir(src: str, dest: str) -> None:
+    """
+    Рабочая копия директории xtrabackup: сжатые .qp файлы связываются hardlink'ами
+    (--decompress --remove-original удаляет только ссылку), остальные файлы копируются,
+    так как --prepare изменяет их на месте.
+    """
+    for root, dirs, files in os.walk(src):
+        rel = os.path.relpath(root, src)
+        target = dest if rel == "." else f"{dest}/{rel}"
+        os.makedirs(target, exist_ok=True)
+
+        for name in files:
+            if name in (CHAIN_FILE, PREPARE_FILE):
+                continue
+
+            if name.endswith(".qp"):
+                os.link(f"{root}/{name}", f"{target}/{name}")
+            else:
+                shutil.copy2(f"{root}/{name}", f"{target}/{name}")
+
+
+def run_mariabackup(args: str, work_dir: str) -> float:
+    """ Выполняет mariabackup с низким приоритетом ввода-вывода, возвращает время выполнения. """
+    started = monotonic()
+    result = run_local_command(f"/bin/ionice -c3 /bin/nice -n 19 /usr/bin/mariabackup {args} --target-dir={work_dir}", MYSQL_PREPARE_TIMEOUT)
+
+    if not result['success']:
+        raise Exception(f"mariabackup {args.split()[0]} завершился с ошибкой: {result['stderr']}")
+
+    return monotonic() - started
+
+
+def write_prepare_file(backup_path: str, prepare: dict) -> None:
+    with open(f"{backup_path}/{PREPARE_FILE}.tmp", "w") as f:
+        json.dump(prepare, f)
+
+    os.replace(f"{backup_path}/{PREPARE_FILE}.tmp", f"{backup_path}/{PREPARE_FILE}")
+
+
+def read_prepare_file(backup_path: str):
+    """ :return: Словарь {ready, prepared_path, decompress_seconds, prepare_seconds, date, error} или None. """
+    try:
+        with open(f"{backup_path}/{PREPARE_FILE}") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+@log_execution
+def prepare_mysql_xtrabackup() -> bool:
+    """
+        Подготавливает последнюю завершённую копию xtrabackup к восстановлению.
+
+        - Полная копия (и инкрементальная, если последняя копия инкрементальная) переносится в рабочую
+          директорию, распаковывается mariabackup --decompress --parallel=MYSQL_PREPARE_PARALLEL.
+        - mariabackup --prepare выполняется с ionice -c3, инкрементальная копия применяется
+          --prepare --incremental-dir.
+        - Готовая копия сохраняется в MYSQL_DUMP_PATH/prepared-<дата>, предыдущие подготовленные копии удаляются.
+        - Время этапов и готовность записываются в <копия>/.prepare.json и в историю запусков.
+
+        Исходные сжатые копии не изменяются и остаются базой для следующих инкрементальных копий.
+
+        :return: True, если копия готова к восстановлению.
+    """
+    chains = get_xtrabackup_chains()
+
+    if not chains:
+        mainLog.warning("[prepare_mysql_xtrabackup] Завершённые копии xtrabackup не найдены.")
+        return False
+
+    name, chain = list(chains.items())[-1]
+    backup_path = f"{MYSQL_DUMP_PATH}/{name}"
+    base_name = chain["base"] or name
+
+    work_dir = f"{MYSQL_DUMP_PATH}/{PREPARED_PREFIX}{name}.tmp"
+    incremental_dir = f"{MYSQL_DUMP_PATH}/{PREPARED_PREFIX}{name}.incremental.tmp"
+    prepared_path = f"{MYSQL_DUMP_PATH}/{PREPARED_PREFIX}{name}"
+
+    started_at = datetime.now()
+    prepare = {"ready": False, "prepared_path": None, "decompress_seconds": 0, "prepare_seconds": 0, "date": get_current_date(), "error": None}
+
+    try:
+        # Рабочие директории любых дат, оставшиеся после прерванной подготовки (kill, перезагрузка)
+        for entry in os.listdir(MYSQL_DUMP_PATH):
+            if entry.startswith(PREPARED_PREFIX) and entry.endswith(".tmp"):
+                mainLog.info(f"[prepare_mysql_xtrabackup] Удаляется рабочая директория прерванной подготовки: {entry}")
+                shutil.rmtree(f"{MYSQL_DUMP_PATH}/{entry}")
+
+        stage_backup_dir(f"{MYSQL_DUMP_PATH}/{base_name}", work_dir)
+        prepare["decompress_seconds"] += run_mariabackup(f"--decompress --parallel={MYSQL_PREPARE_PARALLEL} --remove-original", work_dir)
+        prepare["prepare_seconds"] += run_mariabackup(f"--prepare --use-memory={MYSQL_PREPARE_USE_MEMORY}", work_dir)
+
+        if chain["base"]:
+            stage_backup_dir(backup_path, incremental_dir)
+            prepare["decompress_seconds"] += run_mariabackup(f"--decompress --parallel={MYSQL_PREPARE_PARALLEL} --remove-original", incremental_dir)
+            prepare["prepare_seconds"] += run_mariabackup(f"--prepare --use-memory={MYSQL_PREPARE_USE_MEMORY} --incremental-dir={incremental_dir}", work_dir)
+            shutil.rmtree(incremental_dir)
+
+        # Хранится только последняя подготовленная копия
+        for entry in os.listdir(MYSQL_DUMP_PATH):
+            if entry.startswith(PREPARED_PREFIX) and not entry.endswith(".tmp"):
+                shutil.rmtree(f"{MYSQL_DUMP_PATH}/{entry}")
+
+        os.rename(work_dir, prepared_path)
+
+        prepare["ready"] = True
+        prepare["prepared_path"] = prepared_path
+
+    except Exception as exc:
+        prepare["error"] = str(exc)
+        mainLog.error(f"[prepare_mysql_xtrabackup] Подготовка копии {name} завершилась с ошибкой: {exc}")
+        send_telegram_message(f"[prepare_mysql_xtrabackup] Подготовка копии {name} завершилась с ошибкой: {exc}")
+
+        for path in (work_dir, incremental_dir):
+            if os.path.exists(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    write_prepare_file(backup_path, prepare)
+
+    duration = prepare["decompress_seconds"] + prepare["prepare_seconds"]
+    record_stage_result(GLOBAL_USER, "prepare_mysql_xtrabackup", started_at, duration, prepare["ready"])
+
+    if prepare["ready"]:
+        mainLog.info(f"[prepare_mysql_xtrabackup] Копия {name} готова к восстановлению: {prepared_path} "
+                     f"(распаковка {prepare['decompress_seconds']:.0f} с, prepare {prepare['prepare_seconds']:.0f} с)")
+
+    return prepare["ready"]
@@ -0,0 +1,313 @@
+import sqlite3
+import threading
+
+from time import monotonic
+from datetime import datetime
+from functools import wraps
+
+from utils.log import mainLog
+from utils.fs_utils import get_base_dir
+from utils.date_utils import get_current_date, get_sub_day_date
+
+# Этапы резервного копирования аккаунта, которые сохраняются в историю
+STAGES = (
+    "pre_clean_pkgacct",
+    "run_pkgacct",
+    "move_pkgacct_with_hardlinks",
+    "run_account_db_backup",
+    "run_rsync_homedir",
+    "run_rsync_suspended",
+)
+
+# Этапы верхнего уровня, сумма их длительностей — время резервного копирования аккаунта
+# (pre_clean_pkgacct выполняется внутри run_pkgacct)
+ACCOUNT_STAGES = (
+    "run_pkgacct",
+    "move_pkgacct_with_hardlinks",
+    "run_account_db_backup",
+    "run_rsync_homedir",
+    "run_rsync_suspended",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stage_results (
+    run_date          TEXT    NOT NULL,
+    user              TEXT    NOT NULL,
+    stage             TEXT    NOT NULL,
+    started_at        TEXT    NOT NULL,
+    duration          REAL    NOT NULL,
+    success           INTEGER NOT NULL,
+    returncode        INTEGER,
+    bytes_sent        INTEGER,
+    bytes_received    INTEGER,
+    files             INTEGER,
+    files_transferred INTEGER
+);
+CREATE INDEX IF NOT EXISTS stage_results_user_stage ON stage_results (user, stage, run_date);
+CREATE INDEX IF NOT EXISTS stage_results_run_date ON stage_results (run_date, stage);
+CREATE TABLE IF NOT EXISTS snapshot_usage (
+    snapshot      TEXT    NOT NULL,
+    user          TEXT    NOT NULL,
+    analysed_on   TEXT    NOT NULL,
+    total_bytes   INTEGER NOT NULL,
+    unique_bytes  INTEGER NOT NULL,
+    shared_bytes  INTEGER NOT NULL,
+    files         INTEGER NOT NULL,
+    PRIMARY KEY (snapshot, user)
+);
+"""
+
+METRIC_FIELDS = ("returncode", "bytes_sent", "bytes_received", "files", "files_transferred")
+
+# Стек метрик выполняющихся этапов (этапы могут быть вложенными, например pre_clean_pkgacct в run_pkgacct)
+_local = threading.local()
+
+# Канал результатов процесса этапа (history/results.py): результаты передаются планировщику,
+# который сохраняет их в историю. None — результат сохраняется процессом этапа
+_channel = None
+
+
+def get_history_path() -> str:
+    return f"{get_base_dir()}/logs/history.sqlite"
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Открывает базу истории запусков (создаёт схему при необходимости).
+
+    Запись ведётся из нескольких процессов одновременно, поэтому используется WAL
+    и увеличенный таймаут ожидания блокировки.
+    """
+    conn = sqlite3.connect(get_history_path(), timeout=60)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def record_stage_result(user: str, stage: str, started_at: datetime, duration: float, success: bool, **metrics) -> None:
+    """
+    Сохраняет результат этапа резервного копирования аккаунта.
+
+    :param user: Имя пользователя cPanel.
+    :param stage: Название этапа (см. STAGES).
+    :param started_at: Время запуска этапа.
+    :param duration: Длительность в секундах.
+    :param success: Результат этапа.
+    :param metrics: returncode, bytes_sent, bytes_received, files, files_transferred.
+    """
+    record_stage_results([dict(metrics, user=user, stage=stage, started_at=started_at, duration=duration, success=success)])
+
+
+def record_stage_results(results: list) -> None:
+    """
+    Сохраняет результаты этапов одной транзакцией.
+
+    :param results: Список словарей {user, stage, started_at, duration, success, <METRIC_FIELDS>}.
+    """
+    rows = [[get_current_date(), result["user"], result["stage"], result["started_at"].isoformat(timespec="seconds"), result["duration"],
+             int(bool(result["success"]))] + [result.get(field) for field in METRIC_FIELDS] for result in results]
+
+    try:
+        with get_connection() as conn:
+            conn.executemany("INSERT INTO stage_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    except Exception as exc:
+        mainLog.error(f"[record_stage_results] Не удалось сохранить результаты этапов ({len(rows)}): {exc.args}")
+
+
+def set_result_channel(channel) -> None:
+    """ Передавать результаты этапов текущего процесса через канал channel (StageResultChannel). """
+    global _channel
+    _channel = channel
+
+
+def set_stage_metrics(**metrics) -> None:
+    """
+    Дополняет метрики текущего выполняющегося этапа (returncode, bytes_sent, bytes_received, files, files_transferred).
+    Вне этапа, обёрнутого track_stage, вызов ничего не делает.
+    """
+    stack = getattr(_local, "stack", None)
+
+    if stack:
+        stack[-1].update({key: value for key, value in metrics.items() if value is not None})
+
+
+def get_stage_metrics() -> dict:
+    """ Метрики текущего выполняющегося этапа (пустой словарь вне этапа, обёрнутого track_stage). """
+    stack = getattr(_local, "stack", None)
+    return dict(stack[-1]) if stack else {}
+
+
+def track_stage(func):
+    """
+        Декоратор для сохранения результата этапа в историю запусков.
+
+        Первый аргумент функции должен иметь атрибут `user` (CpanelAccount).
+        Успехом считается истинный результат функции. Метрики передаются
+        из функции через set_stage_metrics. В процессе этапа конвейера результат
+        передаётся планировщику через канал (set_result_channel).
+    """
+    @wraps(func)
+    def wrapper(account, *args, **kwargs):
+        stack = _local.__dict__.setdefault("stack", [])
+        stack.append({})
+
+        started_at = datetime.now()
+        start = monotonic()
+        result = False
+
+        try:
+            result = func(account, *args, **kwargs)
+            return result
+        finally:
+            metrics = stack.pop()
+            duration = monotonic() - start
+
+            if not (_channel and _channel.send(account.user, func.__name__, started_at, duration, bool(result), **metrics)):
+                record_stage_result(account.user, func.__name__, started_at, duration, bool(result), **metrics)
+
+    return wrapper
+
+
+#### QUERY API ####
+def get_account_durations(days: int = 14) -> dict:
+    """
+    Возвращает время резервного копирования каждого аккаунта (сумма этапов ACCOUNT_STAGES)
+    в последнем запуске за указанное число дней.
+
+    :return: Словарь {user: секунды}.
+    """
+    placeholders = ", ".join("?" * len(ACCOUNT_STAGES))
+
+    with get_connection() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT user, run_date, SUM(duration) AS duration FROM stage_results
+            WHERE stage IN ({placeholders}) AND run_date >= ?
+            GROUP BY user, run_date ORDER BY run_date
+            """,
+            ACCOUNT_STAGES + (get_sub_day_date(days),)
+        ).fetchall()
+
+    # Строки отсортированы по дате, поэтому остаётся значение последнего запуска
+    return {row["user"]: row["duration"] for row in rows}
+
+
+def get_stage_history(user: str = None, stage: str = None, days: int = 30) -> list:
+    """
+    Возвращает записи истории этапов.
+
+    :param user: Фильтр по пользователю или None.
+    :param stage: Фильтр по этапу или None.
+    :param days: Глубина выборки в днях.
+    :return: Список словарей, отсортированный по времени запуска.
+    """
+    query = "SELECT * FROM stage_results WHERE run_date >= ?"
+    params = [get_sub_day_date(days)]
+
+    if user:
+        query += " AND user = ?"
+        params.append(user)
+
+    if stage:
+        query += " AND stage = ?"
+        params.append(stage)
+
+    with get_connection() as conn:
+        return [dict(row) for row in conn.execute(query + " ORDER BY started_at", params)]
+
+
+def get_run_totals(days: int = 30) -> list:
+    """
+    Возвращает итоги по каждому запуску и этапу: количество аккаунтов, ошибок,
+    суммарное время и объём переданных данных. Используется для планирования ресурсов.
+    """
+    with get_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT run_date, stage, COUNT(*) AS accounts, SUM(1 - success) AS failed, SUM(duration) AS duration,
+                   SUM(bytes_sent) AS bytes_sent, SUM(bytes_received) AS bytes_received, SUM(files) AS files
+            FROM stage_results WHERE run_date >= ? GROUP BY run_date, stage ORDER BY run_date, stage
+            """,
+            (get_sub_day_date(days),)
+        )
+        return [dict(row) for row in rows]
+
+
+def find_regressions(stage: str = "run_rsync_homedir", factor: float = 2.0, days: int = 14, min_duration: float = 60) -> list:
+    """
+    Находит аккаунты, у которых этап в текущем запуске выполнялся в factor раз дольше
+    медианы предыдущих запусков.
+
+    :param stage: Название этапа.
+    :param factor: Во сколько раз длительность должна превышать медиану.
+    :param days: Глубина истории для расчёта медианы.
+    :param min_duration: Короткие этапы (в секундах) не учитываются.
+    :return: Список словарей {user, duration, baseline}, отсортированный по убыванию замедления.
+    """
+    current = {}
+    previous = {}
+
+    for row in get_stage_history(stage=stage, days=days):
+        if row["run_date"] == get_current_date():
+            current[row["user"]] = row["duration"]
+        elif row["success"]:
+            previous.setdefault(row["user"], []).append(row["duration"])
+
+    regressions = []
+
+    for user, duration in current.items():
+        if duration < min_duration or user not in previous:
+            continue
+
+        history = sorted(previous[user])
+        baseline = history[len(history) // 2]
+
+        if baseline and duration > baseline * factor:
+            regressions.append({"user": user, "duration": duration, "baseline": baseline})
+
+    return sorted(regressions, key=lambda item: item["duration"] / item["baseline"], reverse=True)
+
+
+#### SNAPSHOT USAGE ####
+def record_snapshot_usage(snapshot: str, usage: dict) -> None:
+    """
+    Сохраняет объём копии по аккаунтам (retention/capacity.py).
+
+    :param snapshot: Дата ежедневной копии.
+    :param usage: Словарь {user: {total_bytes, unique_bytes, shared_bytes, files}}.
+    """
+    try:
+        with get_connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO snapshot_usage VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(snapshot, user, get_current_date(), values["total_bytes"], values["unique_bytes"], values["shared_bytes"], values["files"])
+                 for user, values in usage.items()]
+            )
+    except Exception as exc:
+        mainLog.error(f"[record_snapshot_usage] [{snapshot}] Не удалось сохранить объём копии: {exc.args}")
+
+
+def get_snapshot_usage(snapshot: str) -> dict:
+    """ Возвращает сохранённый объём копии: {user: {total_bytes, unique_bytes, shared_bytes, files, analysed_on}}. """
+    with get_connection() as conn:
+        rows = conn.execute("SELECT * FROM snapshot_usage WHERE snapshot = ?", (snapshot,))
+        return {row["user"]: dict(row) for row in rows}
+
+
+def get_growth_history(days: int = 14) -> list:
+    """
+    Возвращает прирост данных за каждый запуск: уникальный объём копий, посчитанный в день их создания
+    (данные, записанные запуском, а не связанные hardlink'ами с предыдущими копиями).
+
+    :return: Список словарей {snapshot, unique_bytes, total_bytes}, отсортированный по дате.
+    """
+    with get_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT snapshot, SUM(unique_bytes) AS unique_bytes, SUM(total_bytes) AS total_bytes FROM snapshot_usage
+            WHERE snapshot = analysed_on AND snapshot >= ? GROUP BY snapshot ORDER BY snapshot
+            """,
+            (get_sub_day_date(days),)
+        )
+        return [dict(row) for row in rows]
@@ -0,0 +1,97 @@
+import os
+
+from datetime import datetime
+
+from utils.log import mainLog
+from utils.fs_utils import get_base_dir
+from utils.date_utils import get_current_date
+
+# Пользователь, под которым в журнал записываются общие шаги запуска (create_additional_copy и т.д.)
+GLOBAL_USER = "-"
+
+JOURNAL_STARTED = "started"
+JOURNAL_DONE = "done"
+JOURNAL_FAILED = "failed"
+
+
+def get_journal_path(run_date: str = None) -> str:
+    return f"{get_base_dir()}/logs/journal-{run_date or get_current_date()}.log"
+
+
+def journal_record(user: str, stage: str, status: str) -> None:
+    """
+    Добавляет запись в журнал текущего запуска.
+
+    Журнал пишется только дописыванием, каждая запись — одна строка, записанная одним write()
+    с fsync, поэтому он переживает падение процесса или перезагрузку сервера. Запись
+    выполняется процессом этапа напрямую, без передачи планировщику.
+
+    :param user: Имя пользователя cPanel или GLOBAL_USER.
+    :param stage: Название этапа или шага.
+    :param status: JOURNAL_STARTED, JOURNAL_DONE или JOURNAL_FAILED.
+    """
+    line = f"{datetime.now().isoformat(timespec='seconds')}\t{user}\t{stage}\t{status}\n"
+
+    try:
+        fd = os.open(get_journal_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+        try:
+            os.write(fd, line.encode())
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    except Exception as exc:
+        mainLog.error(f"[journal_record] [{user}] [{stage}] Не удалось записать в журнал: {exc.args}")
+
+
+def load_completed(run_date: str = None) -> set:
+    """
+    Возвращает множество (user, stage), завершённых успешно в запуске за указанную дату.
+
+    Этапы, которые были начаты, но не завершены (или завершены с ошибкой), в множество
+    не попадают и при возобновлении выполняются заново. Последняя незавершённая строка
+    (обрыв записи) игнорируется.
+    """
+    completed = set()
+
+    try:
+        with open(get_journal_path(run_date)) as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+
+                if len(parts) != 4 or not line.endswith("\n"):
+                    continue
+
+                _, user, stage, status = parts
+
+                if status == JOURNAL_DONE:
+                    completed.add((user, stage))
+                else:
+                    completed.discard((user, stage))
+
+    except FileNotFoundError:
+        pass
+
+    return completed
+
+
+def run_journaled_step(name: str, func, completed: set = None):
+    """
+    Выполняет общий шаг запуска с записью в журнал.
+
+    :param name: Название шага.
+    :param func: Функция без аргументов.
+    :param completed: Результат load_completed в режиме возобновления или None.
+    :return: Результат функции или None, если шаг уже был выполнен.
+    """
+    if completed and (GLOBAL_USER, name) in completed:
+        mainLog.info(f"[run_journaled_step] [{name}] Уже выполнен в прерванном запуске, пропускаем.")
+        return None
+
+    journal_record(GLOBAL_USER, name, JOURNAL_STARTED)
+
+    result = func()
+
+    journal_record(GLOBAL_USER, name, JOURNAL_DONE)
+    return result
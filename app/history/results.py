@@ -0,0 +1,84 @@
+"""
+    Канал результатов этапов конвейера: процессы этапов передают планировщику записи
+    фиксированного размера (RECORD) через multiprocessing.Queue, без процесса Manager.
+
+    Планировщик забирает записи в цикле опроса, сохраняет их в историю запусков одной
+    транзакцией (вместо соединения с базой в каждом процессе этапа) и собирает
+    результаты этапов аккаунтов для отчёта.
+"""
+import struct
+
+from queue import Empty
+from datetime import datetime
+from multiprocessing import Queue
+
+from history.history import STAGES, METRIC_FIELDS, record_stage_results
+
+# Пользователь, индекс этапа в STAGES, успех, маска заданных метрик, время запуска (timestamp), длительность, метрики METRIC_FIELDS
+RECORD = struct.Struct(f"<32sB?Bdd{len(METRIC_FIELDS)}q")
+USER_SIZE = 32
+
+
+def pack_result(user: str, stage: str, started_at: datetime, duration: float, success: bool, metrics: dict) -> bytes:
+    mask = 0
+    values = []
+
+    for index, field in enumerate(METRIC_FIELDS):
+        if metrics.get(field) is not None:
+            mask |= 1 << index
+
+        values.append(int(metrics.get(field) or 0))
+
+    return RECORD.pack(user.encode(), STAGES.index(stage), success, mask, started_at.timestamp(), duration, *values)
+
+
+def unpack_result(record: bytes) -> dict:
+    """ :return: Словарь {user, stage, started_at, duration, success, <METRIC_FIELDS>}, незаданные метрики — None. """
+    user, stage, success, mask, started_at, duration, *values = RECORD.unpack(record)
+
+    result = {"user": user.rstrip(b"\0").decode(), "stage": STAGES[stage], "started_at": datetime.fromtimestamp(started_at),
+              "duration": duration, "success": success}
+
+    for index, (field, value) in enumerate(zip(METRIC_FIELDS, values)):
+        result[field] = value if mask & (1 << index) else None
+
+    return result
+
+
+class StageResultChannel:
+    """ Очередь записей RECORD от процессов этапов к планировщику. """
+
+    def __init__(self):
+        self.queue = Queue()
+
+    def send(self, user: str, stage: str, started_at: datetime, duration: float, success: bool, **metrics) -> bool:
+        """
+        Передаёт результат этапа (вызывается в процессе этапа через track_stage).
+
+        :return: False, если результат не помещается в запись (этап не из STAGES, длинное имя пользователя):
+                 такой результат сохраняется в историю процессом этапа.
+        """
+        if stage not in STAGES or len(user.encode()) > USER_SIZE:
+            return False
+
+        self.queue.put(pack_result(user, stage, started_at, duration, success, metrics))
+        return True
+
+    def receive(self) -> list:
+        """
+        Забирает поступившие записи без ожидания и сохраняет их в историю запусков.
+
+        :return: Список результатов (см. unpack_result).
+        """
+        results = []
+
+        while True:
+            try:
+                results.append(unpack_result(self.queue.get_nowait()))
+            except Empty:
+                break
+
+        if results:
+            record_stage_results(results)
+
+        return results
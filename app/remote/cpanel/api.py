@@ -1,44 +1,27 @@
-import json
-
 from utils.log import mainLog
 from remote.cpanel.account import CpanelAccount
 from utils.exc_handler import get_current_func_name, log_and_send
 
-from utils.remote_exec import run_ssh_command_on_prod
+from remote.cpanel.inventory import get_inventory
 
 def get_account_count(reseller: str) -> tuple:
-    """ Получение списка пользователей у основного ресселера """
+    """ Получение количества активных и приостановленных пользователей у основного ресселера (по снимку get_inventory) """
     try:
-        cmd = "/sbin/whmapi1 acctcounts user={0} --output=json".format(reseller)
-        result = run_ssh_command_on_prod(cmd)
-
-        if not result['success']:
-            raise Exception(f"[get_account_count] Ошибка выполнения команды: {result['stderr']}")
-
-        data = json.loads(result["stdout"])["data"]["reseller"]
+        accounts = [account for account in get_inventory() if account["owner"] == reseller]
+        suspended = sum(1 for account in accounts if int(account["suspended"]))
 
-        return (data["active"], data["suspended"])
+        return (len(accounts) - suspended, suspended)
 
     except Exception as exc:
         log_and_send(get_current_func_name(), exc)
         return ()
 
 def get_account_list(reseller: str = None) -> list:
-    """ Получение списка пользователей из whm api.
+    """ Получение списка пользователей из whm api (по снимку get_inventory).
         Без указания параметра возвращает список всех пользователей.
         При указании параметра reseller возвращает пользователей реселлера."""
     try:
-        args = "searchtype=owner search=^{0}$".format(reseller) if reseller else ""
-        cmd = f"/sbin/whmapi1 listaccts {args} want=user --output=json"
-
-        result = run_ssh_command_on_prod(cmd)
-
-        if not result['success']:
-            raise Exception(f"[get_account_dict] Ошибка выполнения команды: {result['stderr']}")
-        
-        data = json.loads(result["stdout"])["data"]["acct"]
-
-        return [value["user"] for value in data]
+        return [account["user"] for account in get_inventory() if not reseller or account["owner"] == reseller]
 
     except Exception as exc:
         log_and_send(get_current_func_name(), exc)
@@ -46,15 +29,7 @@ def get_account_list(reseller: str = None) -> list:
 
 def get_account_dict(reseller: str) -> dict:
     try:
-        mainLog.info("[get_account_dict] Получаем список аккаунтов с whmapi1...")
-        cmd = f"/sbin/whmapi1 listaccts searchtype=owner search=^{reseller}$ want=user,uid,partition,suspended --output=json"
-
-        result = run_ssh_command_on_prod(cmd)
-      
-        if not result['success']:
-            raise Exception(f"[get_account_dict] Ошибка выполнения команды: {result['stderr']}")
-          
-        data = json.loads(result["stdout"])["data"]["acct"]
+        data = [account for account in get_inventory() if account["owner"] == reseller]
 
         cpane_accounts_dict = {}
 
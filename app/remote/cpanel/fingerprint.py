@@ -0,0 +1,260 @@
+import os
+import json
+import hashlib
+
+from utils.log import mainLog
+from utils.date_utils import get_current_date
+from utils.remote_exec import run_ssh_command_on_prod
+
+from config.const import PKGACCT_TIMEOUT, ACCOUNT_DB_BACKUP_ENABLE
+
+# Файл с отпечатком метаданных аккаунта в копии pkgacct
+PKGACCT_FINGERPRINT_FILE = ".pkgacct_fingerprint"
+
+# Метаданные cPanel, которые попадают в pkgacct (без домашнего каталога): пользователи, userdata (включая *.crt),
+# DNS-зоны, алиасы и фильтры почты, crontab, SSL-сертификаты доменов, FTP-аккаунты, базы данных cPanel
+FINGERPRINT_DIRS = (
+    "/var/cpanel/users /var/cpanel/userdata /var/named /etc/valiases /etc/vfilters "
+    "/var/spool/cron /var/cpanel/ssl/apache_tls /var/cpanel/ssl/domain_tls /etc/proftpd /var/cpanel/databases"
+)
+
+# Строка T: схема, таблица, CREATE_TIME, UPDATE_TIME, TABLE_ROWS, DATA_LENGTH, INDEX_LENGTH, TABLE_TYPE
+TABLES_SQL = (
+    "SELECT 'T', TABLE_SCHEMA, TABLE_NAME, IFNULL(CREATE_TIME, ''), IFNULL(UPDATE_TIME, ''), "
+    "IFNULL(TABLE_ROWS, ''), IFNULL(DATA_LENGTH, ''), IFNULL(INDEX_LENGTH, ''), TABLE_TYPE FROM information_schema.TABLES "
+    "WHERE TABLE_SCHEMA NOT IN ('mysql', 'information_schema', 'performance_schema', 'sys')"
+)
+
+# Строка G: пользователь MySQL и строка mysql.user / mysql.db (пользователи баз данных и их привилегии)
+GRANTS_SQL = "SELECT 'G', User, u.* FROM mysql.user u; SELECT 'G', User, d.* FROM mysql.db d"
+
+# Команда, выводящая строку P с pid mysqld
+MYSQLD_PID_CMD = "echo \"P\t$(/sbin/pidof mysqld mariadbd)\""
+
+# Отпечатки, таблицы аккаунтов и pid mysqld текущего запуска (дочерние процессы получают их при fork)
+_fingerprints = {}
+_tables = None
+_mysqld_pid = None
+
+
+def get_fingerprint_command(homes: dict) -> str:
+    """
+    Команда для одного ssh-вызова, выводящая строки с префиксом:
+    U — владелец домена (/etc/userdomains), F — файл метаданных (путь, размер, mtime),
+    P — pid mysqld, D — dbindex cPanel (владельцы баз), T — метаданные таблиц,
+    G — пользователи MySQL и их привилегии.
+    """
+    etc_dirs = " ".join(f"{home}/etc" for home in homes.values())
+
+    return (
+        "/bin/awk -F': ' '{printf \"U\\t%s\\t%s\\n\", $2, $1}' /etc/userdomains; "
+        f"/bin/find {FINGERPRINT_DIRS} {etc_dirs} -printf 'F\\t%p\\t%s\\t%T@\\n' 2>/dev/null; "
+        f"{MYSQLD_PID_CMD}; "
+        "echo \"D\t$(/bin/tr -d '\\n' < /var/cpanel/databases/dbindex.db.json 2>/dev/null)\"; "
+        f"/usr/bin/mysql -N -B -e \"{TABLES_SQL}\"; "
+        f"/usr/bin/mysql -N -B -e \"{GRANTS_SQL}\""
+    )
+
+
+def get_path_owner(path: str, homes: dict, domains: dict) -> str:
+    """ Возвращает пользователя, к которому относится файл метаданных, или None. """
+    parts = path.split("/")
+
+    if path.startswith("/var/cpanel/users/") or path.startswith("/var/cpanel/userdata/"):
+        return parts[4] if len(parts) > 4 else None
+
+    if path.startswith("/var/named/") and path.endswith(".db"):
+        return domains.get(parts[3][:-3])
+
+    if path.startswith("/etc/valiases/") or path.startswith("/etc/vfilters/"):
+        return domains.get(parts[3])
+
+    if path.startswith("/var/spool/cron/"):
+        return parts[4] if len(parts) > 4 else None
+
+    if path.startswith("/etc/proftpd/"):
+        return parts[3] if len(parts) > 3 else None
+
+    # /var/cpanel/databases/<user>.json
+    if path.startswith("/var/cpanel/databases/"):
+        return parts[4].rsplit(".", 1)[0] if len(parts) > 4 else None
+
+    # /var/cpanel/ssl/apache_tls/<домен>/..., /var/cpanel/ssl/domain_tls/<домен>/...
+    if path.startswith("/var/cpanel/ssl/"):
+        return domains.get(parts[5]) if len(parts) > 5 else None
+
+    for user, home in homes.items():
+        if path.startswith(f"{home}/etc"):
+            return user
+
+    return None
+
+
+def has_unknown_update_time(fields: list) -> bool:
+    """ Таблица (не представление) с пустым UPDATE_TIME: по метаданным нельзя определить, менялись ли данные. """
+    return len(fields) > 8 and not fields[4] and fields[8] != "VIEW"
+
+
+def parse_fingerprint_output(lines: list, homes: dict) -> tuple:
+    """
+    Разбирает вывод get_fingerprint_command.
+
+    :param lines: Строки вывода.
+    :param homes: Словарь {user: домашний каталог}.
+    :return: ({user: отпечаток (sha1 hex)}, {user: [поля строк T]}, pid mysqld) для пользователей из homes.
+             Отпечаток не возвращается для аккаунтов без /var/cpanel/users/<user> и, без ACCOUNT_DB_BACKUP_ENABLE,
+             для аккаунтов с таблицами без UPDATE_TIME.
+    """
+    domains = {}
+    files = {user: [] for user in homes}
+    tables = []
+    grants = []
+    mysqld_pid = ""
+    dbindex = {}
+
+    for line in lines:
+        fields = line.split("\t")
+
+        if fields[0] == "U" and len(fields) == 3:
+            domains[fields[2]] = fields[1]
+
+        elif fields[0] == "F" and len(fields) == 4:
+            files.setdefault(fields[1], []).append(line)
+
+        elif fields[0] == "P":
+            mysqld_pid = fields[1] if len(fields) > 1 else ""
+
+        elif fields[0] == "D" and len(fields) == 2 and fields[1]:
+            try:
+                dbindex = json.loads(fields[1]).get("MYSQL", {})
+            except ValueError as exc:
+                mainLog.warning(f"[parse_fingerprint_output] Некорректный dbindex.db.json: {exc.args}")
+
+        elif fields[0] == "T":
+            tables.append(fields)
+
+        elif fields[0] == "G" and len(fields) > 2:
+            grants.append((fields[1], line))
+
+    metadata = {user: [] for user in homes}
+    account_tables = {user: [] for user in homes}
+
+    for path, entries in files.items():
+        owner = get_path_owner(path, homes, domains)
+
+        if owner in metadata:
+            metadata[owner] += entries
+
+    # Владелец базы по dbindex cPanel, при отсутствии записи — по префиксу <user>_
+    for fields in tables:
+        owner = dbindex.get(fields[1]) or fields[1].split("_", 1)[0]
+
+        if owner in metadata:
+            metadata[owner].append("\t".join(fields))
+            account_tables[owner].append(fields)
+
+    # Пользователи MySQL аккаунта: <user> и <user>_*
+    for mysql_user, line in grants:
+        owner = mysql_user if mysql_user in metadata else mysql_user.split("_", 1)[0]
+
+        if owner in metadata:
+            metadata[owner].append(line)
+
+    fingerprints = {}
+
+    for user, entries in metadata.items():
+        # Без файлов метаданных изменения определить нельзя
+        if not any(entry.startswith("F\t/var/cpanel/users/") for entry in entries):
+            continue
+
+        # Пустой UPDATE_TIME (таблицы в общем табличном пространстве InnoDB) не меняется при изменении данных:
+        # если базы данных не копирует отдельный этап, pkgacct для такого аккаунта выполняется всегда
+        if not ACCOUNT_DB_BACKUP_ENABLE and any(has_unknown_update_time(fields) for fields in account_tables[user]):
+            continue
+
+        # UPDATE_TIME InnoDB хранится только в памяти mysqld, поэтому перезапуск mysqld меняет отпечаток
+        if any(entry.startswith("T\t") for entry in entries):
+            entries.append(f"P\t{mysqld_pid}")
+
+        fingerprints[user] = hashlib.sha1("\n".join(sorted(entries)).encode()).hexdigest()
+
+    return fingerprints, account_tables, mysqld_pid
+
+
+def prefetch_pkgacct_fingerprints(acc_partition_list: dict) -> None:
+    """
+    Одним ssh-вызовом получает отпечатки метаданных всех аккаунтов запуска:
+    /var/cpanel/users/<user>, userdata, DNS-зоны, алиасы и фильтры почты, crontab, SSL-сертификаты,
+    FTP-аккаунты, <home>/etc, метаданные таблиц баз данных аккаунта и привилегии его пользователей MySQL.
+
+    При ошибке отпечатки не заполняются и pkgacct выполняется для всех аккаунтов.
+
+    :param acc_partition_list: Словарь {partition: {user: [CpanelAccount]}}
+    """
+    global _fingerprints, _tables, _mysqld_pid
+
+    homes = {
+        user: f"/{partition}/{user}"
+        for partition, users in acc_partition_list.items()
+        for user in users
+    }
+
+    lines = []
+
+    try:
+        result = run_ssh_command_on_prod(get_fingerprint_command(homes), PKGACCT_TIMEOUT, line_parsers=[lines.append])
+    except Exception as exc:
+        mainLog.warning(f"[prefetch_pkgacct_fingerprints] Не удалось получить отпечатки: {exc.args}")
+        return
+
+    if not result['success']:
+        mainLog.warning(f"[prefetch_pkgacct_fingerprints] Не удалось получить отпечатки: {result['stderr']}")
+        return
+
+    _fingerprints, _tables, _mysqld_pid = parse_fingerprint_output(lines, homes)
+    mainLog.info(f"[prefetch_pkgacct_fingerprints] Получены отпечатки {len(_fingerprints)} из {len(homes)} аккаунтов")
+
+
+def get_pkgacct_fingerprint(username: str) -> str:
+    return _fingerprints.get(username)
+
+
+def get_prefetched_tables(username: str):
+    """
+    Таблицы баз данных аккаунта из prefetch_pkgacct_fingerprints.
+
+    :return: ([поля строк T], pid mysqld) или None, если отпечатки не получены.
+    """
+    if _tables is None or username not in _tables:
+        return None
+
+    return _tables[username], _mysqld_pid
+
+
+def read_fingerprint_file(backup_path: str) -> dict:
+    """
+    Читает отпечаток из копии pkgacct.
+
+    :return: Словарь {'fingerprint', 'date', 'carried'} или None.
+    """
+    try:
+        with open(f"{backup_path}/{PKGACCT_FINGERPRINT_FILE}") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_fingerprint_file(backup_path: str, fingerprint: str, carried: int = 0) -> None:
+    """
+    Записывает отпечаток в копию pkgacct через временный файл: файл предыдущей копии
+    может быть связан hardlink'ом с текущим и не должен изменяться на месте.
+
+    :param carried: Количество подряд перенесённых без pkgacct копий.
+    """
+    path = f"{backup_path}/{PKGACCT_FINGERPRINT_FILE}"
+    tmp = f"{path}.tmp"
+
+    with open(tmp, "w") as f:
+        json.dump({"fingerprint": fingerprint, "date": get_current_date(), "carried": carried}, f)
+
+    os.replace(tmp, path)
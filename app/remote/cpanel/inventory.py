@@ -0,0 +1,93 @@
+import json
+import time
+
+from utils.log import mainLog
+from utils.fs_utils import get_base_dir
+from utils.remote_exec import run_ssh_command_on_prod
+from notify.tg import send_telegram_message
+
+from config.const import INVENTORY_TTL, INVENTORY_FALLBACK_MAX_AGE
+
+# Все поля аккаунтов, которые используются при планировании и в отчете
+INVENTORY_FIELDS = "user,uid,partition,suspended,owner"
+
+# Снимок в памяти процесса (дочерние процессы получают его при fork)
+_inventory = None
+
+
+def get_inventory_path() -> str:
+    return f"{get_base_dir()}/logs/inventory.json"
+
+
+def fetch_inventory() -> dict:
+    """
+    Получает список всех аккаунтов одним вызовом whmapi1 listaccts.
+
+    :return: Снимок {'fetched_at': timestamp, 'accounts': [{user, uid, partition, suspended, owner}]}.
+    """
+    mainLog.info("[fetch_inventory] Получаем список аккаунтов с whmapi1...")
+
+    # Вывод runner'а ограничен последними строками, поэтому полный JSON собирается обработчиком строк
+    output = []
+    result = run_ssh_command_on_prod(f"/sbin/whmapi1 listaccts want={INVENTORY_FIELDS} --output=json", line_parsers=[output.append])
+
+    if not result['success']:
+        raise Exception(f"[fetch_inventory] Ошибка выполнения команды: {result['stderr']}")
+
+    accounts = json.loads("\n".join(output))["data"]["acct"]
+
+    return {"fetched_at": time.time(), "accounts": accounts}
+
+
+def load_inventory():
+    try:
+        with open(get_inventory_path()) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as exc:
+        mainLog.warning(f"[load_inventory] Не удалось прочитать {get_inventory_path()}: {exc.args}")
+        return None
+
+
+def save_inventory(inventory: dict) -> None:
+    try:
+        with open(get_inventory_path(), "w") as f:
+            json.dump(inventory, f)
+    except Exception as exc:
+        mainLog.warning(f"[save_inventory] Не удалось сохранить {get_inventory_path()}: {exc.args}")
+
+
+def get_inventory() -> list:
+    """
+    Возвращает список аккаунтов WHM из снимка текущего запуска.
+
+    Снимок загружается один раз за запуск и дальше отдаётся из памяти процесса, поэтому
+    планирование и отчет видят одинаковый список аккаунтов. На диске (logs/inventory.json)
+    снимок актуален INVENTORY_TTL секунд и переиспользуется при перезапуске (например --resume).
+    Если запрос к WHM завершился ошибкой, используется устаревший снимок с диска не старше
+    INVENTORY_FALLBACK_MAX_AGE секунд (с уведомлением в Telegram), иначе ошибка передаётся вызывающему.
+
+    :return: Список словарей {user, uid, partition, suspended, owner}.
+    """
+    global _inventory
+
+    if _inventory:
+        return _inventory["accounts"]
+
+    inventory = load_inventory()
+
+    if not inventory or time.time() - inventory["fetched_at"] >= INVENTORY_TTL:
+        try:
+            inventory = fetch_inventory()
+            save_inventory(inventory)
+        except Exception as exc:
+            if not inventory or time.time() - inventory["fetched_at"] >= INVENTORY_FALLBACK_MAX_AGE:
+                raise
+
+            message = f"[get_inventory] Не удалось обновить список аккаунтов, используется снимок от {time.ctime(inventory['fetched_at'])}: {exc.args}"
+            mainLog.warning(message)
+            send_telegram_message(message)
+
+    _inventory = inventory
+    return _inventory["accounts"]
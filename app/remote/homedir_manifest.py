@@ -0,0 +1,131 @@
+import os
+import json
+import shlex
+
+from pathlib import Path
+
+from utils.log import mainLog
+from utils.date_utils import get_current_date
+from utils.remote_exec import run_ssh_command_on_prod
+
+from config.const import (
+    HOMEDIR_MANIFEST_PYTHON,
+    HOMEDIR_MANIFEST_REMOTE_DIR,
+    HOMEDIR_MANIFEST_KEEP,
+    RSYNC_HOMEDIR_TIMEOUT
+)
+
+# Файл в копии аккаунта: манифест домашнего каталога, по которому она синхронизирована
+HOMEDIR_MANIFEST_FILE = ".homedir_manifest"
+
+
+def get_manifest_helper_source() -> str:
+    return (Path(__file__).parent / "manifest_helper.py").read_text()
+
+
+class ManifestChanges:
+    """
+        Обработчик строк вывода manifest_helper: пути изменённых файлов записываются в файл
+        для rsync --files-from, удалённые — в отдельный файл.
+    """
+
+    def __init__(self, changed_path: str, deleted_path: str):
+        self.changed_path = changed_path
+        self.deleted_path = deleted_path
+        self.changed = open(changed_path, "w")
+        self.deleted = open(deleted_path, "w")
+        self.base_missing = False
+        self.unsupported = False
+        self.summary = None
+        self.tree = {}
+
+    def __call__(self, line: str) -> None:
+        kind, _, rel = line.partition("\t")
+
+        if kind == "C":
+            self.changed.write(rel + "\n")
+        elif kind == "D":
+            self.deleted.write(rel + "\n")
+        elif kind == "B":
+            self.base_missing = True
+        elif kind == "X":
+            self.unsupported = True
+        elif kind == "T":
+            path, size, files = rel.rsplit("\t", 2)
+            self.tree[path] = [int(size), int(files)]
+        elif kind == "S":
+            entries, changed, deleted = (int(value) for value in rel.split("\t"))
+            self.summary = {"entries": entries, "changed": changed, "deleted": deleted}
+
+    def close(self) -> None:
+        self.changed.close()
+        self.deleted.close()
+
+    def cleanup(self) -> None:
+        for path in (self.changed_path, self.deleted_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def run_manifest_helper(username: str, root: str, base_id: str, work_dir: str):
+    """
+    Выполняет manifest_helper на производственном сервере: сохраняет манифест домашнего каталога
+    текущей даты и выводит изменения относительно манифеста base_id.
+
+    :param username: Имя пользователя (директория манифестов на производственном сервере).
+    :param root: Домашний каталог на производственном сервере.
+    :param base_id: Идентификатор (дата) манифеста предыдущей копии или None.
+    :param work_dir: Локальная директория для списков изменений.
+    :return: ManifestChanges или None при ошибке.
+    """
+    changes = ManifestChanges(f"{work_dir}/.homedir_changed", f"{work_dir}/.homedir_deleted")
+
+    args = [root, f"{HOMEDIR_MANIFEST_REMOTE_DIR}/{username}", base_id or "-", get_current_date(), str(HOMEDIR_MANIFEST_KEEP)]
+    cmd = f"{HOMEDIR_MANIFEST_PYTHON} -c {shlex.quote(get_manifest_helper_source())} {shlex.join(args)}"
+
+    try:
+        result = run_ssh_command_on_prod(cmd, RSYNC_HOMEDIR_TIMEOUT, line_parsers=[changes])
+    finally:
+        changes.close()
+
+    if not result['success'] or not changes.summary:
+        mainLog.warning(f"[run_manifest_helper] [{username}] Не удалось построить манифест: {result['stderr']}")
+        changes.cleanup()
+        return None
+
+    return changes
+
+
+def read_manifest_marker(backup_path: str):
+    """
+    Читает отметку манифеста из копии аккаунта.
+
+    :return: Словарь {'id', 'chain', 'entries', 'changed', 'deleted', 'tree'} или None.
+    """
+    try:
+        with open(f"{backup_path}/{HOMEDIR_MANIFEST_FILE}") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest_marker(backup_path: str, chain: int, summary: dict, tree: dict = None) -> None:
+    """
+    Записывает отметку манифеста текущей даты.
+
+    :param chain: Количество подряд выполненных синхронизаций по списку изменений (0 — полная синхронизация).
+    :param tree: Размеры директорий {путь: [байт, файлов]} для разбиения синхронизации на части.
+    """
+    path = f"{backup_path}/{HOMEDIR_MANIFEST_FILE}"
+
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"id": get_current_date(), "chain": chain, **summary, "tree": tree or {}}, f)
+
+    os.replace(f"{path}.tmp", path)
+
+
+def remove_manifest_marker(backup_path: str) -> None:
+    path = f"{backup_path}/{HOMEDIR_MANIFEST_FILE}"
+
+    if os.path.lexists(path):
+        os.remove(path)
@@ -0,0 +1,186 @@
+"""
+    Скрипт, выполняемый на производственном сервере (python3 -c), без зависимостей от проекта.
+
+    Обходит домашний каталог аккаунта, сохраняет манифест (путь, тип, размер, mtime, inode, права,
+    владелец) в <state_dir>/<new_id>.tsv.gz и сравнивает его с манифестом <base_id>.
+
+    Аргументы: <root> <state_dir> <base_id|-> <new_id> <keep>
+
+    Вывод (построчно):
+        C\\t<путь>  — новый или изменённый файл, ссылка или директория
+        D\\t<путь>  — удалённый путь (или изменивший тип, после него следует C)
+        B          — манифест base_id отсутствует, изменения не выводятся
+        X          — есть имена, которые нельзя передать списком (не UTF-8, \\t, \\n)
+        T\\t<путь>\\t<байт>\\t<файлов> — размер директорий первого уровня и второго уровня
+                     внутри крупных (> TREE_SPLIT_SHARE объёма) директорий, для разбиения на части
+        S\\t<записей>\\t<изменено>\\t<удалено>
+"""
+import os
+import sys
+import gzip
+import stat
+
+
+# Доля объёма каталога, начиная с которой выводятся размеры вложенных директорий
+TREE_SPLIT_SHARE = 0.1
+
+
+def get_key(rel: bytes) -> list:
+    """ Порядок сравнения совпадает с порядком обхода walk (по компонентам пути). """
+    return rel.split(b"/")
+
+
+def walk(root: bytes, rel: bytes = b""):
+    """ Обход в глубину с сортировкой имён, возвращает (путь, запись манифеста). """
+    path = root + b"/" + rel if rel else root
+
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        return
+
+    for entry in entries:
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+
+        if stat.S_ISDIR(st.st_mode):
+            kind = b"d"
+        elif stat.S_ISREG(st.st_mode):
+            kind = b"f"
+        elif stat.S_ISLNK(st.st_mode):
+            kind = b"l"
+        else:
+            continue
+
+        entry_rel = rel + b"/" + entry.name if rel else entry.name
+        values = (kind, st.st_size, st.st_mtime_ns, st.st_ino, st.st_mode, st.st_uid, st.st_gid)
+
+        yield entry_rel, b"\t".join(value if isinstance(value, bytes) else str(value).encode() for value in values)
+
+        if kind == b"d":
+            yield from walk(root, entry_rel)
+
+
+def read_manifest(path: str):
+    with gzip.open(path, "rb") as f:
+        for line in f:
+            rel, _, record = line.rstrip(b"\n").partition(b"\t")
+            yield rel, record
+
+
+def is_supported(rel: bytes) -> bool:
+    if b"\n" in rel or b"\t" in rel:
+        return False
+
+    try:
+        rel.decode("utf-8")
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def main(root: str, state_dir: str, base_id: str, new_id: str, keep: int) -> None:
+    out = sys.stdout.buffer
+    os.makedirs(state_dir, mode=0o700, exist_ok=True)
+
+    base_path = f"{state_dir}/{base_id}.tsv.gz"
+    new_path = f"{state_dir}/{new_id}.tsv.gz"
+
+    base_missing = base_id == "-" or not os.path.isfile(base_path)
+    old = iter(()) if base_missing else read_manifest(base_path)
+    old_item = next(old, None)
+
+    counts = {"entries": 0, "changed": 0, "deleted": 0}
+    # Размер директорий первого и второго уровня: {путь: [байт, файлов]}
+    tree = {}
+    unsupported = False
+    deleted_dir = None
+
+    def emit(kind: bytes, rel: bytes) -> None:
+        nonlocal unsupported, deleted_dir
+
+        if kind == b"D":
+            # Вложенные пути удалённой директории не выводятся
+            if deleted_dir is not None and rel.startswith(deleted_dir + b"/"):
+                return
+            deleted_dir = rel
+            counts["deleted"] += 1
+        else:
+            counts["changed"] += 1
+
+        if not is_supported(rel):
+            unsupported = True
+            return
+
+        if not base_missing:
+            out.write(kind + b"\t" + rel + b"\n")
+
+    with gzip.open(f"{new_path}.tmp", "wb", compresslevel=1) as manifest:
+        for rel, record in walk(os.fsencode(root)):
+            counts["entries"] += 1
+            manifest.write(rel + b"\t" + record + b"\n")
+
+            parts = rel.split(b"/", 2)
+            size = int(record.split(b"\t", 2)[1]) if record[:1] == b"f" else 0
+
+            if len(parts) == 1 and record[:1] == b"d":
+                tree[rel] = [0, 0]
+
+            for depth in (1, 2):
+                prefix = b"/".join(parts[:depth])
+
+                if len(parts) > depth and prefix in tree:
+                    tree[prefix][0] += size
+                    tree[prefix][1] += 1
+
+            if len(parts) == 2 and record[:1] == b"d":
+                tree[rel] = [0, 0]
+
+            while old_item is not None and get_key(old_item[0]) < get_key(rel):
+                emit(b"D", old_item[0])
+                old_item = next(old, None)
+
+            if old_item is not None and old_item[0] == rel:
+                if old_item[1] != record:
+                    if old_item[1][:1] != record[:1]:
+                        emit(b"D", rel)
+                    emit(b"C", rel)
+                old_item = next(old, None)
+            else:
+                emit(b"C", rel)
+
+        while old_item is not None:
+            emit(b"D", old_item[0])
+            old_item = next(old, None)
+
+    os.replace(f"{new_path}.tmp", new_path)
+
+    # Хранятся последние keep манифестов и манифест base_id
+    manifests = sorted(name for name in os.listdir(state_dir) if name.endswith(".tsv.gz"))
+
+    for name in manifests[:-keep]:
+        if name != f"{base_id}.tsv.gz":
+            os.remove(f"{state_dir}/{name}")
+
+    if base_missing:
+        out.write(b"B\n")
+
+    if unsupported:
+        out.write(b"X\n")
+
+    total = sum(values[0] for rel, values in tree.items() if b"/" not in rel) or 1
+
+    for rel, (size, files) in sorted(tree.items()):
+        top = rel.split(b"/", 1)[0]
+
+        if is_supported(rel) and (rel == top or tree[top][0] > total * TREE_SPLIT_SHARE):
+            out.write(b"T\t" + rel + f"\t{size}\t{files}\n".encode())
+
+    out.write(f"S\t{counts['entries']}\t{counts['changed']}\t{counts['deleted']}\n".encode())
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], int(sys.argv[5]))
@@ -1,12 +1,17 @@
 import socket
-from os import path
+from os import path, listdir
+from datetime import timedelta
 from utils.log import mainLog
 from notify.mail import alertToSupport
 from notify.tg import send_telegram_message
 from utils.date_utils import get_current_date
-from utils.fs_utils import get_list_dirs, get_list_files
+from utils.fs_utils import get_list_dirs
+from utils.disk_utils import sizeof_fmt
 
 from remote.cpanel.api import get_account_count, get_account_list
+from retention.catalog import TIERS, get_tier_snapshots
+from retention.capacity import get_account_usage
+from history.history import ACCOUNT_STAGES, get_stage_history
 
 from config.const import LOCAL_DIST, RESELLER
 
@@ -42,12 +47,32 @@ tr {{
 <p>Активных у ресселера {reseller}:          {resellerActiveUserCount} пользователей.</p>
 <p>Приостановленных у ресселера {reseller}:  {resellerSuspendUserCount} пользователей.</p>
 <p>В текущей резервной копии:                {CurrentBackupUserCount} пользователей.</p>
+{retentionPart}
+{xtrabackupPart}
+
+<table>
+  <tr>
+    <th bgcolor="#FAFAD2">Stage</th>
+    <th bgcolor="#FAFAD2">Workers</th>
+    <th bgcolor="#FAFAD2">Tasks</th>
+    <th bgcolor="#FAFAD2">Failed</th>
+    <th bgcolor="#FAFAD2">MaxQueue</th>
+    <th bgcolor="#FAFAD2">Utilisation</th>
+  </tr>
+
+  {stagePart}
+</table>
+
+<br>
 
 <table>
   <tr>
     <th bgcolor="#FAFAD2">Username</th>
-    <th bgcolor="#FAFAD2">HomeDirFiles</th>
-    <th bgcolor="#FAFAD2">MysqlFiles</th>
+    <th bgcolor="#FAFAD2">Files</th>
+    <th bgcolor="#FAFAD2">Size</th>
+    <th bgcolor="#FAFAD2">New</th>
+    <th bgcolor="#FAFAD2">Linked</th>
+    {stageHeaderPart}
     <th bgcolor="#FAFAD2">ExecutionTime</th>
   </tr>
 
@@ -58,7 +83,83 @@ tr {{
 </html>
 """
 
-def get_total_report(shared_report_dict, executionTime):
+def get_retention_report() -> str:
+    """ Формирует строки с копиями уровней хранения по каталогу хранения. """
+    output = ""
+
+    for tier in TIERS:
+        snapshots = get_tier_snapshots(tier)
+        output += f"<p>Копии {tier}: {', '.join(snapshots) or '-'}.</p>\n"
+
+    return output
+
+
+def get_xtrabackup_report() -> str:
+    """ Формирует строки с итогами передачи и подготовки копии xtrabackup текущего запуска. """
+    output = ""
+
+    for row in get_stage_history(stage="run_xtrabackup_stream", days=0):
+        rate = row['bytes_received'] / row['duration'] / 1024**2 if row['duration'] else 0
+        status = "успешно" if row['success'] else "ошибка"
+        output += f"<p>xtrabackup: {row['bytes_received'] / 1024**3:.2f} GiB за {row['duration']:.0f} с ({rate:.1f} MiB/s), {status}.</p>\n"
+
+    for row in get_stage_history(stage="prepare_mysql_xtrabackup", days=0):
+        status = "готова к восстановлению" if row['success'] else "ошибка подготовки"
+        output += f"<p>xtrabackup prepare: {row['duration']:.0f} с, {status}.</p>\n"
+
+    return output
+
+
+def get_stage_report(stage_stats: dict) -> str:
+    """ Формирует строки таблицы загрузки пулов этапов конвейера. """
+    output = ""
+
+    for stage, values in (stage_stats or {}).items():
+        output += f"""
+            <tr>
+                <td>{stage}</td>
+                <td>{values['workers']}</td>
+                <td>{values['tasks']}</td>
+                <td>{values['failed']}</td>
+                <td>{values['max_queue']}</td>
+                <td>{values['utilisation']:.1f}%</td>
+            </tr>
+            """
+
+    return output
+
+
+def get_account_stage_report(stages: dict, line_color: str, error: str) -> str:
+    """
+    Формирует ячейки этапов аккаунта (ACCOUNT_STAGES): длительность, объём данных,
+    код завершения при ошибке. Ячейка этапа с ошибкой выделяется цветом error.
+
+    :param stages: Результаты этапов аккаунта {этап: результат} (history/results.py).
+    """
+    output = ""
+
+    for stage in ACCOUNT_STAGES:
+        result = stages.get(stage)
+
+        if not result:
+            output += f"<td {line_color}>-</td>"
+            continue
+
+        text = f"{result['duration']:.0f}s"
+        transferred = result['bytes_received'] or result['bytes_sent']
+
+        if transferred:
+            text += f", {sizeof_fmt(transferred)}"
+
+        if not result['success']:
+            text += f", rc={result['returncode']}"
+
+        output += f"<td {line_color if result['success'] else error}>{text}</td>"
+
+    return output
+
+
+def get_total_report(account_results: dict, executionTime, stage_stats=None):
     output = ""
 
     try:
@@ -98,23 +199,29 @@ def get_total_report(shared_report_dict, executionTime):
         success = 'bgcolor="#32CD32"'
         error = 'bgcolor="#ee4c50"'
 
-        mainLog.debug(f"Количество значений в shared_report_dict: {len(shared_report_dict)}")
+        mainLog.debug(f"Количество аккаунтов с результатами этапов: {len(account_results)}")
+
+        # Объём копии по аккаунтам: новые данные запуска и связанные hardlink'ами с предыдущими копиями.
+        # Считается параллельно и кэшируется в истории, повторное формирование отчёта не обходит диск
+        accounts_usage = get_account_usage()
 
         for username in accounts_reseller_list:
             account_homedir_path = f"{backups_current_path}/{username}/homedir"
-            account_mysql_path = f"{backups_current_path}/{username}/mysql" 
-
-            account_homedir_files_count = len(get_list_files(account_homedir_path))
-            account_mysql_files_count = len(get_list_files(account_mysql_path))
+            usage = accounts_usage.get(username)
+            result = account_results.get(username)
 
-            line_color = error if not account_homedir_files_count else success
+            line_color = error if not usage or not path.isdir(account_homedir_path) or not listdir(account_homedir_path) else success
+            usage = usage or {"files": 0, "total_bytes": 0, "unique_bytes": 0, "shared_bytes": 0}
 
             add = f"""
             <tr>
                 <td {line_color}>{username}</td>
-                <td {line_color}>{account_homedir_files_count}</td>
-                <td {line_color}>{account_mysql_files_count}</td>
-                <td {line_color}>{shared_report_dict.get(username)}</td>
+                <td {line_color}>{usage['files']}</td>
+                <td {line_color}>{sizeof_fmt(usage['total_bytes'])}</td>
+                <td {line_color}>{sizeof_fmt(usage['unique_bytes'])}</td>
+                <td {line_color}>{sizeof_fmt(usage['shared_bytes'])}</td>
+                {get_account_stage_report(result['stages'] if result else {}, line_color, error)}
+                <td {line_color}>{timedelta(seconds=int(result['time'])) if result else None}</td>
             </tr>
             """
 
@@ -124,7 +231,10 @@ def get_total_report(shared_report_dict, executionTime):
                 output = output + add
 
         return outputHtml.format(CurrentDate=get_current_date(), backupServer=socket.gethostname(), executionTime=executionTime, accountTotalList=len(accounts_total_list), 
-                                 resellerActiveUserCount=accounts_active_count, resellerSuspendUserCount=accounts_susped_count, CurrentBackupUserCount=len(accounts_current_backup), tablePart=output, reseller=RESELLER)
+                                 resellerActiveUserCount=accounts_active_count, resellerSuspendUserCount=accounts_susped_count, CurrentBackupUserCount=len(accounts_current_backup), tablePart=output, reseller=RESELLER,
+                                 stagePart=get_stage_report(stage_stats), retentionPart=get_retention_report(),
+                                 stageHeaderPart="".join(f'<th bgcolor="#FAFAD2">{stage}</th>' for stage in ACCOUNT_STAGES),
+                                 xtrabackupPart=get_xtrabackup_report())
 
     except Exception as exc:
         mainLog.error(f"[get_total_report][Exception] {exc.args}")
@@ -0,0 +1,280 @@
+import os
+import stat
+import shutil
+
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.log import mainLog
+from utils.date_utils import get_current_date
+from cleanup.cleanup import collect_cleanup_targets
+from history.history import record_snapshot_usage, get_snapshot_usage, get_growth_history
+from database.xtrabackup import get_xtrabackup_chains, get_incremental_base, is_xtrabackup_due
+from database.xtrabackup_prepare import PREPARED_PREFIX
+
+from config.const import (
+    LOCAL_DIST,
+    LOCAL_DIST_ARCHIVE,
+    MYSQL_DUMP_PATH,
+    MYSQL_DUMP_ENABLE,
+    MYSQL_XTRABACKUP_MODE,
+    CAPACITY_WORKERS,
+    CAPACITY_MIN_FREE_PERCENT,
+    CAPACITY_FORECAST_DAYS,
+    CAPACITY_FORECAST_MARGIN
+)
+
+# Записи snapshot_usage для данных запуска вне ежедневной копии (measure_run_extras)
+XTRABACKUP_USAGE = "@xtrabackup"
+PREPARED_USAGE = "@prepared"
+ARCHIVE_USAGE = "@archive"
+# Группа measure_snapshots для файлов верхнего уровня копии
+ROOT_FILES_USAGE = "@files"
+
+# Решения проверки свободного места перед запуском
+ADMISSION_PROCEED = "proceed"
+ADMISSION_PRE_CLEAN = "pre-clean"
+ADMISSION_ABORT = "abort"
+
+
+def measure_tree(paths: list) -> dict:
+    """
+    Считает объём деревьев (копии одного аккаунта в одной или нескольких копиях) по занятым блокам.
+    paths могут содержать и отдельные файлы.
+
+    Уникальный объём — inode, все ссылки на которые находятся внутри paths: это место освободится
+    при удалении paths. Остальное — объём, общий с другими копиями (hardlink'и).
+
+    :return: {total_bytes, unique_bytes, shared_bytes, files}.
+    """
+    counters = {"total": 0, "unique": 0, "files": 0}
+    # inode с несколькими ссылками: [найдено ссылок, st_nlink, байт]
+    links = {}
+    stack = []
+
+    def add(st: os.stat_result) -> None:
+        size = st.st_blocks * 512
+        counters["total"] += size
+        counters["files"] += 1
+
+        if st.st_nlink == 1:
+            counters["unique"] += size
+        else:
+            links.setdefault((st.st_dev, st.st_ino), [0, st.st_nlink, size])[0] += 1
+
+    for path in paths:
+        try:
+            st = os.lstat(path)
+        except OSError as exc:
+            mainLog.warning(f"[measure_tree] Путь недоступен: {path}: {exc}")
+            continue
+
+        if stat.S_ISDIR(st.st_mode):
+            stack.append(path)
+        else:
+            add(st)
+
+    while stack:
+        path = stack.pop()
+
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError as exc:
+            mainLog.warning(f"[measure_tree] Директория недоступна: {path}: {exc}")
+            continue
+
+        for entry in entries:
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+
+            if stat.S_ISDIR(st.st_mode):
+                counters["total"] += st.st_blocks * 512
+                counters["unique"] += st.st_blocks * 512
+                stack.append(entry.path)
+            else:
+                add(st)
+
+    unique = counters["unique"] + sum(size for seen, nlink, size in links.values() if seen >= nlink)
+
+    return {"total_bytes": counters["total"], "unique_bytes": unique, "shared_bytes": counters["total"] - unique, "files": counters["files"]}
+
+
+def measure_snapshots(paths: list, users: list = None) -> dict:
+    """
+    Считает объём копий по аккаунтам параллельно (CAPACITY_WORKERS потоков).
+    Ссылки между разными аккаунтами не учитываются (считаются общими).
+
+    :param paths: Директории копий (LOCAL_DIST/<дата>, копии xtrabackup и т.п.), содержащие директории аккаунтов.
+    :param users: Ограничить список аккаунтов или None — все директории из paths и, отдельной группой
+                  ROOT_FILES_USAGE, файлы верхнего уровня paths (например, ibdata1.qp копии xtrabackup).
+    :return: {user: {total_bytes, unique_bytes, shared_bytes, files}}.
+    """
+    groups = {}
+
+    for path in paths:
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if users is None or entry.name in users:
+                            groups.setdefault(entry.name, []).append(entry.path)
+                    elif users is None:
+                        groups.setdefault(ROOT_FILES_USAGE, []).append(entry.path)
+        except OSError as exc:
+            mainLog.warning(f"[measure_snapshots] Директория недоступна: {path}: {exc}")
+
+    with ThreadPoolExecutor(max_workers=CAPACITY_WORKERS) as executor:
+        jobs = {user: executor.submit(measure_tree, user_paths) for user, user_paths in groups.items()}
+        return {user: job.result() for user, job in jobs.items()}
+
+
+def measure_run_extras(snapshot_date: str) -> dict:
+    """
+    Объём данных запуска вне ежедневной копии, на той же файловой системе: копия xtrabackup
+    текущей даты, подготовленная копия xtrabackup (prepared-*) и архивы удалённых аккаунтов,
+    созданные в этот день.
+
+    :return: {XTRABACKUP_USAGE | PREPARED_USAGE | ARCHIVE_USAGE: {total_bytes, unique_bytes, shared_bytes, files}}.
+    """
+    sources = {XTRABACKUP_USAGE: [f"{MYSQL_DUMP_PATH}/{snapshot_date}"], PREPARED_USAGE: [], ARCHIVE_USAGE: []}
+
+    if os.path.isdir(MYSQL_DUMP_PATH):
+        sources[PREPARED_USAGE] = [entry.path for entry in os.scandir(MYSQL_DUMP_PATH) if entry.name.startswith(PREPARED_PREFIX) and entry.is_dir(follow_symlinks=False)]
+
+    if os.path.isdir(LOCAL_DIST_ARCHIVE):
+        day_start = datetime.strptime(snapshot_date, '%Y-%m-%d').timestamp()
+        sources[ARCHIVE_USAGE] = [entry.path for entry in os.scandir(LOCAL_DIST_ARCHIVE)
+                                  if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime >= day_start]
+
+    return {name: measure_tree(paths) for name, paths in sources.items() if any(os.path.exists(path) for path in paths)}
+
+
+def get_account_usage(snapshot_date: str = None, recompute: bool = False) -> dict:
+    """
+    Объём ежедневной копии по аккаунтам с кэшем в истории: аккаунты, уже сохранённые для этой копии,
+    берутся из истории, остальные считаются measure_snapshots (каждый аккаунт обходится один раз)
+    и сохраняются. Повторный вызов для той же копии не обходит файловую систему.
+
+    Уникальный объём копии текущей даты — данные, записанные запуском, общий — файлы,
+    связанные hardlink'ами с предыдущими копиями.
+
+    :param snapshot_date: Дата ежедневной копии, по умолчанию текущая.
+    :param recompute: Посчитать все аккаунты заново.
+    :return: {user: {total_bytes, unique_bytes, shared_bytes, files}}.
+    """
+    snapshot_date = snapshot_date or get_current_date()
+    snapshot_path = f"{LOCAL_DIST}/{snapshot_date}"
+
+    stored = {} if recompute else get_snapshot_usage(snapshot_date)
+    users = [name for name in os.listdir(snapshot_path) if name not in stored and os.path.isdir(f"{snapshot_path}/{name}")]
+
+    usage = measure_snapshots([snapshot_path], users) if users else {}
+
+    if usage:
+        record_snapshot_usage(snapshot_date, usage)
+        mainLog.debug(f"[get_account_usage] [{snapshot_date}] Посчитано аккаунтов: {len(usage)}, из истории: {len(stored)}")
+
+    return {**stored, **usage}
+
+
+def analyse_snapshot_usage(snapshot_date: str = None, recompute: bool = False) -> dict:
+    """
+    Считает и сохраняет в историю объём копии по аккаунтам (get_account_usage), для копии
+    текущей даты — и данные запуска вне неё (measure_run_extras).
+    По уникальному объёму копии текущей даты строится прогноз прироста (get_growth_forecast).
+
+    :param snapshot_date: Дата ежедневной копии, по умолчанию текущая.
+    :return: Суммарный объём копии {total_bytes, unique_bytes, shared_bytes, files}.
+    """
+    snapshot_date = snapshot_date or get_current_date()
+    usage = get_account_usage(snapshot_date, recompute)
+
+    if snapshot_date == get_current_date():
+        extras = measure_run_extras(snapshot_date)
+        record_snapshot_usage(snapshot_date, extras)
+        usage.update(extras)
+
+    totals = {key: 0 for key in ("total_bytes", "unique_bytes", "shared_bytes", "files")}
+
+    for values in usage.values():
+        for key in totals:
+            totals[key] += values[key]
+
+    mainLog.info(f"[analyse_snapshot_usage] [{snapshot_date}] Всего: {totals['total_bytes'] / 1024**3:.2f} GiB, "
+                 f"уникально: {totals['unique_bytes'] / 1024**3:.2f} GiB, файлов: {totals['files']} (записей: {len(usage)})")
+    return totals
+
+
+def get_expected_full_xtrabackup():
+    """
+    Объём полной копии xtrabackup, если в текущем запуске она будет создана (нет базы для
+    инкрементальной копии): объём последней полной копии.
+
+    :return: Байт или None, если полная копия не ожидается или её объём неизвестен.
+    """
+    if not MYSQL_DUMP_ENABLE or not is_xtrabackup_due() or (MYSQL_XTRABACKUP_MODE == "incremental" and get_incremental_base()):
+        return None
+
+    fulls = [chain for chain in get_xtrabackup_chains().values() if chain["type"] == "full"]
+    return fulls[-1].get("stream", {}).get("bytes") if fulls else None
+
+
+def get_growth_forecast():
+    """
+    Прогноз прироста данных текущего запуска: максимальный прирост за CAPACITY_FORECAST_DAYS дней
+    с запасом CAPACITY_FORECAST_MARGIN. Прирост запуска включает копию xtrabackup, подготовленную
+    копию и архивы (measure_run_extras). Если сегодня ожидается полная копия xtrabackup, прогноз
+    не меньше прироста запуска без копии xtrabackup плюс объём последней полной копии.
+
+    :return: Байт или None, если истории нет.
+    """
+    history = [row for row in get_growth_history(CAPACITY_FORECAST_DAYS) if row["snapshot"] != get_current_date()]
+    full = get_expected_full_xtrabackup()
+
+    if not history:
+        return int(full * CAPACITY_FORECAST_MARGIN) if full else None
+
+    growth = max(row["unique_bytes"] for row in history)
+
+    if full:
+        xtrabackup = {row["snapshot"]: get_snapshot_usage(row["snapshot"]).get(XTRABACKUP_USAGE, {}).get("unique_bytes", 0) for row in history}
+        growth = max(growth, max(row["unique_bytes"] - xtrabackup[row["snapshot"]] for row in history) + full)
+
+    return int(growth * CAPACITY_FORECAST_MARGIN)
+
+
+def get_admission(allow_pre_clean: bool = True) -> dict:
+    """
+    Решение о запуске по свободному месту: свободно не меньше прогноза прироста плюс
+    CAPACITY_MIN_FREE_PERCENT резерва — proceed; хватит после удаления устаревших копий — pre-clean;
+    иначе — abort.
+
+    :param allow_pre_clean: False — после предварительной очистки: при нехватке места только abort.
+    :return: {decision, free, need, forecast, reclaimable}.
+    """
+    usage = shutil.disk_usage(LOCAL_DIST)
+    forecast = get_growth_forecast()
+    need = int((forecast or 0) + usage.total * CAPACITY_MIN_FREE_PERCENT / 100)
+
+    admission = {"decision": ADMISSION_PROCEED, "free": usage.free, "need": need, "forecast": forecast, "reclaimable": None}
+
+    if usage.free >= need:
+        return admission
+
+    admission["decision"] = ADMISSION_ABORT
+
+    if not allow_pre_clean:
+        return admission
+
+    targets = collect_cleanup_targets(dry_run=True, keep_current=True)
+
+    if targets:
+        admission["reclaimable"] = sum(values["unique_bytes"] for values in measure_snapshots(targets).values())
+
+        if usage.free + admission["reclaimable"] >= need:
+            admission["decision"] = ADMISSION_PRE_CLEAN
+
+    return admission
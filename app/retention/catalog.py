@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import time
+
+from datetime import datetime
+
+from utils.log import mainLog
+from utils.fs_utils import make_dir
+from notify.tg import send_telegram_message
+
+from config.const import (
+    LOCAL_DIST,
+    WEEKLY_BACKUP_DAYS_LIMIT,
+    WEEKLY_BACKUP_MIN_COUNT,
+    MONTHLY_BACKUP_DAYS_LIMIT,
+    MONTHLY_BACKUP_MIN_COUNT
+)
+
+# Каталог хранения: для уровня weekly/monthly — список дат ежедневных копий, закреплённых за ним.
+# Хранится рядом с копиями, чтобы закрепления не терялись вместе с logs/
+CATALOG_FILE = f"{LOCAL_DIST}/.retention_catalog.json"
+
+# Уровень хранения -> (срок хранения в днях, минимальное количество копий)
+TIERS = {
+    "weekly":  (WEEKLY_BACKUP_DAYS_LIMIT, WEEKLY_BACKUP_MIN_COUNT),
+    "monthly": (MONTHLY_BACKUP_DAYS_LIMIT, MONTHLY_BACKUP_MIN_COUNT),
+}
+
+BACKUP_DIR_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def load_catalog() -> dict:
+    """ Читает каталог хранения: {уровень: [даты]}. """
+    catalog = {tier: [] for tier in TIERS}
+
+    try:
+        with open(CATALOG_FILE) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return catalog
+
+    for tier in TIERS:
+        catalog[tier] = sorted(set(data.get(tier, [])))
+
+    return catalog
+
+
+def save_catalog(catalog: dict) -> None:
+    with open(f"{CATALOG_FILE}.tmp", "w") as f:
+        json.dump(catalog, f, indent=1)
+
+    os.replace(f"{CATALOG_FILE}.tmp", CATALOG_FILE)
+
+
+def get_view_path(tier: str, snapshot_date: str) -> str:
+    return f"{LOCAL_DIST}/{tier}/{snapshot_date}"
+
+
+def pin_snapshot(tier: str, snapshot_date: str) -> bool:
+    """
+    Закрепляет ежедневную копию за уровнем хранения и создаёт представление
+    LOCAL_DIST/<уровень>/<дата> — символическую ссылку на ../<дата>. Данные не копируются.
+
+    :param tier: Уровень хранения (weekly, monthly).
+    :param snapshot_date: Дата ежедневной копии в формате YYYY-MM-DD.
+    :return: True при успехе, False при ошибке.
+    """
+    snapshot_path = f"{LOCAL_DIST}/{snapshot_date}"
+    view_path = get_view_path(tier, snapshot_date)
+
+    if not os.path.isdir(snapshot_path):
+        mainLog.error(f"[pin_snapshot] [{tier}] Ежедневная копия не найдена: {snapshot_path}")
+        send_telegram_message(f"[pin_snapshot] [{tier}] Ежедневная копия не найдена: {snapshot_path}")
+        return False
+
+    try:
+        catalog = load_catalog()
+
+        if snapshot_date not in catalog[tier]:
+            catalog[tier] = sorted(catalog[tier] + [snapshot_date])
+            save_catalog(catalog)
+
+        # Существующая директория — копия, созданная до каталога хранения, остаётся как есть
+        if make_dir(f"{LOCAL_DIST}/{tier}") and not os.path.lexists(view_path):
+            os.symlink(f"../{snapshot_date}", view_path)
+
+    except Exception as exc:
+        mainLog.error(f"[pin_snapshot] [{tier}] Не удалось закрепить копию {snapshot_date}: {exc}")
+        send_telegram_message(f"[pin_snapshot] [{tier}] Не удалось закрепить копию {snapshot_date}: {exc}")
+        return False
+
+    mainLog.info(f"[pin_snapshot] [{tier}] Копия {snapshot_date} закреплена")
+    return True
+
+
+def unpin_snapshot(tier: str, snapshot_date: str) -> None:
+    """ Снимает закрепление и удаляет представление. Ежедневная копия удаляется очисткой по своему сроку. """
+    catalog = load_catalog()
+
+    if snapshot_date in catalog[tier]:
+        catalog[tier].remove(snapshot_date)
+        save_catalog(catalog)
+
+    view_path = get_view_path(tier, snapshot_date)
+
+    if os.path.islink(view_path):
+        os.remove(view_path)
+
+    mainLog.info(f"[unpin_snapshot] [{tier}] Закрепление копии {snapshot_date} снято")
+
+
+def get_pinned_snapshots(exclude_expired: bool = False) -> set:
+    """
+    Даты ежедневных копий, закреплённых хотя бы за одним уровнем.
+
+    :param exclude_expired: Не учитывать закрепления, которые снимет expire_pins (для оценки очистки без изменений).
+    """
+    expired = set(get_expired_pins()) if exclude_expired else set()
+    return {snapshot_date for tier, dates in load_catalog().items() for snapshot_date in dates if (tier, snapshot_date) not in expired}
+
+
+def get_tier_snapshots(tier: str) -> dict:
+    """
+    Копии уровня хранения: закреплённые в каталоге и созданные до него (директории в LOCAL_DIST/<уровень>).
+
+    :return: Словарь {дата: путь к копии}, отсортированный по дате.
+    """
+    snapshots = {}
+    tier_dir = f"{LOCAL_DIST}/{tier}"
+
+    if os.path.isdir(tier_dir):
+        for name in os.listdir(tier_dir):
+            path = f"{tier_dir}/{name}"
+
+            if BACKUP_DIR_PATTERN.match(name) and os.path.isdir(path) and not os.path.islink(path):
+                snapshots[name] = path
+
+    for snapshot_date in load_catalog()[tier]:
+        snapshots[snapshot_date] = f"{LOCAL_DIST}/{snapshot_date}"
+
+    return dict(sorted(snapshots.items()))
+
+
+def resolve_snapshot(tier: str, snapshot_date: str = None):
+    """
+    Путь к копии уровня хранения для восстановления и отчёта.
+
+    :param snapshot_date: Дата копии, по умолчанию — последняя копия уровня.
+    :return: Путь к директории копии или None, если копия не найдена.
+    """
+    snapshots = get_tier_snapshots(tier)
+
+    if snapshot_date is None:
+        return list(snapshots.values())[-1] if snapshots else None
+
+    return snapshots.get(snapshot_date)
+
+
+def get_expired_pins() -> list:
+    """
+    Закрепления старше срока хранения уровня, если закреплённых копий больше минимального
+    количества (те же правила, что и collect_outdated_dirs).
+
+    :return: Список (уровень, дата).
+    """
+    expired = []
+    catalog = load_catalog()
+
+    for tier, (days_limit, min_count) in TIERS.items():
+        if len(catalog[tier]) <= min_count:
+            continue
+
+        time_limit = int(time.time()) - (days_limit * 86400)
+
+        for snapshot_date in catalog[tier]:
+            if int(datetime.strptime(snapshot_date, '%Y-%m-%d').timestamp()) < time_limit:
+                expired.append((tier, snapshot_date))
+
+    return expired
+
+
+def expire_pins() -> list:
+    """
+    Снимает закрепления, найденные get_expired_pins.
+
+    :return: Список (уровень, дата) снятых закреплений.
+    """
+    expired = get_expired_pins()
+
+    for tier, snapshot_date in expired:
+        unpin_snapshot(tier, snapshot_date)
+
+    return expired
@@ -0,0 +1,148 @@
+import os
+import re
+
+from time import monotonic
+
+from utils.log import mainLog
+from utils.remote_exec import run_ssh_command_on_prod
+
+from config.const import (
+    LOCAL_DIST,
+    ADAPTIVE_INTERVAL,
+    ADAPTIVE_WORKERS_MIN,
+    ADAPTIVE_WORKERS_MAX,
+    PROD_LOAD_HIGH,
+    PROD_LOAD_LOW,
+    PROD_DISK_UTIL_HIGH,
+    PROD_DISK_UTIL_LOW,
+    LOCAL_DISK_UTIL_HIGH,
+    LOCAL_DISK_UTIL_LOW
+)
+
+# Физические устройства производственного сервера, по которым считается загрузка дисков
+PROD_DISK_PATTERN = re.compile(r'^(sd[a-z]+|vd[a-z]+|xvd[a-z]+|nvme\d+n\d+|md\d+)$')
+
+
+def parse_diskstats(text: str) -> dict:
+    """
+    Разбирает /proc/diskstats.
+
+    :return: Словарь {(major, minor, name): io_ticks}, где io_ticks — время (мс), в течение которого устройство выполняло I/O.
+    """
+    stats = {}
+
+    for line in text.splitlines():
+        fields = line.split()
+
+        if len(fields) < 13:
+            continue
+
+        stats[(int(fields[0]), int(fields[1]), fields[2])] = int(fields[12])
+
+    return stats
+
+
+def get_disk_util(previous: dict, current: dict, interval: float, match) -> float:
+    """
+    Возвращает максимальную загрузку (%util) среди устройств, выбранных функцией match, за интервал между замерами.
+    """
+    utils = [
+        min(100.0, (current[device] - previous[device]) / (interval * 1000) * 100)
+        for device in current
+        if device in previous and match(device)
+    ]
+
+    return max(utils, default=0.0)
+
+
+def get_local_device() -> tuple:
+    """ Возвращает (major, minor) устройства, на котором находится LOCAL_DIST. """
+    st_dev = os.stat(LOCAL_DIST).st_dev
+    return os.major(st_dev), os.minor(st_dev)
+
+
+def sample_prod() -> dict:
+    """
+    Одним ssh-вызовом получает нагрузку производственного сервера.
+
+    :return: Словарь {'load': load average за 1 минуту на одно ядро, 'diskstats': разобранный /proc/diskstats} или None при ошибке.
+    """
+    lines = []
+    result = run_ssh_command_on_prod("/usr/bin/nproc; /bin/cat /proc/loadavg; /bin/cat /proc/diskstats", 60, line_parsers=[lines.append])
+
+    if not result['success']:
+        mainLog.warning(f"[sample_prod] Не удалось получить нагрузку производственного сервера: {result['stderr']}")
+        return None
+
+    try:
+        cpus = int(lines[0])
+        load = float(lines[1].split()[0])
+    except (IndexError, ValueError) as exc:
+        mainLog.warning(f"[sample_prod] Некорректный ответ: {exc.args}")
+        return None
+
+    return {"load": load / max(cpus, 1), "diskstats": parse_diskstats("\n".join(lines[2:]))}
+
+
+def sample_local() -> dict:
+    with open("/proc/diskstats") as f:
+        return parse_diskstats(f.read())
+
+
+class ConcurrencyController:
+    """
+        Адаптивное управление количеством одновременно выполняемых процессов этапов.
+
+        Каждые ADAPTIVE_INTERVAL секунд снимаются показатели:
+        - load average на ядро производственного сервера;
+        - максимальная загрузка (%util) физических дисков производственного сервера;
+        - загрузка (%util) локального устройства LOCAL_DIST.
+
+        Если хотя бы один показатель выше порога *_HIGH — количество процессов уменьшается на 1,
+        если все ниже порогов *_LOW — увеличивается на 1, в пределах [ADAPTIVE_WORKERS_MIN, ADAPTIVE_WORKERS_MAX].
+        Выполняющиеся процессы не прерываются, меняется только количество новых запусков.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = max(ADAPTIVE_WORKERS_MIN, min(ADAPTIVE_WORKERS_MAX, workers))
+        self.local_device = get_local_device()
+        self.last_time = None
+        self.last_prod = None
+        self.last_local = None
+
+    def poll(self) -> int:
+        """ Возвращает актуальное количество процессов, пересчитывая его не чаще ADAPTIVE_INTERVAL секунд. """
+        now = monotonic()
+
+        if self.last_time is not None and now - self.last_time < ADAPTIVE_INTERVAL:
+            return self.workers
+
+        prod = sample_prod()
+        local = sample_local()
+
+        if self.last_time is not None and prod and self.last_prod:
+            self.adjust(prod, local, now - self.last_time)
+
+        self.last_time = now
+        self.last_prod = prod
+        self.last_local = local
+
+        return self.workers
+
+    def adjust(self, prod: dict, local: dict, interval: float) -> None:
+        prod_disk = get_disk_util(self.last_prod["diskstats"], prod["diskstats"], interval, lambda device: PROD_DISK_PATTERN.match(device[2]))
+        local_disk = get_disk_util(self.last_local, local, interval, lambda device: device[:2] == self.local_device)
+
+        previous = self.workers
+
+        if prod["load"] > PROD_LOAD_HIGH or prod_disk > PROD_DISK_UTIL_HIGH or local_disk > LOCAL_DISK_UTIL_HIGH:
+            self.workers = max(ADAPTIVE_WORKERS_MIN, self.workers - 1)
+            decision = "уменьшение"
+        elif prod["load"] < PROD_LOAD_LOW and prod_disk < PROD_DISK_UTIL_LOW and local_disk < LOCAL_DISK_UTIL_LOW:
+            self.workers = min(ADAPTIVE_WORKERS_MAX, self.workers + 1)
+            decision = "увеличение"
+        else:
+            decision = "без изменений"
+
+        mainLog.info(f"[ConcurrencyController] load/cpu: {prod['load']:.2f}, prod disk: {prod_disk:.0f}%, local disk: {local_disk:.0f}%. "
+                     f"Решение: {decision}, процессов: {previous} -> {self.workers}")
@@ -0,0 +1,214 @@
+import os
+import stat
+import shlex
+
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.log import mainLog
+from utils.ssh_pool import ssh_session, get_ssh_transport
+from utils.local_exec import run_local_command
+from utils.remote_exec import run_ssh_command_on_prod
+from utils.rsync_utils import RsyncStatsParser, RsyncProgressLogger
+
+from config.const import (
+    REMOTE_SERVER,
+    HOMEDIR_SHARD_COUNT,
+    HOMEDIR_SHARD_MIN_BYTES,
+    HOMEDIR_SHARD_MIN_FILES,
+    HOMEDIR_SHARD_FILE_COST
+)
+
+# Символы шаблонов rsync: директории с ними в имени не выделяются в отдельные части
+PATTERN_CHARS = set("*?[\\")
+
+
+def get_weight(values: list) -> int:
+    """ Оценка времени синхронизации директории: байты плюс стоимость каждого файла. """
+    return values[0] + values[1] * HOMEDIR_SHARD_FILE_COST
+
+
+def is_shardable(path: str) -> bool:
+    return not PATTERN_CHARS.intersection(path)
+
+
+def is_tree_name(name: str) -> bool:
+    """ Имя директории, которое может быть единицей разбиения (как is_supported в manifest_helper). """
+    if "\n" in name or "\t" in name:
+        return False
+
+    try:
+        name.encode("utf-8")
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+def get_local_homedir_tree(path: str) -> dict:
+    """
+    Размеры директорий первого и второго уровня локального домашнего каталога (копии предыдущего запуска)
+    в формате ManifestChanges.tree. Используется, когда размеры из манифеста недоступны.
+
+    :param path: Домашний каталог копии.
+    :return: Словарь {путь: [байт, файлов]}, файлов — количество вложенных записей.
+    """
+    tree = {}
+    # (директория, уровень, ключи tree, к которым относятся её записи)
+    stack = [(path, 0, [])]
+
+    while stack:
+        dir_path, depth, keys = stack.pop()
+
+        try:
+            with os.scandir(dir_path) as it:
+                entries = list(it)
+        except OSError as exc:
+            mainLog.warning(f"[get_local_homedir_tree] Директория недоступна: {dir_path}: {exc}")
+            continue
+
+        for entry in entries:
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+
+            size = st.st_size if stat.S_ISREG(st.st_mode) else 0
+
+            for key in keys:
+                tree[key][0] += size
+                tree[key][1] += 1
+
+            if not stat.S_ISDIR(st.st_mode):
+                continue
+
+            child_keys = keys
+
+            # Директория второго уровня учитывается, только если учтена родительская
+            if depth < 2 and len(keys) == depth and is_tree_name(entry.name):
+                rel = f"{keys[-1]}/{entry.name}" if keys else entry.name
+                tree[rel] = [0, 0]
+                child_keys = keys + [rel]
+
+            stack.append((entry.path, depth + 1, child_keys))
+
+    return tree
+
+
+def plan_homedir_shards(tree: dict):
+    """
+    Делит домашний каталог на части для параллельной синхронизации по размерам директорий
+    из манифеста (ManifestChanges.tree) или предыдущей копии (get_local_homedir_tree).
+
+    Единица разбиения — директория первого уровня. Директория тяжелее средней части делится
+    по вложенным директориям второго уровня. Единицы распределяются по HOMEDIR_SHARD_COUNT
+    частям жадно, от тяжёлых к лёгким, в наименее загруженную часть.
+
+    :param tree: Словарь {путь: [байт, файлов]}.
+    :return: {'shards': [[пути]], 'split': [разделённые директории]} или None, если разбиение не нужно.
+    """
+    tops = {path: values for path, values in tree.items() if "/" not in path and is_shardable(path)}
+
+    if sum(values[0] for values in tops.values()) < HOMEDIR_SHARD_MIN_BYTES and sum(values[1] for values in tops.values()) < HOMEDIR_SHARD_MIN_FILES:
+        return None
+
+    target = sum(get_weight(values) for values in tops.values()) / HOMEDIR_SHARD_COUNT
+    units = dict(tops)
+    split = []
+
+    for path, values in tops.items():
+        children = {child: child_values for child, child_values in tree.items() if child.startswith(f"{path}/") and is_shardable(child)}
+
+        if get_weight(values) > target and children:
+            del units[path]
+            units.update(children)
+            split.append(path)
+
+    if len(units) < 2:
+        return None
+
+    shards = [[] for _ in range(min(HOMEDIR_SHARD_COUNT, len(units)))]
+    loads = [0] * len(shards)
+
+    for path, values in sorted(units.items(), key=lambda item: get_weight(item[1]), reverse=True):
+        index = loads.index(min(loads))
+        shards[index].append(path)
+        loads[index] += get_weight(values)
+
+    return {"shards": shards, "split": split}
+
+
+def drop_missing_paths(plan: dict, root: str) -> dict:
+    """
+    Исключает из плана директории, которых больше нет на производственном сервере: они не исключаются
+    из синхронизации корня и удаляются её --delete.
+    """
+    listing = [f"/bin/find {shlex.quote(root)} -mindepth 1 -maxdepth 1 -printf '%P\\n'"]
+    listing += [f"/bin/find {shlex.quote(f'{root}/{parent}')} -mindepth 1 -maxdepth 1 -printf {shlex.quote(f'{parent}/%P')}'\\n'" for parent in plan["split"]]
+
+    existing = set()
+    result = run_ssh_command_on_prod("; ".join(listing), 600, line_parsers=[existing.add])
+
+    if not result['success'] and not existing:
+        raise Exception(f"[drop_missing_paths] Не удалось получить список директорий {root}: {result['stderr']}")
+
+    return {
+        "shards": [[path for path in shard if path in existing] for shard in plan["shards"]],
+        "split": [parent for parent in plan["split"] if parent in existing],
+    }
+
+
+def get_shard_commands(plan: dict, root: str, dest: str, options: str) -> list:
+    """
+    Команды rsync для частей плана (без ssh-транспорта, подставляется при запуске).
+
+    - Часть: rsync -R <root>/./<путь> ... --delete внутри каждой директории части.
+    - Корень и каждая разделённая директория: rsync -R <root>/./<dir>/ --delete с исключением
+      директорий, синхронизируемых частями (исключённые пути не удаляются). Так корень получает
+      новые и удалённые директории первого уровня, а также файлы вне частей.
+
+    :return: Список (название, аргументы rsync без -e).
+    """
+    units = [path for shard in plan["shards"] for path in shard]
+    commands = []
+
+    for index, shard in enumerate(plan["shards"]):
+        sources = " ".join(shlex.quote(f"{REMOTE_SERVER}:{root}/./{path}") for path in shard)
+        commands.append((f"shard {index + 1}", f"{options} {sources} {dest}/"))
+
+    for parent in [""] + plan["split"]:
+        prefix = f"{parent}/" if parent else ""
+        excluded = [path for path in units + plan["split"] if path.startswith(prefix) and "/" not in path[len(prefix):]]
+
+        excludes = " ".join(shlex.quote(f"--exclude=/{path}") for path in excluded)
+        commands.append((f"root /{parent}", f"{options} {excludes} {shlex.quote(f'{REMOTE_SERVER}:{root}/./{prefix}')} {dest}/"))
+
+    return commands
+
+
+def run_shard(username: str, name: str, args: str) -> dict:
+    stats = RsyncStatsParser()
+    progress = RsyncProgressLogger(f"[run_rsync_homedir] [{username}] [{name}]")
+
+    with ssh_session() as ssh:
+        cmd = f"/usr/bin/rsync -e '{get_ssh_transport(ssh)}' {args}"
+        result = run_local_command(cmd, 36000, line_parsers=[stats, progress])
+
+    result["stats"] = stats.stats
+    result["name"] = name
+    return result
+
+
+def run_homedir_shards(username: str, plan: dict, root: str, dest: str, options: str) -> list:
+    """
+    Выполняет синхронизацию частей параллельно, не более HOMEDIR_SHARD_COUNT одновременно.
+
+    :param options: Общие параметры rsync (-a -R -s --delete --stats, --link-dest, --exclude-from).
+    :return: Список результатов run_local_command с добавленными 'name' и 'stats'.
+    """
+    plan = drop_missing_paths(plan, root)
+    commands = get_shard_commands(plan, root, dest, options)
+
+    mainLog.info(f"[run_homedir_shards] [{username}] Частей: {len(plan['shards'])}, разделены: {plan['split'] or '-'}")
+
+    with ThreadPoolExecutor(max_workers=HOMEDIR_SHARD_COUNT) as executor:
+        jobs = [executor.submit(run_shard, username, name, args) for name, args in commands]
+        return [job.result() for job in jobs]
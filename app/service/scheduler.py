@@ -0,0 +1,257 @@
+from time import sleep
+from datetime import datetime
+from multiprocessing import Process
+
+from utils.log import mainLog
+from service.service import PIPELINE_STAGES, get_first_stage, get_next_stage, run_account_stage
+from history.history import get_account_durations
+from history.results import StageResultChannel
+from service.concurrency import ConcurrencyController
+
+from config.const import BACKUP_WORKERS, PARTITION_WORKERS_DEFAULT, PARTITION_WORKERS_LIMIT, STAGE_WORKERS, STAGE_QUEUE_LIMIT, ADAPTIVE_CONCURRENCY_ENABLE
+
+
+def build_account_queue(acc_partition_list: dict, durations: dict) -> list:
+    """
+        Формирует единую очередь аккаунтов всех разделов.
+
+        Аккаунты упорядочены по убыванию длительности предыдущего запуска (longest first),
+        что сокращает общее время ночного запуска. Аккаунты без истории ставятся в начало
+        очереди, так как первая синхронизация обычно самая долгая.
+
+        :param acc_partition_list: Результат get_account_dict: {partition: {user: [CpanelAccount]}}.
+        :param durations: Словарь {user: секунды} из истории запусков (get_account_durations).
+        :return: Список объектов CpanelAccount.
+    """
+    accounts = [acc_partition_list[partition][user][0] for partition in acc_partition_list for user in acc_partition_list[partition]]
+
+    return sorted(accounts, key=lambda account: durations.get(account.user, float("inf")), reverse=True)
+
+
+def get_partition_limit(partition: str) -> int:
+    return PARTITION_WORKERS_LIMIT.get(partition, PARTITION_WORKERS_DEFAULT)
+
+
+def get_stage_limit(stage: str) -> int:
+    return STAGE_WORKERS.get(stage, 1)
+
+
+class BackupScheduler:
+    """
+        Глобальный конвейерный планировщик резервного копирования аккаунтов.
+
+        Каждый этап (PIPELINE_STAGES) выполняется в собственном пуле процессов размером
+        get_stage_limit(stage) с собственной очередью, поэтому pkgacct следующего аккаунта
+        выполняется одновременно с синхронизацией домашней директории предыдущего.
+
+        Ограничения:
+        - не более workers процессов всего (при ADAPTIVE_CONCURRENCY_ENABLE значение изменяет ConcurrencyController);
+        - не более get_partition_limit(partition) процессов этапов, нагружающих раздел
+          производственного сервера;
+        - этап не запускается, если очередь следующего этапа содержит STAGE_QUEUE_LIMIT аккаунтов
+          (новые аккаунты ожидают в общей очереди pending, упорядоченной по длительности).
+
+        Результаты этапов (длительность, код завершения, объём данных) процессы передают
+        через StageResultChannel, планировщик сохраняет их в историю и собирает в results для отчета.
+    """
+
+    def __init__(self, accounts: list, workers: int = BACKUP_WORKERS, completed: set = None):
+        self.completed = completed or set()
+        self.pending = list(accounts)
+        self.priority = {account.user: index for index, account in enumerate(accounts)}
+        self.queues = {stage: [] for stage in PIPELINE_STAGES}
+        self.workers = workers
+        self.running = []
+        self.account_time = {}
+        self.channel = StageResultChannel()
+        # {user: {этап истории: результат}}
+        self.results = {account.user: {} for account in accounts}
+        self.stats = {stage: {"tasks": 0, "failed": 0, "busy": 0.0, "max_queue": 0} for stage in PIPELINE_STAGES}
+        self.total = len(accounts)
+        self.started = 0
+
+    def stage_load(self, stage: str) -> int:
+        return sum(1 for _, _, running_stage, _ in self.running if running_stage == stage)
+
+    def partition_load(self, partition: str) -> int:
+        return sum(1 for _, account, stage, _ in self.running if account.partition == partition and PIPELINE_STAGES[stage][1])
+
+    def can_start(self, account, stage: str) -> bool:
+        if self.stage_load(stage) >= get_stage_limit(stage):
+            return False
+
+        if PIPELINE_STAGES[stage][1] and self.partition_load(account.partition) >= get_partition_limit(account.partition):
+            return False
+
+        # Ограничение очереди следующего этапа (backpressure)
+        next_stage = get_next_stage(account, stage, True)
+
+        return not next_stage or len(self.queues[next_stage]) < STAGE_QUEUE_LIMIT
+
+    def enqueue(self, account, stage: str) -> None:
+        queue = self.queues[stage]
+        queue.append(account)
+        queue.sort(key=lambda item: self.priority[item.user])
+        self.stats[stage]["max_queue"] = max(self.stats[stage]["max_queue"], len(queue))
+
+    def next_task(self):
+        """
+            Возвращает (account, stage) для запуска или None.
+
+            Последние этапы конвейера выбираются первыми, чтобы аккаунты не накапливались в очередях.
+            Новые аккаунты берутся из общей очереди pending в порядке приоритета.
+        """
+        for stage in reversed(list(PIPELINE_STAGES)):
+            for account in self.queues[stage]:
+                if self.can_start(account, stage):
+                    self.queues[stage].remove(account)
+                    return account, stage
+
+        for account in self.pending:
+            stage = get_first_stage(account)
+
+            if self.can_start(account, stage):
+                self.pending.remove(account)
+                self.started += 1
+                mainLog.info(f"[{self.started}/{self.total}] [{account.partition}] Обработка аккаунта: {account.user}")
+                return account, stage
+
+    def skip_completed(self) -> None:
+        """
+            Режим возобновления: этапы, завершённые в прерванном запуске, считаются успешными без запуска.
+            Этапы перебираются в порядке конвейера, поэтому цепочка завершённых этапов пропускается за один проход.
+        """
+        for account in self.pending[:]:
+            if (account.user, get_first_stage(account)) in self.completed:
+                self.pending.remove(account)
+                self.started += 1
+                self.enqueue(account, get_first_stage(account))
+
+        for stage in PIPELINE_STAGES:
+            for account in self.queues[stage][:]:
+                if (account.user, stage) in self.completed:
+                    self.queues[stage].remove(account)
+                    mainLog.debug(f"[BackupScheduler] [{account.user}] Этап {stage} выполнен в прерванном запуске, пропускаем.")
+                    self.finish(account, stage, True, 0)
+
+    def reap(self) -> int:
+        """ Собирает завершившиеся процессы, передаёт аккаунты на следующий этап и возвращает количество завершённых. """
+        finished = 0
+
+        # Очередь разбирается до join: процесс этапа завершается после передачи всех своих записей
+        self.collect_results()
+
+        for task in self.running[:]:
+            proc, account, stage, start_time = task
+
+            if proc.is_alive():
+                continue
+
+            proc.join()
+            self.running.remove(task)
+            finished += 1
+
+            success = proc.exitcode == 0
+            duration = (datetime.now() - start_time).total_seconds()
+
+            self.stats[stage]["tasks"] += 1
+            self.stats[stage]["busy"] += duration
+            self.stats[stage]["failed"] += 0 if success else 1
+
+            self.finish(account, stage, success, duration)
+
+        return finished
+
+    def finish(self, account, stage: str, success: bool, duration: float) -> None:
+        """ Передаёт аккаунт на следующий этап и учитывает время его обработки для отчета. """
+        self.account_time[account.user] = self.account_time.get(account.user, 0) + duration
+
+        next_stage = get_next_stage(account, stage, success)
+
+        if next_stage:
+            self.enqueue(account, next_stage)
+
+    def collect_results(self) -> None:
+        for result in self.channel.receive():
+            self.results.setdefault(result["user"], {})[result["stage"]] = result
+
+    def start(self, account, stage: str) -> None:
+        mainLog.debug(f"[BackupScheduler] [{account.user}] Запуск этапа {stage}")
+
+        proc = Process(target=run_account_stage, args=(account, stage, self.channel), name=f"{account.user}:{stage}")
+        self.running.append((proc, account, stage, datetime.now()))
+        proc.start()
+
+    def has_work(self) -> bool:
+        return bool(self.pending or self.running or any(self.queues.values()))
+
+    def run(self) -> dict:
+        mainLog.info(f"[BackupScheduler] Аккаунтов в очереди: {self.total}, процессов: {self.workers}, пулы этапов: {STAGE_WORKERS}")
+
+        run_start = datetime.now()
+        controller = ConcurrencyController(self.workers) if ADAPTIVE_CONCURRENCY_ENABLE else None
+
+        while self.has_work():
+            self.reap()
+
+            if controller:
+                self.workers = controller.poll()
+
+            if self.completed:
+                self.skip_completed()
+
+            while len(self.running) < self.workers:
+                task = self.next_task()
+
+                if not task:
+                    break
+
+                self.start(*task)
+
+            sleep(0.5)
+
+        self.collect_results()
+
+        return self.get_stage_stats((datetime.now() - run_start).total_seconds())
+
+    def get_stage_stats(self, wall_time: float) -> dict:
+        """
+            Возвращает статистику пулов этапов: количество задач, ошибок, суммарное время работы,
+            максимальную длину очереди и загрузку пула (время работы / (размер пула * время запуска)).
+        """
+        stats = {}
+
+        for stage, values in self.stats.items():
+            capacity = get_stage_limit(stage) * wall_time
+            stats[stage] = dict(values, workers=get_stage_limit(stage), utilisation=(values["busy"] / capacity * 100) if capacity else 0)
+
+        return stats
+
+
+def run_backup_scheduler(acc_partition_list: dict, completed: set = None) -> tuple:
+    """
+        Запускает резервное копирование всех аккаунтов через глобальный планировщик.
+        Очередь упорядочивается по длительности из истории запусков.
+
+        :param acc_partition_list: Результат get_account_dict.
+        :param completed: Завершённые (user, stage) из журнала прерванного запуска (режим --resume) или None.
+        :return: (статистика пулов этапов, результаты аккаунтов) для отчета. Результаты аккаунтов —
+                 {user: {"time": секунды обработки, "stages": {этап истории: результат}}}.
+    """
+    try:
+        durations = get_account_durations()
+    except Exception as exc:
+        mainLog.warning(f"[run_backup_scheduler] История запусков недоступна, очередь без упорядочивания: {exc.args}")
+        durations = {}
+
+    accounts = build_account_queue(acc_partition_list, durations)
+
+    scheduler = BackupScheduler(accounts, completed=completed)
+    stage_stats = scheduler.run()
+
+    for stage, values in stage_stats.items():
+        mainLog.info(f"[run_backup_scheduler] [{stage}] Задач: {values['tasks']}, ошибок: {values['failed']}, загрузка пула: {values['utilisation']:.1f}%")
+
+    account_results = {user: {"time": scheduler.account_time.get(user, 0), "stages": stages} for user, stages in scheduler.results.items()}
+
+    return stage_stats, account_results
@@ -1,21 +1,38 @@
+import os
+import sys
+import shlex
+import shutil
 import logging
 
 from utils.log import mainLog
-from datetime import date, datetime, timedelta
-from time import time, sleep
-from multiprocessing import Process
+from datetime import date
+from time import time
 from notify.tg import send_telegram_message
 
 from utils.logging_tools import log_execution
 from remote.cpanel.account import CpanelAccount
+from remote.cpanel.fingerprint import get_pkgacct_fingerprint, read_fingerprint_file, write_fingerprint_file
+from remote.homedir_manifest import HOMEDIR_MANIFEST_FILE, run_manifest_helper, read_manifest_marker, write_manifest_marker, remove_manifest_marker
 
 from utils.backup_utils import get_last_date_path
 from utils.date_utils import get_current_date, get_last_date
-from utils.fs_utils import create_weekly_backup_dir, create_monthly_backup_dir
+from utils.fs_utils import create_weekly_backup_dir, create_monthly_backup_dir, make_dir
 from utils.remote_exec import run_ssh_command_on_prod
+from utils.ssh_pool import ssh_session, get_ssh_transport
 from utils.local_exec import run_local_command
+from utils.rsync_utils import RsyncStatsParser, RsyncProgressLogger
+from utils.fs_utils import get_tree_size
+from utils.link_dest import sync_with_link_dest, remove_path
+from utils.hardlink_clone import clone_tree
+from service.homedir_shards import plan_homedir_shards, run_homedir_shards, get_local_homedir_tree
+from retention.catalog import pin_snapshot
 
-from database.xtrabackup import create_mysql_xtrabackup
+from history.history import track_stage, set_stage_metrics, get_stage_metrics, set_result_channel
+from history.journal import journal_record, JOURNAL_STARTED, JOURNAL_DONE, JOURNAL_FAILED
+
+from database.xtrabackup import create_mysql_xtrabackup, is_xtrabackup_due
+from database.xtrabackup_prepare import prepare_mysql_xtrabackup
+from database.account_dump import dump_account_databases
 
 from tenacity import retry, stop_after_attempt, retry_if_result, wait_random, before_sleep_log
 
@@ -23,17 +40,50 @@ from config.const import (
     LOCAL_DIST, 
     REMOTE_SERVER_MOUNT_DIR, 
     LOCAL_DIST_UPLOAD, 
+    LOCAL_DIST_INCOMING,
+    REMOTE_PKGACCT_TMP_DIR,
+    PKGACCT_TRANSFER_MODE,
+    PKGACCT_STREAM_COMPRESS_LEVEL,
     REMOTE_SERVER, 
-    REMOTE_SSH_PORT,
     PKGACCT_TIMEOUT,
-    RSYNC_HOMEDIR_TIMEOUT,
+    PKGACCT_SKIP_UNCHANGED,
+    PKGACCT_CARRY_OVER_MAX_DAYS,
+    ACCOUNT_DB_BACKUP_ENABLE,
+    HOMEDIR_MANIFEST_ENABLE,
+    HOMEDIR_MANIFEST_FULL_SYNC_DAYS,
+    HOMEDIR_SHARD_ENABLE,
+    MYSQL_PREPARE_ENABLE,
     EXCLUDE_DIR,
-    RSYNC_HOMEDIR_ERR_EXCLUDE,
-    RSYNC_SUSPENDED_ERR_EXCLUDE
+    RSYNC_HOMEDIR_ERR_EXCLUDE
 )
 
 #### PKGACCT ####
+def is_pkgacct_stream_mode() -> bool:
+    return PKGACCT_TRANSFER_MODE == "stream"
+
+
+def get_pkgacct_src(username: str) -> str:
+    """
+    Директория с результатом pkgacct на сервере резервного копирования:
+    - sshfs: директория загрузки, смонтированная на производственном сервере;
+    - stream: локальная директория приёма tar-потока (недоступна производственному серверу).
+    """
+    if is_pkgacct_stream_mode():
+        return f"{LOCAL_DIST_INCOMING}/{get_current_date()}/{username}"
+
+    return f"{LOCAL_DIST_UPLOAD}/{get_current_date()}/{username}"
+
+
+def get_pkgacct_remote_dir() -> str:
+    """ Директория на производственном сервере, в которую pkgacct сохраняет резервную копию. """
+    if is_pkgacct_stream_mode():
+        return f"{REMOTE_PKGACCT_TMP_DIR}/{get_current_date()}"
+
+    return f"{REMOTE_SERVER_MOUNT_DIR}/{get_current_date()}"
+
+
 @log_execution
+@track_stage
 @retry(stop=stop_after_attempt(5), wait=wait_random(min=30, max=90), retry=retry_if_result(lambda x: x is False), before_sleep=before_sleep_log(mainLog, logging.ERROR))
 def pre_clean_pkgacct(account: CpanelAccount) -> bool:
     """
@@ -47,12 +97,18 @@ def pre_clean_pkgacct(account: CpanelAccount) -> bool:
     """
     username = account.user
 
-    pkgacct_src = f"{LOCAL_DIST_UPLOAD}/{get_current_date()}/{username}"
+    pkgacct_src = get_pkgacct_src(username)
 
     cmd = f"/bin/rm -rf {pkgacct_src}"
 
     result = run_local_command(cmd, PKGACCT_TIMEOUT)
 
+    # В режиме stream также удаляются остатки прерванного запуска на производственном сервере
+    if result['success'] and is_pkgacct_stream_mode():
+        result = run_ssh_command_on_prod(f"/bin/rm -rf {get_pkgacct_remote_dir()}/{username}", PKGACCT_TIMEOUT)
+
+    set_stage_metrics(returncode=result['returncode'])
+
     if not result['success']:
         mainLog.error(f"[pre_clean_pkgacct] [{username}] завершился с ошибкой. stdout: {result['stdout']} stderr: {result['stderr']}")
         send_telegram_message(f"[pre_clean_pkgacct] [{username}] завершился с ошибкой. stderr: {result['stderr']}")
@@ -63,14 +119,20 @@ def pre_clean_pkgacct(account: CpanelAccount) -> bool:
 
 
 @log_execution
+@track_stage
 @retry(stop=stop_after_attempt(5), wait=wait_random(min=60, max=180), retry=retry_if_result(lambda x: x is False), before_sleep=before_sleep_log(mainLog, logging.WARNING))
 def run_pkgacct(account: CpanelAccount) -> bool:
     """
         Запускает резервное копирование аккаунта cPanel на удалённом сервере с помощью pkgacct.
 
-        Без копирования домашнего каталога, квот, логов и трафика.
+        Без копирования домашнего каталога, квот, логов и трафика. При ACCOUNT_DB_BACKUP_ENABLE без баз данных:
+        они копируются отдельным этапом run_account_db_backup.
         Бэкап сохраняется в директорию, соответствующую текущей дате.
 
+        Если отпечаток метаданных аккаунта (prefetch_pkgacct_fingerprints) совпадает с отпечатком
+        предыдущей копии, pkgacct не запускается, а предыдущая копия переносится hardlink'ами
+        (carry_over_pkgacct), но не более PKGACCT_CARRY_OVER_MAX_DAYS дней подряд.
+
         В случае ошибки логирует stdout/stderr и отправляет сообщение в Telegram.
 
         :param username: имя пользователя cPanel
@@ -78,30 +140,150 @@ def run_pkgacct(account: CpanelAccount) -> bool:
     """
     username = account.user
 
-    pkgacct_current_backup_path = f"{REMOTE_SERVER_MOUNT_DIR}/{get_current_date()}/"
+    pkgacct_current_backup_path = f"{get_pkgacct_remote_dir()}/"
 
     pre_clean_pkgacct(account)
 
-    cmd = f"/bin/timeout {PKGACCT_TIMEOUT} /usr/local/cpanel/scripts/pkgacct --skiphomedir --skipquota --skiplogs --skipbwdata --backup --incremental {username} {pkgacct_current_backup_path}"
+    fingerprint = get_pkgacct_fingerprint(username)
+    previous = get_unchanged_pkgacct(account, fingerprint)
+
+    if previous and carry_over_pkgacct(account, previous):
+        return True
+
+    skip_mysql = "--skipmysql " if ACCOUNT_DB_BACKUP_ENABLE else ""
+
+    cmd = f"/bin/mkdir -p {pkgacct_current_backup_path} && /bin/timeout {PKGACCT_TIMEOUT} /usr/local/cpanel/scripts/pkgacct --skiphomedir --skipquota --skiplogs --skipbwdata {skip_mysql}--backup --incremental {username} {pkgacct_current_backup_path}"
     
     result = run_ssh_command_on_prod(cmd, PKGACCT_TIMEOUT)
+    set_stage_metrics(returncode=result['returncode'])
 
     if not result['success']:
         mainLog.error(f"[run_pkgacct] [{username}] завершился с ошибкой. stdout: {result['stdout']} stderr: {result['stderr']}")
         send_telegram_message(f"[run_pkgacct] [{username}] завершился с ошибкой. stderr: {result['stderr']}")
         return False
+
+    if is_pkgacct_stream_mode() and not transfer_pkgacct_stream(account):
+        return False
+
+    if fingerprint:
+        write_fingerprint_file(get_pkgacct_src(username), fingerprint)
+
+    # Размер принятого результата pkgacct — объём принятых данных
+    bytes_received, files = get_tree_size(get_pkgacct_src(username))
+    set_stage_metrics(bytes_received=bytes_received, files=files)
     
     mainLog.info(f"[run_pkgacct] [{username}] Завершен успешно.")
     return True
 
+
+def get_unchanged_pkgacct(account: CpanelAccount, fingerprint: str) -> dict:
+    """
+        Проверяет, можно ли перенести предыдущую копию pkgacct вместо запуска pkgacct.
+
+        :param account: Объект CpanelAccount с полем user
+        :param fingerprint: Отпечаток метаданных аккаунта текущего запуска или None
+        :return: Отпечаток предыдущей копии с добавленным путём 'path' или None
+    """
+    if not PKGACCT_SKIP_UNCHANGED or not fingerprint:
+        return None
+
+    last_date_path = get_last_date_path(account)
+
+    if not last_date_path:
+        return None
+
+    previous = read_fingerprint_file(last_date_path)
+
+    if not previous or previous.get("fingerprint") != fingerprint:
+        return None
+
+    if previous.get("carried", 0) >= PKGACCT_CARRY_OVER_MAX_DAYS:
+        mainLog.info(f"[get_unchanged_pkgacct] [{account.user}] Копия переносилась {previous['carried']} дней подряд, выполняем pkgacct.")
+        return None
+
+    previous["path"] = last_date_path
+    return previous
+
+
+def carry_over_pkgacct(account: CpanelAccount, previous: dict) -> bool:
+    """
+        Переносит предыдущую копию pkgacct (без homedir) в копию текущей даты hardlink'ами
+        и обновляет отпечаток. Этап move для перенесённой копии пропускается.
+
+        :param account: Объект CpanelAccount с полем user
+        :param previous: Результат get_unchanged_pkgacct
+        :return: True при успехе, False при ошибке (выполняется обычный pkgacct)
+    """
+    username = account.user
+
+    acc_backup_dest = f"{LOCAL_DIST}/{get_current_date()}/{username}"
+
+    try:
+        stats = clone_tree(previous['path'], acc_backup_dest, exclude=("homedir", HOMEDIR_MANIFEST_FILE))
+    except Exception as exc:
+        mainLog.warning(f"[carry_over_pkgacct] [{username}] Перенос предыдущей копии завершился ошибкой, выполняем pkgacct: {exc.args}")
+        return False
+
+    write_fingerprint_file(acc_backup_dest, previous["fingerprint"], previous.get("carried", 0) + 1)
+    set_stage_metrics(returncode=0, **stats)
+
+    mainLog.info(f"[carry_over_pkgacct] [{username}] Метаданные не изменились, перенесена копия {previous['path']} (дней подряд: {previous.get('carried', 0) + 1}).")
+    return True
+
+
+def is_pkgacct_carried_over(username: str) -> bool:
+    """ True, если копия pkgacct текущей даты перенесена carry_over_pkgacct. """
+    current = read_fingerprint_file(f"{LOCAL_DIST}/{get_current_date()}/{username}")
+    return bool(current and current.get("date") == get_current_date() and current.get("carried"))
+
+
+def transfer_pkgacct_stream(account: CpanelAccount) -> bool:
+    """
+        Режим stream: передаёт результат pkgacct с производственного сервера сжатым tar-потоком
+        через ssh в локальную директорию приёма (без sshfs) и удаляет его на производственном сервере.
+
+        :param account: Объект CpanelAccount с полем user
+        :return: True при успехе, False при ошибке
+    """
+    username = account.user
+    remote_dir = get_pkgacct_remote_dir()
+    local_dir = os.path.dirname(get_pkgacct_src(username))
+
+    if not make_dir(local_dir):
+        return False
+
+    with ssh_session() as ssh:
+        remote_cmd = f"set -o pipefail; /bin/tar -C {remote_dir} -cf - {username} | /bin/gzip -{PKGACCT_STREAM_COMPRESS_LEVEL}"
+        cmd = f"set -o pipefail; {get_ssh_transport(ssh)} {REMOTE_SERVER} '{remote_cmd}' | /bin/tar -xzpf - --numeric-owner -C {local_dir}"
+
+        # pipefail поддерживается bash, но не /bin/sh (dash): без него ошибка ssh или tar на производственном
+        # сервере скрывается успешным кодом локального tar
+        result = run_local_command(f"/bin/bash -c {shlex.quote(cmd)}", PKGACCT_TIMEOUT)
+
+    if not result['success']:
+        mainLog.error(f"[transfer_pkgacct_stream] [{username}] завершился с ошибкой. stderr: {result['stderr']}")
+        send_telegram_message(f"[transfer_pkgacct_stream] [{username}] завершился с ошибкой. stderr: {result['stderr']}")
+        return False
+
+    run_ssh_command_on_prod(f"/bin/rm -rf {remote_dir}/{username}", PKGACCT_TIMEOUT)
+    return True
+
+
 @log_execution
+@track_stage
 def move_pkgacct_with_hardlinks(account: CpanelAccount) -> bool:
     """
         Перемещает результат pkgacct из временной директории загрузки в постоянное хранилище с использованием hardlink'ов.
 
         - Источник: upload/<дата>/<user>
         - Назначение: backup/<дата>/<user>
-        - Используется rsync с --link-dest для экономии места при неизменённых файлах.
+        - Неизменённые файлы связываются hardlink'ом с предыдущей копией (sync_with_link_dest).
+          Контрольные суммы предыдущей копии берутся из кеша, поэтому она не хешируется повторно.
+        - Новое содержимое копируется: директория загрузки доступна производственному серверу
+          на запись, поэтому hardlink на её файлы не создаётся.
+        - В режиме stream источник — локальная директория приёма incoming/<дата>/<user> на той же
+          файловой системе, новое содержимое связывается hardlink'ом без копирования, после чего
+          директория приёма удаляется.
 
         Если операция завершается с ошибкой — отправляется уведомление и пишется лог.
 
@@ -111,19 +293,75 @@ def move_pkgacct_with_hardlinks(account: CpanelAccount) -> bool:
     username = account.user
 
     pkgacct_linkdest = f"{LOCAL_DIST}/{get_last_date()}/{username}"
-    pkgacct_src = f"{LOCAL_DIST_UPLOAD}/{get_current_date()}/{username}/"
-    pkgacct_dest = f"{LOCAL_DIST}/{get_current_date()}/{username}/"
+    pkgacct_src = get_pkgacct_src(username)
+    pkgacct_dest = f"{LOCAL_DIST}/{get_current_date()}/{username}"
 
-    cmd = f"rsync -rlpgoD -c --delete --link-dest={pkgacct_linkdest} --exclude=homedir {pkgacct_src} {pkgacct_dest}"
+    # Копия перенесена без pkgacct, результата для перемещения нет
+    if not os.path.isdir(pkgacct_src) and is_pkgacct_carried_over(username):
+        set_stage_metrics(returncode=0)
+        mainLog.info(f"[run_pkgacct_move] [{username}] Копия перенесена без pkgacct, перемещение не требуется.")
+        return True
 
-    result = run_local_command(cmd, 36000)
+    try:
+        stats = sync_with_link_dest(pkgacct_src, pkgacct_dest, pkgacct_linkdest, exclude=get_pkgacct_exclude(), link_new=is_pkgacct_stream_mode())
+        set_stage_metrics(returncode=0, **stats)
 
-    if not result['success']:
-        mainLog.error(f"[run_pkgacct_move] [{username}] завершился с ошибкой. stdout: {result['stdout']} stderr: {result['stderr']}")
-        send_telegram_message(f"[run_pkgacct_move] [{username}] завершился с ошибкой. stderr: {result['stderr']}")
+        if is_pkgacct_stream_mode():
+            shutil.rmtree(pkgacct_src)
+
+    except Exception as exc:
+        set_stage_metrics(returncode=-1)
+        mainLog.error(f"[run_pkgacct_move] [{username}] завершился с ошибкой: {exc.args}")
+        send_telegram_message(f"[run_pkgacct_move] [{username}] завершился с ошибкой: {exc.args}")
         return False
     
-    mainLog.info(f"[run_pkgacct_move] [{username}] Завершен успешно.")
+    mainLog.info(f"[run_pkgacct_move] [{username}] Завершен успешно. Файлов: {stats['files']}, связано: {stats['files_linked']}, скопировано: {stats['files_transferred']}")
+    return True
+
+
+def get_pkgacct_exclude() -> tuple:
+    """ Директории копии аккаунта, которые заполняются другими этапами и не затрагиваются переносом pkgacct. """
+    exclude = ("homedir", HOMEDIR_MANIFEST_FILE)
+    return exclude + ("mysql",) if ACCOUNT_DB_BACKUP_ENABLE else exclude
+
+###############
+
+
+#### MYSQL ####
+@log_execution
+@track_stage
+@retry(stop=stop_after_attempt(3), wait=wait_random(min=60, max=180), retry=retry_if_result(lambda x: x is False), before_sleep=before_sleep_log(mainLog, logging.WARNING))
+def run_account_db_backup(account: CpanelAccount) -> bool:
+    """
+        Копирует базы данных аккаунта по таблицам в backup/<дата>/<user>/mysql (см. AccountDatabaseDump).
+        Неизменённые таблицы связываются hardlink'ом с предыдущей копией.
+
+        Если копия pkgacct перенесена без изменений (carry_over_pkgacct), базы данных перенесены вместе с ней.
+
+        :param account: Объект CpanelAccount с полем user
+        :return: True при успехе, False при ошибке
+    """
+    username = account.user
+
+    if is_pkgacct_carried_over(username):
+        set_stage_metrics(returncode=0)
+        mainLog.info(f"[run_account_db_backup] [{username}] Копия перенесена без изменений, базы данных не копируются.")
+        return True
+
+    dest = f"{LOCAL_DIST}/{get_current_date()}/{username}/mysql"
+    previous = get_last_date_path(account, "mysql")
+
+    try:
+        stats = dump_account_databases(username, dest, previous)
+        set_stage_metrics(returncode=0, **stats)
+
+    except Exception as exc:
+        set_stage_metrics(returncode=-1)
+        mainLog.error(f"[run_account_db_backup] [{username}] завершился с ошибкой: {exc.args}")
+        send_telegram_message(f"[run_account_db_backup] [{username}] завершился с ошибкой: {exc.args}")
+        return False
+
+    mainLog.info(f"[run_account_db_backup] [{username}] Завершен успешно. Таблиц: {stats['files']}, связано: {stats['files_linked']}, выгружено: {stats['files_transferred']}")
     return True
 
 ###############
@@ -131,38 +369,152 @@ def move_pkgacct_with_hardlinks(account: CpanelAccount) -> bool:
 
 #### RSYNC ####
 @log_execution
+@track_stage
 def run_rsync_suspended(account: CpanelAccount) -> bool:
-
+    """ Копия приостановленного аккаунта — предыдущая копия, перенесённая hardlink'ами (clone_tree). """
     last_date_path = get_last_date_path(account)
 
     if not last_date_path:
         return False
-   
-    acc_backup_src      = f"{last_date_path}/"
-    acc_backup_dest     = f"{LOCAL_DIST}/{get_current_date()}/{account.user}/"
 
-    cmd = f"rsync -a --delete --link-dest={acc_backup_src} {acc_backup_src} {acc_backup_dest}"
+    acc_backup_dest = f"{LOCAL_DIST}/{get_current_date()}/{account.user}"
 
-    result = run_local_command(cmd, RSYNC_HOMEDIR_TIMEOUT)
+    try:
+        stats = clone_tree(last_date_path, acc_backup_dest)
+        set_stage_metrics(returncode=0, **stats)
 
-    if not result['success'] and result.get('returncode') not in RSYNC_SUSPENDED_ERR_EXCLUDE:
-        mainLog.error(f"[run_rsync_suspended] [{account.user}] завершился с ошибкой. stdout: {result['stdout']} stderr: {result['stderr']}")
-        send_telegram_message(f"[run_rsync_suspended] [{account.user}] завершился с ошибкой. stderr: {result['stderr']}")
+    except Exception as exc:
+        set_stage_metrics(returncode=-1)
+        mainLog.error(f"[run_rsync_suspended] [{account.user}] завершился с ошибкой: {exc.args}")
+        send_telegram_message(f"[run_rsync_suspended] [{account.user}] завершился с ошибкой: {exc.args}")
         return False
-    
+
     return True
 
 @log_execution
+@track_stage
 @retry(stop=stop_after_attempt(5), wait=wait_random(min=60, max=180), retry=retry_if_result(lambda x: x is False), before_sleep=before_sleep_log(mainLog, logging.WARNING))
 def run_rsync_homedir(account: CpanelAccount) -> bool:
+    """
+        Синхронизирует домашний каталог аккаунта в backup/<дата>/<user>/homedir.
+
+        При HOMEDIR_MANIFEST_ENABLE на производственном сервере строится манифест каталога
+        (run_manifest_helper) и список изменений относительно манифеста предыдущей копии.
+        Если он получен, предыдущая копия переносится hardlink'ами и передаются только изменённые
+        пути (sync_homedir_changes), без обхода всего дерева rsync'ом на обеих сторонах.
+        Полная синхронизация выполняется без манифеста предыдущей копии (в том числе после
+        синхронизации с непереданными файлами) и каждые HOMEDIR_MANIFEST_FULL_SYNC_DAYS дней.
+        Для крупных аккаунтов она разбивается на части по размерам директорий из манифеста
+        или предыдущей копии (sync_homedir_sharded).
+
+        :param account: Объект CpanelAccount
+        :return: True при успехе, False при ошибке
+    """
+    if not HOMEDIR_MANIFEST_ENABLE:
+        return sync_homedir_full(account, get_learned_homedir_tree(account))
+
+    acc_backup_path = f"{LOCAL_DIST}/{get_current_date()}/{account.user}"
+
+    if not make_dir(acc_backup_path):
+        return False
+
+    remove_manifest_marker(acc_backup_path)
+
+    base = get_homedir_manifest_base(account)
+    changes = run_manifest_helper(account.user, f"/{account.partition}/{account.user}", base["id"] if base else None, acc_backup_path)
+
+    try:
+        if changes and base and not changes.base_missing and not changes.unsupported:
+            success = sync_homedir_changes(account, base, changes)
+            chain = base.get("chain", 0) + 1
+        else:
+            success = sync_homedir_full(account, changes.tree if changes else get_learned_homedir_tree(account))
+            chain = 0
+
+        returncode = get_stage_metrics().get("returncode")
+
+        # Файлы, не переданные rsync (коды RSYNC_HOMEDIR_ERR_EXCLUDE), не должны попасть в манифест копии:
+        # без отметки следующий запуск выполнит полную синхронизацию
+        if success and changes and returncode == 0:
+            write_manifest_marker(acc_backup_path, chain, changes.summary, changes.tree)
+        elif success and changes:
+            mainLog.warning(f"[run_rsync_homedir] [{account.user}] rsync завершился с кодом {returncode}, следующая синхронизация будет полной.")
+
+    finally:
+        if changes:
+            changes.cleanup()
+
+    return success
+
+
+def get_homedir_manifest_base(account: CpanelAccount):
+    """
+        Возвращает отметку манифеста предыдущей копии, относительно которой можно передать только изменения,
+        с добавленным путём 'path', или None, если нужна полная синхронизация.
+    """
+    last_date_path = get_last_date_path(account)
+
+    if not last_date_path or not os.path.isdir(f"{last_date_path}/homedir"):
+        return None
+
+    marker = read_manifest_marker(last_date_path)
+
+    # Отметка должна относиться именно к этой копии (а не перенесена из более ранней)
+    if not marker or marker.get("id") != os.path.basename(os.path.dirname(last_date_path)):
+        return None
+
+    if marker.get("chain", 0) + 1 >= HOMEDIR_MANIFEST_FULL_SYNC_DAYS:
+        mainLog.info(f"[get_homedir_manifest_base] [{account.user}] Плановая полная синхронизация домашнего каталога.")
+        return None
+
+    marker["path"] = last_date_path
+    return marker
+
+
+def get_learned_homedir_tree(account: CpanelAccount) -> dict:
+    """
+        Размеры директорий домашнего каталога для разбиения полной синхронизации, если манифест текущего запуска
+        не построен: из манифеста предыдущей копии, без него (HOMEDIR_MANIFEST_ENABLE = 0) — обходом
+        домашнего каталога предыдущей копии.
+    """
+    if not HOMEDIR_SHARD_ENABLE:
+        return {}
+
+    last_date_path = get_last_date_path(account)
+
+    if not last_date_path:
+        return {}
+
+    marker = read_manifest_marker(last_date_path)
+
+    if marker and marker.get("tree"):
+        return marker["tree"]
+
+    if not os.path.isdir(f"{last_date_path}/homedir"):
+        return {}
+
+    return get_local_homedir_tree(f"{last_date_path}/homedir")
+
+
+def sync_homedir_full(account: CpanelAccount, tree: dict = None) -> bool:
     last_date_path = get_last_date_path(account, "homedir")
 
+    plan = plan_homedir_shards(tree) if HOMEDIR_SHARD_ENABLE and tree else None
+
+    if plan:
+        return sync_homedir_sharded(account, plan, last_date_path)
+
     link_dest = f"--link-dest={last_date_path}" if last_date_path else ""
     exclude_from = f"--exclude-from={EXCLUDE_DIR[account.user]}" if account.user in EXCLUDE_DIR else ""
 
-    cmd = f"/usr/bin/rsync -a --delete -e 'ssh -p {REMOTE_SSH_PORT}' {exclude_from} {link_dest} {REMOTE_SERVER}:/{account.partition}/{account.user}/ {LOCAL_DIST}/{get_current_date()}/{account.user}/homedir/"
-    
-    result = run_local_command(cmd, 36000)
+    stats = RsyncStatsParser()
+    progress = RsyncProgressLogger(f"[run_rsync_homedir] [{account.user}]")
+
+    with ssh_session() as ssh:
+        cmd = f"/usr/bin/rsync -a --stats --info=progress2 --delete -e '{get_ssh_transport(ssh)}' {exclude_from} {link_dest} {REMOTE_SERVER}:/{account.partition}/{account.user}/ {LOCAL_DIST}/{get_current_date()}/{account.user}/homedir/"
+
+        result = run_local_command(cmd, 36000, line_parsers=[stats, progress])
+    set_stage_metrics(returncode=result['returncode'], **stats.stats)
 
     if not result['success'] and result.get('returncode') not in RSYNC_HOMEDIR_ERR_EXCLUDE:
         mainLog.error(f"[run_rsync_homedir] [{account.user}] завершился с ошибкой. stdout: {result['stdout']} stderr: {result['stderr']}")
@@ -171,68 +523,138 @@ def run_rsync_homedir(account: CpanelAccount) -> bool:
     
     return True
 
-###############
 
+def sync_homedir_sharded(account: CpanelAccount, plan: dict, last_date_path: str) -> bool:
+    """
+        Полная синхронизация домашнего каталога крупного аккаунта частями (run_homedir_shards):
+        части по директориям синхронизируются параллельно в один homedir/ с --delete и
+        --link-dest на предыдущую копию.
 
-#### AdditionalCopy ####
-@log_execution
-def create_weekly_copy() -> bool:
-    weekly_dir_path = create_weekly_backup_dir()
+        :param account: Объект CpanelAccount
+        :param plan: Результат plan_homedir_shards
+        :param last_date_path: Домашний каталог предыдущей копии или None
+        :return: True при успехе, False при ошибке
+    """
+    link_dest = f"--link-dest={last_date_path}" if last_date_path else ""
+    exclude_from = f"--exclude-from={EXCLUDE_DIR[account.user]}" if account.user in EXCLUDE_DIR else ""
+    options = f"-a -R -s --stats --info=progress2 --delete {exclude_from} {link_dest}"
 
-    if not weekly_dir_path:
-        mainLog.error(f"[create_weekly_copy] Не удалось создать директорию для сохранения недельной копии.")
-        send_telegram_message("[create_weekly_copy] Не удалось создать директорию для сохранения недельной копии.")
+    try:
+        results = run_homedir_shards(account.user, plan, f"/{account.partition}/{account.user}", f"{LOCAL_DIST}/{get_current_date()}/{account.user}/homedir", options)
+    except Exception as exc:
+        set_stage_metrics(returncode=-1)
+        mainLog.error(f"[run_rsync_homedir] [{account.user}] завершился с ошибкой: {exc.args}")
+        send_telegram_message(f"[run_rsync_homedir] [{account.user}] завершился с ошибкой: {exc.args}")
         return False
 
-    # Важен / в конце path
-    source_link_dest = f"{LOCAL_DIST}/{get_current_date()}"
-    current_backup_path = f"{LOCAL_DIST}/{get_current_date()}/"
-    weekly_backup_path = f"{weekly_dir_path}/{get_current_date()}/"
+    stats = {}
 
-    cmd = f"rsync -a --delete --link-dest={source_link_dest} {current_backup_path} {weekly_backup_path}"
+    for result in results:
+        for key, value in result["stats"].items():
+            stats[key] = stats.get(key, 0) + value
 
-    result = run_local_command(cmd, 36000)
+    failed = [result for result in results if not result['success'] and result.get('returncode') not in RSYNC_HOMEDIR_ERR_EXCLUDE]
+    set_stage_metrics(returncode=failed[0]['returncode'] if failed else max(result['returncode'] for result in results), **stats)
 
-    if not result['success']:
-        mainLog.error(f"[create_weekly_copy] Создание недельной копии завершилось с ошибкой. stderr: {result['stderr']}")
-        send_telegram_message(f"[create_weekly_copy] Создание недельной копии завершилось с ошибкой. stderr: {result['stderr']}")
-        return False
-    
-    return True
+    for result in failed:
+        mainLog.error(f"[run_rsync_homedir] [{account.user}] [{result['name']}] завершился с ошибкой. stdout: {result['stdout']} stderr: {result['stderr']}")
+        send_telegram_message(f"[run_rsync_homedir] [{account.user}] [{result['name']}] завершился с ошибкой. stderr: {result['stderr']}")
 
+    return not failed
 
-@log_execution
-def create_monthly_copy() -> bool:
-    monthly_dir_path = create_monthly_backup_dir()
 
-    if not monthly_dir_path:
-        mainLog.error(f"[create_monthly_copy] Не удалось создать директорию для сохранения месячной копии.")
-        send_telegram_message("[create_monthly_copy] Не удалось создать директорию для сохранения месячной копии.")
+def sync_homedir_changes(account: CpanelAccount, base: dict, changes) -> bool:
+    """
+        Синхронизация домашнего каталога по списку изменений манифеста:
+        - домашний каталог предыдущей копии переносится hardlink'ами;
+        - удалённые на производственном сервере пути удаляются;
+        - изменённые пути передаются rsync --files-from. Ключ -I (без сравнения размера и mtime)
+          заставляет rsync создать новый файл, а не менять права файла, общего с предыдущей копией.
+
+        :param account: Объект CpanelAccount
+        :param base: Результат get_homedir_manifest_base
+        :param changes: Результат run_manifest_helper
+        :return: True при успехе, False при ошибке
+    """
+    homedir_src = f"{base['path']}/homedir"
+    homedir_dest = f"{LOCAL_DIST}/{get_current_date()}/{account.user}/homedir"
+
+    try:
+        clone_tree(homedir_src, homedir_dest)
+
+        with open(changes.deleted_path) as f:
+            for rel in f:
+                path = f"{homedir_dest}/{rel.rstrip(chr(10))}"
+
+                if os.path.lexists(path):
+                    remove_path(path)
+
+    except Exception as exc:
+        set_stage_metrics(returncode=-1)
+        mainLog.error(f"[run_rsync_homedir] [{account.user}] Перенос предыдущей копии завершился с ошибкой: {exc.args}")
+        send_telegram_message(f"[run_rsync_homedir] [{account.user}] Перенос предыдущей копии завершился с ошибкой: {exc.args}")
         return False
 
-    # Важен / в конце path
-    source_link_dest = f"{LOCAL_DIST}/{get_current_date()}"
-    current_backup_path = f"{LOCAL_DIST}/{get_current_date()}/"
-    monthly_backup_path = f"{monthly_dir_path}/{get_current_date()}/"
+    summary = changes.summary
+    mainLog.info(f"[run_rsync_homedir] [{account.user}] Манифест: {summary['entries']} записей, изменено: {summary['changed']}, удалено: {summary['deleted']}")
+
+    if not summary["changed"]:
+        set_stage_metrics(returncode=0, files=summary["entries"], files_transferred=0)
+        return True
 
-    cmd = f"rsync -a --delete --link-dest={source_link_dest} {current_backup_path} {monthly_backup_path}"
+    exclude_from = f"--exclude-from={EXCLUDE_DIR[account.user]}" if account.user in EXCLUDE_DIR else ""
 
-    result = run_local_command(cmd, 36000)
+    stats = RsyncStatsParser()
+    progress = RsyncProgressLogger(f"[run_rsync_homedir] [{account.user}]")
 
-    if not result['success']:
-        mainLog.error(f"[create_monthly_copy] Создание месячной копии завершилось с ошибкой. stderr: {result['stderr']}")
-        send_telegram_message(f"[create_monthly_copy] Создание месячной копии завершилось с ошибкой. stderr: {result['stderr']}")
+    with ssh_session() as ssh:
+        cmd = f"/usr/bin/rsync -a -I --stats --info=progress2 --files-from={changes.changed_path} -e '{get_ssh_transport(ssh)}' {exclude_from} {REMOTE_SERVER}:/{account.partition}/{account.user}/ {homedir_dest}/"
+
+        result = run_local_command(cmd, 36000, line_parsers=[stats, progress])
+    set_stage_metrics(returncode=result['returncode'], **{**stats.stats, "files": summary["entries"]})
+
+    if not result['success'] and result.get('returncode') not in RSYNC_HOMEDIR_ERR_EXCLUDE:
+        mainLog.error(f"[run_rsync_homedir] [{account.user}] завершился с ошибкой. stdout: {result['stdout']} stderr: {result['stderr']}")
+        send_telegram_message(f"[run_rsync_homedir] [{account.user}] завершился с ошибкой. stderr: {result['stderr']}")
         return False
-    
+
     return True
 
+###############
+
+
+#### AdditionalCopy ####
+@log_execution
+def create_weekly_copy() -> bool:
+    """ Закрепляет текущую ежедневную копию за недельным уровнем хранения (retention/catalog.py). """
+    if not create_weekly_backup_dir():
+        mainLog.error(f"[create_weekly_copy] Не удалось создать директорию для сохранения недельной копии.")
+        send_telegram_message("[create_weekly_copy] Не удалось создать директорию для сохранения недельной копии.")
+        return False
+
+    return pin_snapshot("weekly", get_current_date())
+
+
+@log_execution
+def create_monthly_copy() -> bool:
+    """ Закрепляет текущую ежедневную копию за месячным уровнем хранения (retention/catalog.py). """
+    if not create_monthly_backup_dir():
+        mainLog.error(f"[create_monthly_copy] Не удалось создать директорию для сохранения месячной копии.")
+        send_telegram_message("[create_monthly_copy] Не удалось создать директорию для сохранения месячной копии.")
+        return False
+
+    return pin_snapshot("monthly", get_current_date())
+
 def create_additional_copy():
 
     today = date.today()
 
-    # Каждые 3 дня создаём дамп MySQL
-    if today.day % 3 == 0:
-        create_mysql_xtrabackup()
+    # Копия MySQL: ежедневно в режиме incremental, каждые 3 дня в режиме full
+    if is_xtrabackup_due():
+
+        # Подготовка копии к восстановлению (распаковка и --prepare)
+        if create_mysql_xtrabackup() and MYSQL_PREPARE_ENABLE:
+            prepare_mysql_xtrabackup()
     
     # Каждое воскресенье — недельный бэкап
     if today.weekday() == 6:
@@ -247,61 +669,72 @@ def create_additional_copy():
             mainLog.debug(f"[create_additional_copy] Создание месячной копии успешно завершено.")
 
 
-@log_execution
-def run_account_backup(account):
+#### PIPELINE ####
+# Этапы конвейера: имя -> (функция, нагружает раздел производственного сервера)
+PIPELINE_STAGES = {
+    "suspended": (run_rsync_suspended, False),
+    "pkgacct":   (run_pkgacct, True),
+    "move":      (move_pkgacct_with_hardlinks, False),
+    "mysql":     (run_account_db_backup, True),
+    "homedir":   (run_rsync_homedir, True),
+}
+
+
+def get_first_stage(account: CpanelAccount) -> str:
+    """ Если аккаунт приостановлен, то делаем копию предыдущего дня, иначе начинаем с pkgacct. """
+    return "suspended" if int(account.suspended) else "pkgacct"
+
+
+def get_next_stage(account: CpanelAccount, stage: str, success: bool):
+    """
+        Возвращает следующий этап конвейера для аккаунта или None, если обработка завершена.
+
+        - suspended: при ошибке (нет предыдущей копии) выполняется полное копирование.
+        - pkgacct: при ошибке перенос пропускается, домашняя директория синхронизируется в любом случае.
+        - mysql: выполняется после переноса pkgacct только при ACCOUNT_DB_BACKUP_ENABLE. pkgacct в этом режиме
+          запускается с --skipmysql, поэтому при его ошибке базы данных копируются этапом mysql
+          (этап не зависит от результата pkgacct).
+    """
+    if stage == "suspended":
+        return None if success else "pkgacct"
+
+    if stage == "pkgacct":
+        if success:
+            return "move"
+
+        return "mysql" if ACCOUNT_DB_BACKUP_ENABLE else "homedir"
+
+    if stage == "move":
+        return "mysql" if ACCOUNT_DB_BACKUP_ENABLE else "homedir"
+
+    if stage == "mysql":
+        return "homedir"
+
+    return None
+
+
+def run_account_stage(account: CpanelAccount, stage: str, channel=None):
+    """
+        Выполняет один этап конвейера для аккаунта в отдельном процессе.
+        Результат передаётся через код завершения процесса: 0 — успех, 1 — ошибка,
+        и записывается в журнал запуска для возобновления после сбоя.
+        Метрики этапов (track_stage) передаются планировщику через channel (StageResultChannel).
+    """
+    func = PIPELINE_STAGES[stage][0]
+    success = False
+
+    if channel:
+        set_result_channel(channel)
+
+    journal_record(account.user, stage, JOURNAL_STARTED)
+
     try:
-        ## Если аккаунт приостановлен, то делаем копию предущего дня
-        if int(account.suspended) and run_rsync_suspended(account):
-            return True
-
-        ## PKGACCT STAGE ##
-        if run_pkgacct(account):
-            move_pkgacct_with_hardlinks(account)
-        ## PKGACCT END ##
-
-        ## HOMEDIR STAGE ##
-        run_rsync_homedir(account)
-        ## HOMEDIR END ##
-    
+        success = bool(func(account))
+
     except Exception as exc:
-        mainLog.error(f"[run_account_backup][EXCEPTION] {exc.args}")
-        send_telegram_message(f"[run_account_backup] {exc.args}")
-
-
-def processing_account_data(accounts_data, shared_report_dict):
-    proc_count = []
-    current = 0
-    total = len(accounts_data)
-
-    for account in accounts_data:
-        user_obj = accounts_data[account][0]
-        current += 1
-
-        user = user_obj.user
-        partition = user_obj.partition
-
-        # Ограничение по числу процессов
-        while len(proc_count) >= 2:
-            for proc, start_time in proc_count[:]:
-                if not proc.is_alive():
-                    shared_report_dict[proc.name] = timedelta(seconds=int((datetime.now() - start_time).total_seconds()))
-                    proc_count.remove((proc, start_time))
-                    proc.join()
-                    break
-
-            sleep(0.5)
-
-        mainLog.info(f"[{current}/{total}] [{partition}] Обработка аккаунта: {user}")
-
-        proc = Process(target=run_account_backup, args=(user_obj,), name=user)
-        proc_count.append((proc, datetime.now()))
-        proc.start()
-
-    # Ожидание завершения оставшихся потоков
-    while len(proc_count) > 0: 
-        for proc, start_time in proc_count:
-            if not proc.is_alive():
-                shared_report_dict[proc.name] = timedelta(seconds=int((datetime.now() - start_time).total_seconds()))
-                proc_count.remove((proc, start_time))
-                proc.join()
-                break
\ No newline at end of file
+        mainLog.error(f"[run_account_stage] [{account.user}] [{stage}][EXCEPTION] {exc.args}")
+        send_telegram_message(f"[run_account_stage] [{account.user}] [{stage}] {exc.args}")
+
+    journal_record(account.user, stage, JOURNAL_DONE if success else JOURNAL_FAILED)
+
+    sys.exit(0 if success else 1)
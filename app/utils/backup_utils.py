@@ -1,7 +1,8 @@
 import os
+import shutil
 import tarfile
 
-from config.const import LOCAL_DIST
+from config.const import LOCAL_DIST, ARCHIVE_FORMAT, ARCHIVE_COMPRESS_LEVEL, ARCHIVE_THREADS_PER_JOB
 from utils.log import mainLog
 from notify.tg import send_telegram_message
 from utils.local_exec import run_local_command
@@ -29,29 +30,55 @@ def get_last_date_path(account: CpanelAccount = None, specific_dir: str = None)
             return preview_path
 
 
-def create_tar_gz_archive(source_dir: str, archive_path: str) -> bool:
+def get_archive_compressor(archive_format: str, threads: int) -> str:
     """
-    Создаёт tar.gz архив из содержимого source_dir и сохраняет его в archive_path
-    с помощью внешнего tar --ignore-failed-read.
+    Команда многопоточного сжатия для tar --use-compress-program.
+
+    :param archive_format: Формат архива: 'gz' (pigz, при отсутствии — gzip) или 'zst' (zstd -T).
+    :param threads: Количество потоков сжатия.
+    """
+    if archive_format == "zst":
+        return f"zstd -T{threads} -{ARCHIVE_COMPRESS_LEVEL}"
+
+    if shutil.which("pigz"):
+        return f"pigz -p {threads} -{ARCHIVE_COMPRESS_LEVEL}"
+
+    mainLog.warning("[get_archive_compressor] pigz не найден, архив сжимается однопоточным gzip.")
+    return f"gzip -{ARCHIVE_COMPRESS_LEVEL}"
+
+
+def create_tar_archive(source_dir: str, archive_path: str, archive_format: str = ARCHIVE_FORMAT, threads: int = ARCHIVE_THREADS_PER_JOB) -> bool:
+    """
+    Создаёт tar архив из содержимого source_dir с многопоточным сжатием и сохраняет его в archive_path
+    с помощью внешнего tar --ignore-failed-read. Архив пишется во временный файл и переименовывается
+    после успешного завершения.
 
     :param source_dir: Путь к директории, содержимое которой нужно архивировать.
-    :param archive_path: Путь к создаваемому архиву (.tar.gz).
+    :param archive_path: Путь к создаваемому архиву (расширение — ARCHIVE_EXTENSIONS[archive_format]).
+    :param archive_format: Формат архива: 'gz' или 'zst'.
+    :param threads: Количество потоков сжатия.
     :return: True при успехе, False при ошибке.
     """
     if not os.path.isdir(source_dir):
-        mainLog.error(f"[create_tar_gz_archive] Ошибка: директория {source_dir} не существует")
-        send_telegram_message(f"[create_tar_gz_archive] Ошибка: директория {source_dir} не существует")
+        mainLog.error(f"[create_tar_archive] Ошибка: директория {source_dir} не существует")
+        send_telegram_message(f"[create_tar_archive] Ошибка: директория {source_dir} не существует")
         return False
 
     parent_dir = os.path.dirname(source_dir)
     base_name = os.path.basename(source_dir)
-    cmd = f"tar czf {archive_path} --ignore-failed-read -C {parent_dir} {base_name}"
+    compressor = get_archive_compressor(archive_format, threads)
+    cmd = f"tar cf {archive_path}.tmp --use-compress-program='{compressor}' --ignore-failed-read -C {parent_dir} {base_name}"
 
-    result = run_local_command(cmd)
+    result = run_local_command(cmd, 36000)
 
     if not result["success"]:
-        mainLog.error(f"[create_tar_gz_archive] Ошибка при создании архива {archive_path} из {source_dir}: {result['stderr']}")
-        send_telegram_message(f"[create_tar_gz_archive] Ошибка при создании архива {archive_path} из {source_dir}")
+        mainLog.error(f"[create_tar_archive] Ошибка при создании архива {archive_path} из {source_dir}: {result['stderr']}")
+        send_telegram_message(f"[create_tar_archive] Ошибка при создании архива {archive_path} из {source_dir}")
+
+        if os.path.exists(f"{archive_path}.tmp"):
+            os.remove(f"{archive_path}.tmp")
+
         return False
 
-    return True
\ No newline at end of file
+    os.replace(f"{archive_path}.tmp", archive_path)
+    return True
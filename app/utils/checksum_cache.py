@@ -0,0 +1,151 @@
+import os
+import sqlite3
+import hashlib
+
+from utils.log import mainLog
+from utils.fs_utils import get_base_dir
+from utils.date_utils import get_current_date, get_sub_day_date
+
+# Размер блока чтения при хешировании
+HASH_BLOCK_SIZE = 1024 * 1024
+# Количество накопленных записей кеша, после которого они записываются в базу
+FLUSH_ROWS = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checksums (
+    dev       INTEGER NOT NULL,
+    ino       INTEGER NOT NULL,
+    size      INTEGER NOT NULL,
+    mtime_ns  INTEGER NOT NULL,
+    digest    BLOB    NOT NULL,
+    last_used TEXT    NOT NULL,
+    PRIMARY KEY (dev, ino, size, mtime_ns)
+);
+"""
+
+
+def new_hasher():
+    return hashlib.blake2b(digest_size=20)
+
+
+def hash_file(path: str) -> bytes:
+    hasher = new_hasher()
+
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+
+            if not block:
+                break
+
+            hasher.update(block)
+
+    return hasher.digest()
+
+
+def get_checksum_cache_path() -> str:
+    return f"{get_base_dir()}/logs/checksums.sqlite"
+
+
+class ChecksumCache:
+    """
+        Постоянный кеш контрольных сумм файлов LOCAL_DIST.
+
+        Ключ — (st_dev, st_ino, st_size, st_mtime_ns): файлы резервных копий не изменяются на месте,
+        а hardlink'и сегодняшней копии указывают на те же inode, что и вчерашней, поэтому
+        сумма, посчитанная один раз, используется во всех следующих запусках.
+
+        Кеш открывается в режиме autocommit: новые суммы и отметки использования накапливаются
+        в памяти и записываются короткой транзакцией каждые FLUSH_ROWS записей и при close(),
+        поэтому параллельные этапы не ожидают блокировку базы всё время синхронизации.
+    """
+
+    def __init__(self):
+        self.conn = sqlite3.connect(get_checksum_cache_path(), timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.today = get_current_date()
+        self.hits = 0
+        self.misses = 0
+        # Несохранённые суммы {ключ: digest} и ключи, использованные в этом запуске
+        self.pending = {}
+        self.used = set()
+
+    @staticmethod
+    def get_key(st: os.stat_result) -> tuple:
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def get(self, st: os.stat_result):
+        key = self.get_key(st)
+
+        if key in self.pending:
+            return self.pending[key]
+
+        row = self.conn.execute("SELECT digest FROM checksums WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?", key).fetchone()
+
+        if row:
+            self.used.add(key)
+
+            if len(self.used) >= FLUSH_ROWS:
+                self.flush()
+
+        return row[0] if row else None
+
+    def put(self, st: os.stat_result, digest: bytes) -> None:
+        self.pending[self.get_key(st)] = digest
+
+        if len(self.pending) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self) -> None:
+        """ Записывает накопленные суммы и отметки использования одной транзакцией. """
+        if not self.pending and not self.used:
+            return
+
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+
+            try:
+                self.conn.executemany("INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?)",
+                                      [key + (digest, self.today) for key, digest in self.pending.items()])
+                self.conn.executemany("UPDATE checksums SET last_used = ? WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?",
+                                      [(self.today,) + key for key in self.used])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        except sqlite3.Error as exc:
+            # Кеш только ускоряет сравнение: несохранённые суммы будут посчитаны заново в следующем запуске
+            mainLog.warning(f"[ChecksumCache] Не удалось сохранить записи кеша ({len(self.pending)} сумм, {len(self.used)} отметок): {exc.args}")
+
+        self.pending.clear()
+        self.used.clear()
+
+    def get_digest(self, path: str, st: os.stat_result) -> bytes:
+        """ Возвращает контрольную сумму файла из кеша, при отсутствии считает и сохраняет её. """
+        digest = self.get(st)
+
+        if digest is not None:
+            self.hits += 1
+            return digest
+
+        self.misses += 1
+        digest = hash_file(path)
+        self.put(st, digest)
+        return digest
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
+
+
+def prune_checksum_cache(days: int = 30) -> None:
+    """ Удаляет из кеша записи, которые не использовались указанное количество дней. """
+    try:
+        cache = ChecksumCache()
+        removed = cache.conn.execute("DELETE FROM checksums WHERE last_used < ?", (get_sub_day_date(days),)).rowcount
+        cache.close()
+        mainLog.info(f"[prune_checksum_cache] Удалено устаревших записей: {removed}")
+    except Exception as exc:
+        mainLog.error(f"[prune_checksum_cache] {exc.args}")
@@ -2,6 +2,7 @@ import shutil
 
 from utils.log import mainLog
 from notify.tg import send_telegram_message
+from retention.capacity import get_admission, ADMISSION_ABORT, ADMISSION_PRE_CLEAN
 
 from config.const import LOCAL_DIST
 
@@ -14,7 +15,14 @@ def sizeof_fmt(num, suffix='B'):
     return "%.1f%s%s" % (num, 'Yi', suffix)
 
 
-def check_free_space():
+def check_free_space(allow_pre_clean: bool = True) -> dict:
+    """
+    Проверяет свободное место с учётом прогноза прироста данных запуска (retention/capacity.py).
+    При решении abort завершает выполнение.
+
+    :param allow_pre_clean: Разрешить решение pre-clean (очистка устаревших копий перед запуском).
+    :return: Результат get_admission: {decision, free, need, forecast, reclaimable}.
+    """
     disk_info = shutil.disk_usage(LOCAL_DIST)
 
     total = disk_info[0]
@@ -24,14 +32,30 @@ def check_free_space():
     used_perc = round(100 * used / total)
     free_perc = round(100 * free / total)
 
-    if(free_perc < 6):
+    admission = get_admission(allow_pre_clean)
+
+    forecast = sizeof_fmt(admission['forecast']) if admission['forecast'] is not None else "нет истории"
+    reclaimable = sizeof_fmt(admission['reclaimable']) if admission['reclaimable'] is not None else "-"
+    details = f"Прогноз прироста: {forecast}. Требуется: {sizeof_fmt(admission['need'])}. Освободит очистка: {reclaimable}"
 
-        mainLog.error("[check_free_space] Недостаточно свободного места: \nВсего: {0:>20} [100%] \nИспользовано: {1:>13} [{3}%] \nСвободно: {2:>17} [{4}%]".format
-                      (sizeof_fmt(total), sizeof_fmt(used), sizeof_fmt(free), used_perc, free_perc))
+    if admission['decision'] == ADMISSION_ABORT:
+
+        mainLog.error("[check_free_space] Недостаточно свободного места: \nВсего: {0:>20} [100%] \nИспользовано: {1:>13} [{3}%] \nСвободно: {2:>17} [{4}%] \n{5}".format
+                      (sizeof_fmt(total), sizeof_fmt(used), sizeof_fmt(free), used_perc, free_perc, details))
         
-        send_telegram_message(f"[check_free_space] Недостаточно свободного места для проведения резервного копирования: Свободно: {sizeof_fmt(free)}")
+        send_telegram_message(f"[check_free_space] Недостаточно свободного места для проведения резервного копирования: Свободно: {sizeof_fmt(free)}. {details}")
 
         exit()
+
+    elif admission['decision'] == ADMISSION_PRE_CLEAN:
+
+        mainLog.warning("[check_free_space] Места недостаточно до очистки устаревших копий: \nВсего: {0:>20} [100%] \nИспользовано: {1:>13} [{3}%] \nСвободно: {2:>17} [{4}%] \n{5}".format
+                        (sizeof_fmt(total), sizeof_fmt(used), sizeof_fmt(free), used_perc, free_perc, details))
+
+        send_telegram_message(f"[check_free_space] Очистка устаревших копий перед запуском: Свободно: {sizeof_fmt(free)}. {details}")
+
     else:
-        mainLog.info("[check_free_space] Проверка наличия свободного места завершена успешно: \nВсего: {0:>20} [100%] \nИспользовано: {1:>13} [{3}%] \nСвободно: {2:>17} [{4}%]".format
-                     (sizeof_fmt(total), sizeof_fmt(used), sizeof_fmt(free), used_perc, free_perc))
\ No newline at end of file
+        mainLog.info("[check_free_space] Проверка наличия свободного места завершена успешно: \nВсего: {0:>20} [100%] \nИспользовано: {1:>13} [{3}%] \nСвободно: {2:>17} [{4}%] \n{5}".format
+                     (sizeof_fmt(total), sizeof_fmt(used), sizeof_fmt(free), used_perc, free_perc, details))
+
+    return admission
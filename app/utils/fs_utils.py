@@ -111,4 +111,24 @@ def get_list_files(path: str, extension: str = None) -> list:
     return []
 
 def get_base_dir() -> Path:
-    return Path(sys.argv[0]).resolve().parent.parent
\ No newline at end of file
+    return Path(sys.argv[0]).resolve().parent.parent
+
+def get_tree_size(path: str) -> tuple:
+    """
+    Подсчитывает размер и количество файлов в директории (рекурсивно, без перехода по ссылкам).
+
+    :param path: путь к директории
+    :return: (размер в байтах, количество файлов)
+    """
+    total_bytes = 0
+    total_files = 0
+
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total_bytes += os.lstat(os.path.join(root, name)).st_size
+                total_files += 1
+            except OSError:
+                pass
+
+    return total_bytes, total_files
@@ -0,0 +1,211 @@
+import os
+import stat
+import errno
+import fcntl
+import shutil
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+from utils.log import mainLog
+from utils.link_dest import remove_path
+
+from config.const import CLONE_WORKERS, CLONE_BATCH_SIZE, CLONE_REFLINK
+
+# ioctl FICLONE (linux/fs.h): копия файла с общими блоками данных (btrfs, xfs с reflink=1)
+FICLONE = 0x40049409
+
+
+def reflink_file(src: str, dst: str, st: os.stat_result) -> bool:
+    """ Создаёт reflink-копию файла. False, если файловая система не поддерживает reflink. """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError as exc:
+            if exc.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL):
+                fdst.close()
+                os.remove(dst)
+                return False
+            raise
+
+    apply_entry_metadata(dst, st)
+    return True
+
+
+def apply_entry_metadata(path: str, st: os.stat_result) -> None:
+    """ Переносит владельца, права и время изменения, для символических ссылок — без перехода по ссылке. """
+    is_link = stat.S_ISLNK(st.st_mode)
+
+    if os.geteuid() == 0:
+        os.chown(path, st.st_uid, st.st_gid, follow_symlinks=False)
+
+    if not is_link:
+        os.chmod(path, stat.S_IMODE(st.st_mode))
+
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns), follow_symlinks=not is_link)
+
+
+class HardlinkClone:
+    """
+        Копия дерева директорий из hardlink'ов на файлы источника (аналог cp -al / rsync --link-dest
+        без сравнения файлов).
+
+        - Директории обходятся параллельно (CLONE_WORKERS потоков), каждая директория — одна задача,
+          крупные директории делятся на пакеты по CLONE_BATCH_SIZE записей.
+        - Файлы связываются os.link, при достижении лимита ссылок на inode — копируются.
+          При CLONE_REFLINK и поддержке файловой системой создаются reflink-копии (отдельные inode
+          с общими блоками данных).
+        - Символические ссылки, FIFO, сокеты и устройства создаются заново, права, владелец и время
+          директорий и ссылок переносятся (время директорий — после заполнения).
+        - Верхнеуровневые имена из exclude не копируются и не удаляются в dest; остальное
+          содержимое существующей dest заменяется.
+    """
+
+    def __init__(self, src: str, dest: str, exclude: tuple = (), workers: int = CLONE_WORKERS, reflink: bool = bool(CLONE_REFLINK)):
+        self.src = src.rstrip("/")
+        self.dest = dest.rstrip("/")
+        self.exclude = set(exclude)
+        self.workers = workers
+        self.reflink = reflink
+        self.dirs = []
+        self.lock = threading.Lock()
+        self.pending = []
+        self.stats = {"dirs": 0, "files": 0, "files_linked": 0, "files_reflinked": 0, "files_copied": 0, "symlinks": 0, "specials": 0, "specials_skipped": 0}
+
+    def count(self, key: str, value: int = 1) -> None:
+        with self.lock:
+            self.stats[key] += value
+
+    def prepare_dest(self) -> None:
+        """ Удаляет содержимое существующей dest, кроме исключённых имён. """
+        if not os.path.isdir(self.dest) or os.path.islink(self.dest):
+            if os.path.lexists(self.dest):
+                remove_path(self.dest)
+            os.makedirs(self.dest)
+            return
+
+        with os.scandir(self.dest) as it:
+            for entry in it:
+                if entry.name not in self.exclude:
+                    remove_path(entry.path)
+
+    def run(self) -> dict:
+        self.prepare_dest()
+        self.dirs.append(("", os.lstat(self.src)))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            self.executor = executor
+            self.submit(self.clone_dir, "")
+
+            # Задачи добавляются во время обхода, ожидаем до их исчерпания
+            while True:
+                with self.lock:
+                    futures, self.pending = self.pending, []
+
+                if not futures:
+                    break
+
+                done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+
+                for future in done:
+                    future.result()
+
+                with self.lock:
+                    self.pending += [future for future in futures if future not in done]
+
+        # Время директорий меняется при создании записей, поэтому метаданные переносятся в конце, от глубоких к корню
+        for rel, st in sorted(self.dirs, key=lambda item: item[0].count("/") + bool(item[0]), reverse=True):
+            apply_entry_metadata(f"{self.dest}/{rel}" if rel else self.dest, st)
+
+        self.stats["dirs"] = len(self.dirs)
+        return self.stats
+
+    def submit(self, func, *args) -> None:
+        future = self.executor.submit(func, *args)
+
+        with self.lock:
+            self.pending.append(future)
+
+    def clone_dir(self, rel: str) -> None:
+        src_dir = f"{self.src}/{rel}" if rel else self.src
+
+        with os.scandir(src_dir) as it:
+            entries = [entry for entry in it if rel or entry.name not in self.exclude]
+
+        batches = [entries[start:start + CLONE_BATCH_SIZE] for start in range(0, len(entries), CLONE_BATCH_SIZE)]
+
+        for batch in batches[1:]:
+            self.submit(self.clone_entries, rel, batch)
+
+        if batches:
+            self.clone_entries(rel, batches[0])
+
+    def clone_entries(self, rel: str, entries: list) -> None:
+        for entry in entries:
+            entry_rel = f"{rel}/{entry.name}" if rel else entry.name
+            dst = f"{self.dest}/{entry_rel}"
+
+            if entry.is_dir(follow_symlinks=False):
+                os.mkdir(dst)
+
+                with self.lock:
+                    self.dirs.append((entry_rel, entry.stat(follow_symlinks=False)))
+
+                self.submit(self.clone_dir, entry_rel)
+
+            elif entry.is_symlink():
+                os.symlink(os.readlink(entry.path), dst)
+                apply_entry_metadata(dst, entry.stat(follow_symlinks=False))
+                self.count("symlinks")
+
+            elif entry.is_file(follow_symlinks=False):
+                self.clone_file(entry, dst)
+                self.count("files")
+
+            else:
+                self.clone_special(entry, dst)
+
+    def clone_special(self, entry: os.DirEntry, dst: str) -> None:
+        """ FIFO, сокеты и устройства создаются заново (как rsync -D). Без прав на mknod запись пропускается. """
+        st = entry.stat(follow_symlinks=False)
+
+        try:
+            os.mknod(dst, st.st_mode, st.st_rdev)
+            apply_entry_metadata(dst, st)
+            self.count("specials")
+
+        except OSError as exc:
+            mainLog.warning(f"[HardlinkClone] Не удалось создать специальный файл {dst}: {exc}")
+            self.count("specials_skipped")
+
+    def clone_file(self, entry: os.DirEntry, dst: str) -> None:
+        if self.reflink:
+            if reflink_file(entry.path, dst, entry.stat(follow_symlinks=False)):
+                self.count("files_reflinked")
+                return
+
+            # Файловая система не поддерживает reflink, дальше используются hardlink'и
+            self.reflink = False
+            mainLog.debug(f"[HardlinkClone] reflink не поддерживается для {self.dest}, используются hardlink'и")
+
+        try:
+            os.link(entry.path, dst)
+            self.count("files_linked")
+
+        except OSError as exc:
+            if exc.errno != errno.EMLINK:
+                raise
+
+            shutil.copy2(entry.path, dst, follow_symlinks=False)
+            apply_entry_metadata(dst, entry.stat(follow_symlinks=False))
+            self.count("files_copied")
+
+
+def clone_tree(src: str, dest: str, exclude: tuple = ()) -> dict:
+    """
+    Выполняет HardlinkClone и возвращает статистику
+    {dirs, files, files_linked, files_reflinked, files_copied, symlinks, specials, specials_skipped}.
+    """
+    stats = HardlinkClone(src, dest, exclude).run()
+    mainLog.debug(f"[clone_tree] {src} -> {dest}: {stats}")
+    return stats
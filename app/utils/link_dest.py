@@ -0,0 +1,197 @@
+import os
+import stat
+import errno
+import shutil
+
+from utils.log import mainLog
+from utils.checksum_cache import ChecksumCache, new_hasher, hash_file, HASH_BLOCK_SIZE
+
+
+def copy_file_with_digest(src: str, dst: str, st: os.stat_result) -> bytes:
+    """
+    Копирует файл через временный файл в той же директории (атомарная замена) и
+    считает контрольную сумму содержимого за одно чтение.
+
+    :return: Контрольная сумма скопированного содержимого.
+    """
+    tmp = f"{os.path.dirname(dst)}/.{os.path.basename(dst)}.tmp"
+    hasher = new_hasher()
+
+    with open(src, "rb") as fsrc, open(tmp, "wb") as fdst:
+        while True:
+            block = fsrc.read(HASH_BLOCK_SIZE)
+
+            if not block:
+                break
+
+            hasher.update(block)
+            fdst.write(block)
+
+    apply_metadata(tmp, st)
+    os.replace(tmp, dst)
+
+    return hasher.digest()
+
+
+def apply_metadata(path: str, st: os.stat_result) -> None:
+    """ Переносит права, владельца и время изменения (аналог rsync -pgot). """
+    if os.geteuid() == 0:
+        os.chown(path, st.st_uid, st.st_gid, follow_symlinks=False)
+
+    os.chmod(path, stat.S_IMODE(st.st_mode))
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def link_file(src: str, dst: str) -> bool:
+    """ Атомарно заменяет dst hardlink'ом на src. False, если достигнут лимит ссылок на inode. """
+    tmp = f"{os.path.dirname(dst)}/.{os.path.basename(dst)}.tmp"
+
+    try:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+
+        os.link(src, tmp)
+        os.replace(tmp, dst)
+        return True
+
+    except OSError as exc:
+        if exc.errno == errno.EMLINK:
+            return False
+        raise
+
+
+def same_attributes(a: os.stat_result, b: os.stat_result) -> bool:
+    """ hardlink допустим только при совпадении размера, прав и владельца, иначе изменится предыдущая копия. """
+    return a.st_size == b.st_size and a.st_mode == b.st_mode and a.st_uid == b.st_uid and a.st_gid == b.st_gid
+
+
+def remove_path(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+class LinkDestSync:
+    """
+        Синхронизация директории src в dest с hardlink'ами неизменённых файлов из link_dest
+        (аналог rsync -rlpgo -c --delete --link-dest), без повторного хеширования link_dest.
+
+        - Файл с совпадающими атрибутами сравнивается по контрольной сумме: сумма src считается,
+          сумма link_dest берётся из ChecksumCache. При совпадении создаётся hardlink.
+        - Новое содержимое копируется (сумма считается при копировании и сохраняется в кеш для
+          следующего запуска) или, при link_new, связывается hardlink'ом с src (src должен
+          находиться на той же файловой системе и быть недоступен для записи извне).
+        - Файлы и директории dest, отсутствующие в src, удаляются; верхнеуровневые имена
+          из exclude не синхронизируются и не удаляются.
+    """
+
+    def __init__(self, src: str, dest: str, link_dest: str = None, exclude: tuple = (), link_new: bool = False):
+        self.src = src.rstrip("/")
+        self.dest = dest.rstrip("/")
+        self.link_dest = link_dest.rstrip("/") if link_dest and os.path.isdir(link_dest) else None
+        self.exclude = set(exclude)
+        self.link_new = link_new
+        self.cache = ChecksumCache()
+        self.stats = {"files": 0, "files_transferred": 0, "files_linked": 0, "bytes_received": 0}
+
+    def run(self) -> dict:
+        try:
+            self.sync_dir("")
+        finally:
+            self.cache.close()
+
+        self.stats.update(cache_hits=self.cache.hits, cache_misses=self.cache.misses)
+        return self.stats
+
+    def sync_dir(self, rel: str) -> None:
+        src_dir = f"{self.src}/{rel}" if rel else self.src
+        dest_dir = f"{self.dest}/{rel}" if rel else self.dest
+
+        src_st = os.lstat(src_dir)
+        os.makedirs(dest_dir, exist_ok=True)
+
+        names = set()
+
+        with os.scandir(src_dir) as it:
+            entries = list(it)
+
+        for entry in entries:
+            if not rel and entry.name in self.exclude:
+                continue
+
+            names.add(entry.name)
+            entry_rel = f"{rel}/{entry.name}" if rel else entry.name
+            dst = f"{self.dest}/{entry_rel}"
+
+            if entry.is_dir(follow_symlinks=False):
+                if os.path.lexists(dst) and not os.path.isdir(dst):
+                    remove_path(dst)
+                self.sync_dir(entry_rel)
+
+            elif entry.is_symlink():
+                target = os.readlink(entry.path)
+
+                if os.path.lexists(dst):
+                    if os.path.islink(dst) and os.readlink(dst) == target:
+                        continue
+                    remove_path(dst)
+
+                os.symlink(target, dst)
+
+            elif entry.is_file(follow_symlinks=False):
+                if os.path.isdir(dst) and not os.path.islink(dst):
+                    remove_path(dst)
+                self.sync_file(entry, entry_rel, dst)
+
+        # --delete
+        with os.scandir(dest_dir) as it:
+            for entry in it:
+                if entry.name in names or (not rel and entry.name in self.exclude):
+                    continue
+
+                remove_path(entry.path)
+
+        apply_metadata(dest_dir, src_st)
+
+    def sync_file(self, entry: os.DirEntry, rel: str, dst: str) -> None:
+        st = entry.stat(follow_symlinks=False)
+        self.stats["files"] += 1
+
+        digest = None
+
+        if self.link_dest:
+            link_path = f"{self.link_dest}/{rel}"
+
+            try:
+                link_st = os.lstat(link_path)
+            except FileNotFoundError:
+                link_st = None
+
+            if link_st and stat.S_ISREG(link_st.st_mode) and same_attributes(st, link_st):
+                digest = hash_file(entry.path)
+
+                if digest == self.cache.get_digest(link_path, link_st) and link_file(link_path, dst):
+                    self.stats["files_linked"] += 1
+                    return
+
+        self.stats["files_transferred"] += 1
+        self.stats["bytes_received"] += st.st_size
+
+        if self.link_new and link_file(entry.path, dst):
+            if digest is not None:
+                self.cache.put(os.lstat(dst), digest)
+            return
+
+        digest = copy_file_with_digest(entry.path, dst, st)
+        self.cache.put(os.lstat(dst), digest)
+
+
+def sync_with_link_dest(src: str, dest: str, link_dest: str = None, exclude: tuple = (), link_new: bool = False) -> dict:
+    """
+    Выполняет LinkDestSync и возвращает статистику
+    {files, files_transferred, files_linked, bytes_received, cache_hits, cache_misses}.
+    """
+    stats = LinkDestSync(src, dest, link_dest, exclude, link_new).run()
+    mainLog.debug(f"[sync_with_link_dest] {src} -> {dest}: {stats}")
+    return stats
@@ -1,8 +1,9 @@
 import subprocess
 
 from utils.log import mainLog
+from utils.stream_exec import run_streaming_command
 
-def run_local_command(command: str, timeout: int = 600, capture_output: bool = True):
+def run_local_command(command: str, timeout: int = 600, capture_output: bool = True, line_parsers: list = None):
     """
     Запускает локальную shell-команду.
 
@@ -10,6 +11,9 @@ def run_local_command(command: str, timeout: int = 600, capture_output: bool = T
     - command: строка команды (shell=True).
     - timeout: время ожидания в секундах.
     - capture_output: если True — возвращает вывод (stdout, stderr).
+    - line_parsers: функции, получающие строки stdout по мере выполнения (см. run_streaming_command).
+
+    Вывод читается потоково, возвращаются только последние COMMAND_OUTPUT_TAIL_LINES строк.
 
     Возвращает словарь:
     {
@@ -20,31 +24,18 @@ def run_local_command(command: str, timeout: int = 600, capture_output: bool = T
     }
     """
     try:
-        result = subprocess.run(
-            command,
-            shell=True,
-            stdout=subprocess.PIPE if capture_output else None,
-            stderr=subprocess.PIPE if capture_output else None,
-            text=True,
-            timeout=timeout,
-            check=False
-        )
-
-        success = (result.returncode == 0)
-        stdout = result.stdout if capture_output else ""
-        stderr = result.stderr if capture_output else ""
-
-        mainLog.debug(f"[run_local_command] Cmd: {command}, Return code: {result.returncode}, Success: {success}")
-        if not success:
-            mainLog.debug(f"[run_local_command] stdout: {stdout}")
-            mainLog.debug(f"[run_local_command] stderr: {stderr}")
-
-        return {
-            "success": success,
-            "stdout": stdout,
-            "stderr": stderr,
-            "returncode": result.returncode
-        }
+        if capture_output:
+            result = run_streaming_command(command, timeout, line_parsers, shell=True)
+        else:
+            completed = subprocess.run(command, shell=True, timeout=timeout, check=False)
+            result = {"success": completed.returncode == 0, "stdout": "", "stderr": "", "returncode": completed.returncode}
+
+        mainLog.debug(f"[run_local_command] Cmd: {command}, Return code: {result['returncode']}, Success: {result['success']}")
+        if not result['success']:
+            mainLog.debug(f"[run_local_command] stdout: {result['stdout']}")
+            mainLog.debug(f"[run_local_command] stderr: {result['stderr']}")
+
+        return result
 
     except subprocess.TimeoutExpired:
         mainLog.error(f"[run_local_command] Timeout expired for command: {command}")
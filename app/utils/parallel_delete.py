@@ -0,0 +1,252 @@
+import os
+import stat
+import errno
+import threading
+
+from time import monotonic, sleep
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+from utils.log import mainLog
+
+from config.const import DELETE_WORKERS, DELETE_BATCH_SIZE, DELETE_OPS_PER_SEC, DELETE_BYTES_PER_SEC
+
+# Интервал записи прогресса удаления в лог, секунд
+PROGRESS_INTERVAL = 60
+# Количество блокировок для файлов с несколькими hardlink'ами (по номеру inode)
+INODE_LOCKS = 64
+
+
+class TokenBucket:
+    """ Ограничение скорости: rate единиц в секунду, запас не более rate. rate = 0 — без ограничения. """
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, amount: int = 1) -> None:
+        if not self.rate:
+            return
+
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if delay:
+            sleep(delay)
+
+
+class DirNode:
+    """ Директория в процессе удаления: удаляется, когда обработаны все её пакеты записей и поддиректории. """
+
+    def __init__(self, path: str, parent=None):
+        self.path = path
+        self.parent = parent
+        self.remaining = 1
+
+
+class ParallelDelete:
+    """
+        Удаление деревьев директорий в несколько потоков (замена ionice rm -rf с повторным проходом find/chmod).
+
+        - Директории обходятся параллельно (DELETE_WORKERS потоков), крупные директории делятся
+          на пакеты по DELETE_BATCH_SIZE записей; директория удаляется после своего содержимого.
+        - Директориям без прав u+rwx права добавляются перед обходом, повторный проход не нужен.
+        - Символические ссылки удаляются как записи, переход по ним не выполняется (O_NOFOLLOW
+          при открытии директорий).
+        - Скорость ограничивается DELETE_OPS_PER_SEC операциями и DELETE_BYTES_PER_SEC
+          освобождаемыми байтами в секунду.
+        - Освобождённым считается место файлов, у которых удалена последняя ссылка на inode
+          (st_nlink == 1), файлы, связанные hardlink'ами с другими копиями, места не освобождают.
+        - Ошибки отдельных записей собираются в stats['errors'], удаление остального продолжается.
+    """
+
+    def __init__(self, paths: list, workers: int = DELETE_WORKERS, ops_per_sec: int = DELETE_OPS_PER_SEC, bytes_per_sec: int = DELETE_BYTES_PER_SEC):
+        self.paths = [path.rstrip("/") for path in paths]
+        self.workers = workers
+        self.ops = TokenBucket(ops_per_sec)
+        self.bandwidth = TokenBucket(bytes_per_sec)
+        self.lock = threading.Lock()
+        self.inode_locks = [threading.Lock() for _ in range(INODE_LOCKS)]
+        self.pending = []
+        self.errors = []
+        self.stats = {"dirs": 0, "files": 0, "symlinks": 0, "files_shared": 0, "bytes_freed": 0, "chmod": 0}
+
+    def count(self, key: str, value: int = 1) -> None:
+        with self.lock:
+            self.stats[key] += value
+
+    def error(self, path: str, exc: Exception) -> None:
+        with self.lock:
+            self.errors.append((path, exc))
+
+    def run(self) -> dict:
+        started = monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            self.executor = executor
+
+            for path in self.paths:
+                self.submit(self.delete_root, path)
+
+            last_progress = monotonic()
+
+            # Задачи добавляются во время обхода, ожидаем до их исчерпания
+            while True:
+                with self.lock:
+                    futures, self.pending = self.pending, []
+
+                if not futures:
+                    break
+
+                done, _ = wait(futures, timeout=PROGRESS_INTERVAL, return_when=FIRST_EXCEPTION)
+
+                for future in done:
+                    future.result()
+
+                with self.lock:
+                    self.pending += [future for future in futures if future not in done]
+
+                if monotonic() - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = monotonic()
+                    mainLog.info(f"[ParallelDelete] Прогресс: {self.stats}")
+
+        self.stats["errors"] = self.errors
+        self.stats["duration"] = round(monotonic() - started, 1)
+        return self.stats
+
+    def submit(self, func, *args) -> None:
+        future = self.executor.submit(func, *args)
+
+        with self.lock:
+            self.pending.append(future)
+
+    def delete_root(self, path: str) -> None:
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            return
+        except OSError as exc:
+            self.error(path, exc)
+            return
+
+        if stat.S_ISDIR(st.st_mode):
+            self.delete_dir(DirNode(path), st)
+        else:
+            self.unlink(path, st)
+
+    def delete_dir(self, node: DirNode, st: os.stat_result) -> None:
+        if stat.S_IMODE(st.st_mode) & 0o700 != 0o700:
+            try:
+                os.chmod(node.path, stat.S_IMODE(st.st_mode) | 0o700, follow_symlinks=False)
+                self.count("chmod")
+            except OSError as exc:
+                self.error(node.path, exc)
+
+        try:
+            fd = os.open(node.path, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW)
+
+            try:
+                with os.scandir(fd) as it:
+                    entries = [(entry.name, entry.stat(follow_symlinks=False)) for entry in it]
+            finally:
+                os.close(fd)
+
+        except OSError as exc:
+            self.error(node.path, exc)
+            entries = []
+
+        batches = [entries[start:start + DELETE_BATCH_SIZE] for start in range(0, len(entries), DELETE_BATCH_SIZE)]
+
+        with self.lock:
+            node.remaining += len(batches[1:])
+
+        for batch in batches[1:]:
+            self.submit(self.delete_entries, node, batch)
+
+        self.delete_entries(node, batches[0] if batches else [])
+
+    def delete_entries(self, node: DirNode, entries: list) -> None:
+        for name, st in entries:
+            path = f"{node.path}/{name}"
+
+            if stat.S_ISDIR(st.st_mode):
+                with self.lock:
+                    node.remaining += 1
+
+                self.submit(self.delete_dir, DirNode(path, node), st)
+            else:
+                self.unlink(path, st)
+
+        self.complete(node)
+
+    def unlink(self, path: str, st: os.stat_result) -> None:
+        size = st.st_blocks * 512
+        self.ops.take()
+
+        try:
+            if st.st_nlink > 1 and stat.S_ISREG(st.st_mode):
+                # Количество ссылок перечитывается под блокировкой inode: ссылки на тот же inode
+                # могут удаляться параллельно в других удаляемых копиях
+                with self.inode_locks[st.st_ino % INODE_LOCKS]:
+                    st = os.lstat(path)
+                    os.unlink(path)
+            else:
+                os.unlink(path)
+
+        except FileNotFoundError:
+            return
+        except OSError as exc:
+            self.error(path, exc)
+            return
+
+        if stat.S_ISLNK(st.st_mode):
+            self.count("symlinks")
+            return
+
+        self.count("files")
+
+        if st.st_nlink == 1:
+            self.bandwidth.take(size)
+            self.count("bytes_freed", size)
+        else:
+            self.count("files_shared")
+
+    def complete(self, node: DirNode) -> None:
+        """ Отмечает обработку части директории, удаляет директорию и её родителей, ставших пустыми. """
+        while node is not None:
+            with self.lock:
+                node.remaining -= 1
+
+                if node.remaining:
+                    return
+
+            self.ops.take()
+
+            try:
+                size = os.lstat(node.path).st_blocks * 512
+                os.rmdir(node.path)
+                self.count("dirs")
+                self.count("bytes_freed", size)
+
+            except OSError as exc:
+                # Не удалось удалить содержимое (ошибка уже записана), родительские директории сохраняются
+                if exc.errno != errno.ENOTEMPTY:
+                    self.error(node.path, exc)
+                return
+
+            node = node.parent
+
+
+def delete_paths(paths: list) -> dict:
+    """
+    Выполняет ParallelDelete и возвращает статистику
+    {dirs, files, symlinks, files_shared, bytes_freed, chmod, errors, duration}.
+    """
+    stats = ParallelDelete(paths).run()
+    mainLog.debug(f"[delete_paths] {len(paths)} путей: { {key: value for key, value in stats.items() if key != 'errors'} }")
+    return stats
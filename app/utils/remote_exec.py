@@ -1,10 +1,12 @@
 import subprocess
 
 from utils.log import mainLog
+from utils.ssh_pool import ssh_session
+from utils.stream_exec import run_streaming_command
 
 from config.const import REMOTE_SERVER, REMOTE_SSH_PORT
 
-def run_ssh_command_on_prod(command: str, timeout: int = 300):
+def run_ssh_command_on_prod(command: str, timeout: int = 300, line_parsers: list = None):
     """
     Запускает команду на удалённом сервере через SSH.
 
@@ -15,10 +17,10 @@ def run_ssh_command_on_prod(command: str, timeout: int = 300):
 
     Аргумент command должен быть строкой — команда, которую нужно выполнить.
     """
-    return run_ssh_command(REMOTE_SERVER, REMOTE_SSH_PORT, command, timeout)
+    return run_ssh_command(REMOTE_SERVER, REMOTE_SSH_PORT, command, timeout, line_parsers)
 
 
-def run_ssh_command(server: str, port: int, command: str, timeout: int = 300):
+def run_ssh_command(server: str, port: int, command: str, timeout: int = 300, line_parsers: list = None):
     """
     Запускает команду на удалённом сервере через SSH.
 
@@ -26,40 +28,25 @@ def run_ssh_command(server: str, port: int, command: str, timeout: int = 300):
     - 'success' (bool): True, если команда выполнилась успешно (код 0).
     - 'stdout' (str): стандартный вывод.
     - 'stderr' (str): стандартный поток ошибок.
+    - 'returncode' (int): код завершения ssh (-1 при таймауте или исключении).
 
     Аргумент command должен быть строкой — команда, которую нужно выполнить.
+    Вывод читается потоково (run_streaming_command): stdout/stderr содержат последние строки,
+    line_parsers получают строки stdout по мере выполнения.
     """
-    ssh_cmd = [
-        "ssh",
-        "-p", str(port),
-        server,
-        command
-    ]
-
     try:
-        result = subprocess.run(
-            ssh_cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            timeout=timeout,
-            check=False
-        )
-
-        success = (result.returncode == 0)
+        # Соединение берётся из пула постоянных master-соединений (utils/ssh_pool.py)
+        with ssh_session(server, port) as ssh:
+            result = run_streaming_command(ssh + [server, command], timeout, line_parsers)
 
-        mainLog.debug(f"[run_ssh_command] Server: {server}, Cmd: {command}, Return code: {result.returncode}")
+        mainLog.debug(f"[run_ssh_command] Server: {server}, Cmd: {command}, Return code: {result['returncode']}")
 
-        return {
-            "success": success,
-            "stdout": result.stdout,
-            "stderr": result.stderr
-        }
+        return result
 
     except subprocess.TimeoutExpired:
         mainLog.error(f"[run_ssh_command] Timeout expired for command: {command}")
-        return {"success": False, "stdout": "", "stderr": "Timeout expired"}
+        return {"success": False, "stdout": "", "stderr": "Timeout expired", "returncode": -1}
 
     except Exception as e:
         mainLog.error(f"[run_ssh_command] Exception: {e}")
-        return {"success": False, "stdout": "", "stderr": str(e)}
\ No newline at end of file
+        return {"success": False, "stdout": "", "stderr": str(e), "returncode": -1}
\ No newline at end of file
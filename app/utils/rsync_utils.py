@@ -0,0 +1,74 @@
+import re
+
+from time import monotonic
+
+from utils.log import mainLog
+
+# Строки вывода rsync --stats и ключи, под которыми значения попадают в результат
+RSYNC_STATS_PATTERNS = {
+    "files":             re.compile(r"^Number of files:\s+([\d,]+)"),
+    "files_transferred": re.compile(r"^Number of regular files transferred:\s+([\d,]+)"),
+    "bytes_sent":        re.compile(r"^Total bytes sent:\s+([\d,]+)"),
+    "bytes_received":    re.compile(r"^Total bytes received:\s+([\d,]+)"),
+}
+
+# Строка прогресса rsync --info=progress2: "  1,234,567  45%   12.34MB/s    0:01:23 (xfr#12, to-chk=0/100)"
+RSYNC_PROGRESS_PATTERN = re.compile(r"^\s*([\d,]+)\s+(\d+)%\s+(\S+/s)\s+(\S+)")
+
+# Как часто (в секундах) прогресс rsync попадает в лог
+RSYNC_PROGRESS_LOG_INTERVAL = 300
+
+
+class RsyncStatsParser:
+    """
+        Обработчик строк вывода rsync --stats для run_local_command(line_parsers=[...]).
+        После завершения команды значения доступны в stats.
+    """
+
+    def __init__(self):
+        self.stats = {}
+
+    def __call__(self, line: str) -> None:
+        line = line.strip()
+
+        for key, pattern in RSYNC_STATS_PATTERNS.items():
+            match = pattern.match(line)
+
+            if match:
+                self.stats[key] = int(match.group(1).replace(",", ""))
+
+
+class RsyncProgressLogger:
+    """
+        Обработчик строк вывода rsync --info=progress2.
+        Пишет прогресс передачи в лог не чаще RSYNC_PROGRESS_LOG_INTERVAL секунд.
+    """
+
+    def __init__(self, tag: str):
+        self.tag = tag
+        self.last_log = monotonic()
+
+    def __call__(self, line: str) -> None:
+        match = RSYNC_PROGRESS_PATTERN.match(line)
+
+        if not match or monotonic() - self.last_log < RSYNC_PROGRESS_LOG_INTERVAL:
+            return
+
+        self.last_log = monotonic()
+        transferred, percent, speed, eta = match.groups()
+        mainLog.info(f"{self.tag} Передано: {transferred} байт ({percent}%), скорость: {speed}, осталось: {eta}")
+
+
+def parse_rsync_stats(output: str) -> dict:
+    """
+    Разбирает вывод rsync --stats.
+
+    :param output: stdout rsync.
+    :return: Словарь с ключами files, files_transferred, bytes_sent, bytes_received (только найденные значения).
+    """
+    parser = RsyncStatsParser()
+
+    for line in (output or "").splitlines():
+        parser(line)
+
+    return parser.stats
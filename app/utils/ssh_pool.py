@@ -0,0 +1,157 @@
+import os
+import fcntl
+import shlex
+import subprocess
+
+from time import sleep, monotonic
+from contextlib import contextmanager
+
+from utils.log import mainLog
+
+from config.const import (
+    REMOTE_SERVER,
+    REMOTE_SSH_PORT,
+    SSH_CONTROL_DIR,
+    SSH_MASTER_COUNT,
+    SSH_MAX_SESSIONS,
+    SSH_CONTROL_PERSIST
+)
+
+# Как часто (в секундах) процесс повторно проверяет живость master-соединения перед использованием
+SSH_CHECK_INTERVAL = 30
+
+# Время последней успешной проверки master-соединения в текущем процессе: {control_path: monotonic}
+_checked = {}
+
+
+def get_control_path(server: str, port: int, slot: int) -> str:
+    # Длина пути unix-сокета ограничена ~108 символами, поэтому имя максимально короткое
+    host = server.split('@')[-1]
+    return f"{SSH_CONTROL_DIR}/{host}-{port}-{slot}"
+
+
+def get_control_cmd(port: int, control_path: str) -> list:
+    return ["ssh", "-p", str(port), "-o", f"ControlPath={control_path}"]
+
+
+def is_master_alive(server: str, port: int, control_path: str) -> bool:
+    result = subprocess.run(get_control_cmd(port, control_path) + ["-O", "check", server],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=30, check=False)
+    return result.returncode == 0
+
+
+def ensure_master(server: str, port: int, slot: int) -> str:
+    """
+    Проверяет master-соединение слота и при необходимости запускает его.
+
+    Запуск защищён блокировкой файла, чтобы несколько процессов не поднимали один слот одновременно.
+    Если master поднять не удалось, ssh-сессии слота подключаются напрямую (ControlMaster=no
+    при недоступном сокете выполняет обычное подключение).
+
+    :return: Путь к управляющему сокету.
+    """
+    control_path = get_control_path(server, port, slot)
+
+    last_check = _checked.get(control_path)
+
+    if last_check is not None and monotonic() - last_check < SSH_CHECK_INTERVAL:
+        return control_path
+
+    with open(f"{control_path}.master.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        try:
+            if not is_master_alive(server, port, control_path):
+                if os.path.exists(control_path):
+                    os.remove(control_path)
+
+                # -f переводит ssh в фон после аутентификации, вывод не перехватывается, чтобы не ждать закрытия pipe
+                cmd = get_control_cmd(port, control_path) + [
+                    "-o", "ControlMaster=yes", "-o", f"ControlPersist={SSH_CONTROL_PERSIST}", "-o", "ServerAliveInterval=30", "-f", "-N", server
+                ]
+                result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60, check=False)
+
+                if result.returncode == 0:
+                    mainLog.debug(f"[ensure_master] Запущено master-соединение {control_path}")
+                else:
+                    mainLog.warning(f"[ensure_master] Не удалось запустить master-соединение {control_path}, код: {result.returncode}")
+
+        except Exception as exc:
+            mainLog.warning(f"[ensure_master] {control_path} {exc.args}")
+
+        # Неудачная попытка тоже запоминается, чтобы до следующей проверки не ждать запуска master при каждом вызове
+        _checked[control_path] = monotonic()
+
+    return control_path
+
+
+def acquire_session(server: str, port: int):
+    """
+    Занимает свободную сессию в одном из SSH_MASTER_COUNT master-соединений.
+
+    Каждая сессия — блокировка отдельного файла, поэтому ограничение действует для всех процессов
+    и автоматически снимается при завершении (в том числе аварийном) процесса-владельца.
+
+    :return: (slot, открытый файл блокировки).
+    """
+    os.makedirs(SSH_CONTROL_DIR, mode=0o700, exist_ok=True)
+
+    host = server.split('@')[-1]
+    first_slot = os.getpid() % SSH_MASTER_COUNT
+    waited = False
+
+    while True:
+        for offset in range(SSH_MASTER_COUNT):
+            slot = (first_slot + offset) % SSH_MASTER_COUNT
+
+            for session in range(SSH_MAX_SESSIONS):
+                lock = open(f"{SSH_CONTROL_DIR}/{host}-{port}-{slot}.{session}.lock", "w")
+
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return slot, lock
+                except BlockingIOError:
+                    lock.close()
+
+        if not waited:
+            mainLog.debug(f"[acquire_session] Все {SSH_MASTER_COUNT * SSH_MAX_SESSIONS} ssh-сессий заняты, ожидаем.")
+            waited = True
+
+        sleep(0.2)
+
+
+@contextmanager
+def ssh_session(server: str = REMOTE_SERVER, port: int = REMOTE_SSH_PORT):
+    """
+    Контекстный менеджер ssh-сессии из пула постоянных master-соединений (ControlMaster).
+
+    Возвращает команду ssh без адреса сервера, например:
+        with ssh_session() as ssh:
+            subprocess.run(ssh + [REMOTE_SERVER, "uptime"])
+
+    Сессия считается занятой до выхода из контекста, поэтому внутри него должна выполняться
+    вся работа с соединением (включая потоковые команды rsync -e и xtrabackup).
+    """
+    slot, lock = acquire_session(server, port)
+
+    try:
+        control_path = ensure_master(server, port, slot)
+        yield get_control_cmd(port, control_path) + ["-o", "ControlMaster=no"]
+    finally:
+        lock.close()
+
+
+def get_ssh_transport(ssh: list) -> str:
+    """ Возвращает команду ssh строкой для rsync -e. """
+    return shlex.join(ssh)
+
+
+def close_ssh_pool(server: str = REMOTE_SERVER, port: int = REMOTE_SSH_PORT) -> None:
+    """ Завершает master-соединения пула. """
+    for slot in range(SSH_MASTER_COUNT):
+        control_path = get_control_path(server, port, slot)
+
+        if os.path.exists(control_path):
+            subprocess.run(get_control_cmd(port, control_path) + ["-O", "exit", server],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=30, check=False)
+            _checked.pop(control_path, None)
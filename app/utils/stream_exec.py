@@ -0,0 +1,100 @@
+import os
+import signal
+import threading
+import subprocess
+
+from time import monotonic
+from collections import deque
+
+from utils.log import mainLog
+
+from config.const import COMMAND_OUTPUT_TAIL_LINES
+
+# Ожидание дочитывания вывода после завершения команды, секунд. Дольше вывод может удерживать
+# только отсоединившийся потомок (ssh ControlMaster, фоновые процессы), его вывод не ожидается
+READER_JOIN_TIMEOUT = 30
+
+
+def read_stream(stream, tail: deque, line_parsers: list) -> None:
+    """
+    Читает поток построчно, сохраняя только последние строки в кольцевом буфере tail,
+    и передаёт каждую строку в обработчики line_parsers.
+    """
+    for line in stream:
+        line = line.rstrip("\n")
+        tail.append(line)
+
+        for parser in line_parsers:
+            try:
+                parser(line)
+            except Exception as exc:
+                mainLog.debug(f"[read_stream] Ошибка обработчика строки: {exc.args}")
+
+    stream.close()
+
+
+def run_streaming_command(command, timeout: int = 600, line_parsers: list = None, shell: bool = False, tail_lines: int = COMMAND_OUTPUT_TAIL_LINES) -> dict:
+    """
+    Запускает команду с потоковым чтением вывода.
+
+    В памяти хранятся только последние tail_lines строк stdout и stderr, поэтому объём вывода
+    (rsync, pkgacct) не влияет на потребление памяти. Строки stdout по мере поступления
+    передаются в обработчики line_parsers (прогресс, статистика). Символ \\r считается
+    концом строки, поэтому прогресс rsync --info=progress2 приходит без задержки.
+
+    При превышении timeout завершается вся группа процессов команды.
+
+    :param command: Строка (при shell=True) или список аргументов.
+    :param timeout: Время ожидания в секундах, может быть None.
+    :param line_parsers: Список функций, принимающих строку stdout.
+    :param shell: Выполнять command через shell.
+    :param tail_lines: Размер кольцевого буфера строк.
+    :return: Словарь {'success', 'stdout', 'stderr', 'returncode'}, stdout/stderr — последние строки вывода.
+    """
+    stdout_tail = deque(maxlen=tail_lines)
+    stderr_tail = deque(maxlen=tail_lines)
+
+    proc = subprocess.Popen(
+        command,
+        shell=shell,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors="replace",
+        start_new_session=True
+    )
+
+    readers = [
+        threading.Thread(target=read_stream, args=(proc.stdout, stdout_tail, line_parsers or []), daemon=True),
+        threading.Thread(target=read_stream, args=(proc.stderr, stderr_tail, []), daemon=True),
+    ]
+
+    for reader in readers:
+        reader.start()
+
+    try:
+        proc.wait(timeout=timeout)
+
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+
+        for reader in readers:
+            reader.join(5)
+
+        raise
+
+    deadline = monotonic() + READER_JOIN_TIMEOUT
+
+    for reader in readers:
+        reader.join(max(0, deadline - monotonic()))
+
+    if any(reader.is_alive() for reader in readers):
+        mainLog.warning(f"[run_streaming_command] Команда завершилась, но её вывод удерживается дочерним процессом, дальнейший вывод не читается: {command}")
+
+    return {
+        "success": proc.returncode == 0,
+        "stdout": "\n".join(stdout_tail),
+        "stderr": "\n".join(stderr_tail),
+        "returncode": proc.returncode
+    }
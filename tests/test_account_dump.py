@@ -0,0 +1,71 @@
+import shlex
+import subprocess
+
+import database.account_dump as account_dump
+
+from database.account_dump import AccountDatabaseDump, build_checksum_command, get_table_key, quote_identifier
+
+
+def test_quote_identifier_doubles_backticks():
+    assert quote_identifier("user_db") == "`user_db`"
+    assert quote_identifier("a`b") == "`a``b`"
+
+
+def test_build_checksum_command():
+    cmd = build_checksum_command("user_db", ["wp_posts", "wp_options"])
+
+    assert cmd == "/usr/bin/mysql -N -B -e 'CHECKSUM TABLE `user_db`.`wp_posts`, `user_db`.`wp_options`'"
+
+
+def test_build_checksum_command_is_not_expanded_by_shell():
+    cmd = build_checksum_command("user_db", ["$(touch x)", "it's"])
+    args = shlex.split(cmd)
+
+    assert args[-1] == "CHECKSUM TABLE `user_db`.`$(touch x)`, `user_db`.`it's`"
+
+    # Оболочка производственного сервера передаёт запрос mysql без изменений
+    printed = subprocess.run(["/bin/sh", "-c", cmd.replace("/usr/bin/mysql -N -B -e", "printf %s")], capture_output=True, text=True)
+    assert printed.stdout == args[-1]
+
+
+def get_fields(table: str, update_time: str) -> list:
+    return ["T", "user_db", table, "2024-01-01 00:00:00", update_time, "10", "16384", "0", "BASE TABLE"]
+
+
+def get_dump(tables: list, checksums: dict) -> AccountDatabaseDump:
+    dump = AccountDatabaseDump("user", "/nonexistent")
+    dump.previous_manifest = {
+        "mysqld_pid": "1234",
+        "tables": {"user_db": {fields[2]: {"key": get_table_key(fields), "checksum": checksums.get(fields[2])} for fields in tables}},
+    }
+    return dump
+
+
+def test_plan_without_update_time_always_checks_checksum(monkeypatch):
+    tables = [get_fields("same", ""), get_fields("updated", ""), get_fields("dated", "2024-02-01 00:00:00")]
+    dump = get_dump(tables, {"same": "1", "updated": "2"})
+    requested = []
+
+    def fetch(database, names):
+        requested.extend(names)
+        return {"same": "1", "updated": "3"}
+
+    monkeypatch.setattr(account_dump, "fetch_checksums", fetch)
+
+    entries, unchanged, changed = dump.plan(tables)
+
+    assert requested == ["same", "updated"]
+    assert unchanged == [("user_db", "dated"), ("user_db", "same")]
+    assert changed == [("user_db", "updated")]
+    assert entries["user_db"]["updated"]["checksum"] == "3"
+
+
+def test_plan_stores_checksum_of_new_table_without_update_time(monkeypatch):
+    dump = AccountDatabaseDump("user", "/nonexistent")
+    monkeypatch.setattr(account_dump, "fetch_checksums", lambda database, names: {"new": "5"})
+
+    entries, unchanged, changed = dump.plan([get_fields("new", "")])
+
+    assert unchanged == []
+    assert changed == [("user_db", "new")]
+    assert entries["user_db"]["new"]["checksum"] == "5"
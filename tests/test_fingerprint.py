@@ -0,0 +1,40 @@
+import remote.cpanel.fingerprint as fingerprint
+
+
+HOMES = {"user": "/home/user"}
+
+
+def get_lines(update_time: str) -> list:
+    return [
+        "F\t/var/cpanel/users/user\t100\t1700000000.0",
+        "P\t1234",
+        f"T\tuser_db\twp_posts\t2024-01-01 00:00:00\t{update_time}\t10\t16384\t0\tBASE TABLE",
+        "T\tuser_db\twp_view\t\t\t\t\t\tVIEW",
+    ]
+
+
+def test_fingerprint_with_update_time(monkeypatch):
+    monkeypatch.setattr(fingerprint, "ACCOUNT_DB_BACKUP_ENABLE", 0)
+
+    fingerprints, tables, mysqld_pid = fingerprint.parse_fingerprint_output(get_lines("2024-02-01 00:00:00"), HOMES)
+
+    assert "user" in fingerprints
+    assert len(tables["user"]) == 2
+    assert mysqld_pid == "1234"
+
+
+def test_no_fingerprint_without_update_time(monkeypatch):
+    monkeypatch.setattr(fingerprint, "ACCOUNT_DB_BACKUP_ENABLE", 0)
+
+    fingerprints, tables, _ = fingerprint.parse_fingerprint_output(get_lines(""), HOMES)
+
+    assert "user" not in fingerprints
+    assert len(tables["user"]) == 2
+
+
+def test_fingerprint_without_update_time_when_db_stage_enabled(monkeypatch):
+    monkeypatch.setattr(fingerprint, "ACCOUNT_DB_BACKUP_ENABLE", 1)
+
+    fingerprints, _, _ = fingerprint.parse_fingerprint_output(get_lines(""), HOMES)
+
+    assert "user" in fingerprints
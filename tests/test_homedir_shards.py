@@ -0,0 +1,37 @@
+import os
+
+from service.homedir_shards import get_local_homedir_tree
+
+
+def write_file(path: str, size: int) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+
+
+def test_get_local_homedir_tree(tmp_path):
+    root = str(tmp_path)
+    write_file(f"{root}/public_html/index.php", 10)
+    write_file(f"{root}/public_html/wp-content/uploads/a.jpg", 100)
+    write_file(f"{root}/mail/domain/info/cur/1", 5)
+    write_file(f"{root}/.bashrc", 1)
+    os.symlink("public_html", f"{root}/www")
+
+    tree = get_local_homedir_tree(root)
+
+    # Записи верхнего уровня, кроме директорий, не учитываются
+    assert set(tree) == {"public_html", "public_html/wp-content", "mail", "mail/domain"}
+    assert tree["public_html"] == [110, 4]
+    assert tree["public_html/wp-content"] == [100, 2]
+    assert tree["mail"] == [5, 4]
+    assert tree["mail/domain"] == [5, 3]
+
+
+def test_get_local_homedir_tree_skips_unsupported_names(tmp_path):
+    root = str(tmp_path)
+    write_file(f"{root}/bad\tname/sub/file", 7)
+
+    tree = get_local_homedir_tree(root)
+
+    assert tree == {}
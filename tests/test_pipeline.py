@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+
+import service.service as service
+
+
+ACCOUNT = SimpleNamespace(user="user", partition="home", suspended="0")
+
+
+def test_failed_pkgacct_goes_to_mysql_when_db_backup_enabled(monkeypatch):
+    monkeypatch.setattr(service, "ACCOUNT_DB_BACKUP_ENABLE", 1)
+
+    assert service.get_next_stage(ACCOUNT, "pkgacct", False) == "mysql"
+    assert service.get_next_stage(ACCOUNT, "mysql", False) == "homedir"
+
+
+def test_failed_pkgacct_goes_to_homedir_when_db_backup_disabled(monkeypatch):
+    monkeypatch.setattr(service, "ACCOUNT_DB_BACKUP_ENABLE", 0)
+
+    assert service.get_next_stage(ACCOUNT, "pkgacct", False) == "homedir"
+
+
+def test_successful_pkgacct_goes_to_move(monkeypatch):
+    monkeypatch.setattr(service, "ACCOUNT_DB_BACKUP_ENABLE", 1)
+
+    assert service.get_next_stage(ACCOUNT, "pkgacct", True) == "move"
+    assert service.get_next_stage(ACCOUNT, "move", True) == "mysql"
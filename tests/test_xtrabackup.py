@@ -0,0 +1,51 @@
+import os
+import json
+
+import database.xtrabackup as xtrabackup
+
+
+def make_copy(root: str, name: str, chain: dict = None, in_progress: bool = False) -> str:
+    path = f"{root}/{name}"
+    os.makedirs(path)
+
+    if chain:
+        with open(f"{path}/{xtrabackup.CHAIN_FILE}", "w") as f:
+            json.dump(chain, f)
+
+    if in_progress:
+        open(f"{path}/{xtrabackup.IN_PROGRESS_FILE}", "w").close()
+
+    return path
+
+
+def test_legacy_copies_are_not_incomplete(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    monkeypatch.setattr(xtrabackup, "MYSQL_DUMP_PATH", root)
+
+    make_copy(root, "2024-01-01")
+    make_copy(root, "2024-01-02", in_progress=True)
+    make_copy(root, "2024-01-03", chain={"type": "full", "base": None})
+
+    assert xtrabackup.get_incomplete_xtrabackups() == ["2024-01-02"]
+
+
+def test_nothing_is_deleted_without_complete_full(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    monkeypatch.setattr(xtrabackup, "MYSQL_DUMP_PATH", root)
+
+    legacy = make_copy(root, "2024-01-01")
+    failed = make_copy(root, "2024-01-02", in_progress=True)
+
+    assert xtrabackup.filter_xtrabackup_cleanup([legacy, failed]) == []
+
+
+def test_last_complete_full_and_its_incrementals_are_kept(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    monkeypatch.setattr(xtrabackup, "MYSQL_DUMP_PATH", root)
+
+    legacy = make_copy(root, "2024-01-01")
+    full = make_copy(root, "2024-01-02", chain={"type": "full", "base": None})
+    incremental = make_copy(root, "2024-01-03", chain={"type": "incremental", "base": "2024-01-02"})
+    failed = make_copy(root, "2024-01-04", in_progress=True)
+
+    assert xtrabackup.filter_xtrabackup_cleanup([legacy, full, incremental, failed]) == [legacy, failed]